@@ -1,10 +1,15 @@
 (global => {
-  let progressInterval = undefined
+  let progressSource = undefined
 
   let progressPanel = document.createElement("div")
   progressPanel.className = 'kubin-progress-panel'
   document.body.appendChild(progressPanel)
 
+  let progressText = document.createElement("span")
+  let progressPreview = document.createElement("img")
+  progressPanel.appendChild(progressPreview)
+  progressPanel.appendChild(progressText)
+
   kubin.UI.taskStarted = task => {
     let index = -1
     document.querySelectorAll(`.ui-tabs.left>.tab-nav button`).forEach((button, i) => button.textContent.includes(task) && (index = i + 1))
@@ -19,7 +24,7 @@
 
       document.head.appendChild(style)
       progressPanel.classList.add('active')
-      progressInterval = setInterval(kubin.UI.progress, 2000)
+      kubin.UI.progress()
     })()
   }
 
@@ -31,15 +36,24 @@
       style && style.parentNode.removeChild(style)
     })()
 
-    progressInterval && clearInterval(progressInterval)
+    progressSource && progressSource.close()
+    progressSource = undefined
     progressPanel.classList.remove('active')
   }
 
-  kubin.UI.progress = async () => {
-    const progressInfo = await kubin.requestApi('api/progress')
-    const taskInfo = progressInfo['data'][0]['progress']
+  kubin.UI.progress = () => {
+    progressSource && progressSource.close()
+    progressText.textContent = ''
+    progressPreview.removeAttribute('src')
+
+    progressSource = new EventSource(`${global.location.origin}/kubin/progress/${global._kubinSession}`)
+    progressSource.onmessage = message => {
+      const taskInfo = JSON.parse(message.data)
+      if (taskInfo.finished) return
 
-    progressPanel.textContent = JSON.stringify(taskInfo)
+      progressText.textContent = `${taskInfo.task} / ${taskInfo.stage}: ${taskInfo.step} of ${taskInfo.total_steps}`
+      taskInfo.preview && (progressPreview.src = taskInfo.preview)
+    }
   }
 
-})(window)
+})(window)
\ No newline at end of file
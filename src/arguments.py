@@ -1,8 +1,10 @@
 import argparse
 
 
-def parse_arguments():
-    parser = argparse.ArgumentParser(description="Run Kubin")
+def parse_arguments(parser=None):
+    if parser is None:
+        parser = argparse.ArgumentParser(description="Run Kubin")
+
     parser.add_argument("--from-config", type=str, default=None)
     parser.add_argument("--model-name", type=str, default=None)
     parser.add_argument("--device", type=str, default=None)
@@ -0,0 +1,214 @@
+"""
+Headless batch runner: executes a JSONL file of jobs without building the UI.
+
+Each line is ``{"task": "t2i" | "i2i" | "inpaint" | "t2v" | ..., "params": {...}}``
+where ``params`` is the dict the corresponding UI tab passes to the model.
+Image inputs are given as ``{"$image": "path/to/file.png"}`` and opened as PIL
+images before the job runs.
+
+    python src/batch.py jobs.jsonl [--report report.jsonl] [--keep-order] [--pipelined]
+
+With ``--pipelined``, consecutive jobs of one task and pipeline are handed to
+the model together; Kandinsky 5 text2video overlaps text encoding, denoising
+and decoding of neighbouring jobs, other models run them one by one.
+
+All regular command line arguments (``--model-name``, ``--device``, ...) are
+accepted as well.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from patches import patch
+
+patch(headless=True)
+
+from arguments import parse_arguments
+from env import Kubin
+from models.model_50.distributed import is_tp_worker, serve, stop_workers
+from utils.logging import k_error, k_log
+
+
+def resolve_images(value):
+    if isinstance(value, dict):
+        if set(value.keys()) == {"$image"}:
+            from PIL import Image
+
+            image = Image.open(value["$image"])
+            image.load()
+            return image
+        return {key: resolve_images(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_images(item) for item in value]
+    return value
+
+
+def load_jobs(path):
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            job = json.loads(line)
+            if "task" not in job or "params" not in job:
+                raise ValueError(f"job on line {line_number} needs 'task' and 'params'")
+
+            job["line"] = line_number
+            jobs.append(job)
+    return jobs
+
+
+def order_jobs(kubin, jobs):
+    # jobs sharing a pipeline run back to back, and within a pipeline jobs
+    # sharing a prompt follow each other to reuse cached embeddings
+    groups = {}
+    prompts = {}
+    for index, job in enumerate(jobs):
+        job["affinity"] = kubin.scheduler.affinity(job["task"], job["params"])
+        group = groups.setdefault(str(job["affinity"]), len(groups))
+        prompt_key = (group, job["params"].get("prompt", ""))
+        prompt = prompts.setdefault(prompt_key, len(prompts))
+        job["order"] = (group, prompt, index)
+
+    return sorted(jobs, key=lambda job: job["order"])
+
+
+def to_report_value(value):
+    if isinstance(value, (list, tuple)):
+        return [to_report_value(item) for item in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return repr(value)
+
+
+def group_jobs(kubin, jobs):
+    # consecutive jobs of one task and affinity form a group, so a model
+    # implementing ``<task>_many`` can overlap their stages
+    groups = []
+    for job in jobs:
+        affinity = job.get("affinity")
+        if affinity is None:
+            affinity = job["affinity"] = kubin.scheduler.affinity(
+                job["task"], job["params"]
+            )
+
+        previous = groups[-1][0] if groups else None
+        if (
+            previous is not None
+            and previous["task"] == job["task"]
+            and previous["affinity"] == affinity
+        ):
+            groups[-1].append(job)
+        else:
+            groups.append([job])
+    return groups
+
+
+def run_group(kubin, group, pipelined):
+    task = group[0]["task"]
+    params_list = [resolve_images(job["params"]) for job in group]
+    if pipelined and len(group) > 1:
+        yield from kubin.scheduler.run_many(task, params_list)
+        return
+
+    for params in params_list:
+        try:
+            yield kubin.scheduler.run(task, params), None
+        except Exception as e:
+            yield None, e
+
+
+def run_jobs(kubin, jobs, report_path, pipelined=False):
+    total_start = time.time()
+    failed = 0
+    groups = group_jobs(kubin, jobs) if pipelined else [[job] for job in jobs]
+
+    with open(report_path, "w", encoding="utf-8") as report:
+        position = 0
+        for group in groups:
+            if pipelined and len(group) > 1:
+                k_log(f"batch: running {len(group)} {group[0]['task']} jobs pipelined")
+
+            start = time.time()
+            outcomes = run_group(kubin, group, pipelined)
+            for job in group:
+                position += 1
+                task = job["task"]
+                k_log(f"batch job {position}/{len(jobs)} (line {job['line']}): {task}")
+
+                entry = {
+                    "line": job["line"],
+                    "task": task,
+                    "affinity": str(job.get("affinity")),
+                }
+                try:
+                    output, error = next(outcomes)
+                except StopIteration:
+                    output, error = None, RuntimeError("job was not run")
+                except Exception as e:
+                    # the whole group failed before producing this job
+                    output, error = None, e
+                    outcomes = iter(())
+
+                if error is None:
+                    entry["status"] = "ok"
+                    entry["output"] = to_report_value(output)
+                else:
+                    failed += 1
+                    entry["status"] = "error"
+                    entry["error"] = str(error)
+                    k_error(f"batch job on line {job['line']} failed: {error}")
+
+                # pipelined jobs overlap, each is timed from the end of the
+                # previous one
+                entry["seconds"] = round(time.time() - start, 3)
+                start = time.time()
+                report.write(json.dumps(entry) + "\n")
+                report.flush()
+
+    k_log(
+        f"batch finished: {len(jobs) - failed} succeeded, {failed} failed, {time.time() - total_start:.1f}s total, report written to {report_path}"
+    )
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Kubin batch jobs")
+    parser.add_argument("jobs", type=str)
+    parser.add_argument("--report", type=str, default=None)
+    parser.add_argument("--keep-order", action="store_true")
+    parser.add_argument("--pipelined", action="store_true")
+    parser.add_argument("--with-extensions", action="store_true")
+    args = parse_arguments(parser)
+
+    kubin = Kubin()
+    kubin.with_args(args)
+    kubin.with_envvars()
+    if is_tp_worker():
+        serve(kubin)
+        return
+
+    if args.with_extensions:
+        kubin.with_utils()
+        kubin.with_extensions()
+        kubin.with_hooks()
+    kubin.with_pipeline()
+
+    jobs = load_jobs(args.jobs)
+    if not args.keep_order:
+        jobs = order_jobs(kubin, jobs)
+
+    report_path = args.report or f"{os.path.splitext(args.jobs)[0]}.report.jsonl"
+    failed = run_jobs(kubin, jobs, report_path, pipelined=args.pipelined)
+
+    kubin.model.flush()
+    stop_workers()
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
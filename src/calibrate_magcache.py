@@ -0,0 +1,113 @@
+"""
+Calibrates MagCache for a Kandinsky 5 config: runs one full generation per
+resolution, length and step count with the calibration forward pass and stores
+the measured ratios as profiles (``models/model_50/magcache_profiles.py``),
+which later generations with MagCache pick up automatically.
+
+    python src/calibrate_magcache.py --config-name 5s_sft --sizes 512x512,512x768 --lengths 5 --steps 50
+
+``--sizes`` are ``HEIGHTxWIDTH``, ``--lengths`` in seconds. All regular command
+line arguments (``--device``, ``--cache-dir``, ...) are accepted as well; the
+profiles go to ``--cache-dir`` unless ``KD50_CACHE_DIR`` is set.
+"""
+
+import argparse
+import itertools
+import os
+import tempfile
+
+from patches import patch
+
+patch(headless=True)
+
+from arguments import parse_arguments
+from env import Kubin
+from models.model_50.distributed import is_tp_worker, serve, stop_workers
+from models.model_50.magcache_profiles import profile_store_path
+from utils.logging import k_error, k_log
+
+DEFAULT_PROMPT = "A cat in a red hat walks along a sunny beach, waves rolling in behind it, cinematic lighting"
+
+
+def parse_sizes(value):
+    sizes = []
+    for size in value.split(","):
+        height, width = size.lower().split("x")
+        sizes.append((int(height), int(width)))
+    return sizes
+
+
+def parse_ints(value):
+    return [int(item) for item in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate Kandinsky 5 MagCache")
+    parser.add_argument("--config-name", type=str, default="5s_sft")
+    parser.add_argument("--sizes", type=str, default="512x512")
+    parser.add_argument("--lengths", type=str, default="5")
+    parser.add_argument("--steps", type=str, default=None)
+    parser.add_argument("--guidance-weight", type=float, default=None)
+    parser.add_argument("--prompt", type=str, default=DEFAULT_PROMPT)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parse_arguments(parser)
+
+    # read by generation_utils.prepare_magcache on every rank
+    os.environ["MAGCACHE_CALIBRATE"] = "1"
+    if args.model_name is None:
+        args.model_name = "kd50"
+    if args.pipeline is None:
+        args.pipeline = "native"
+
+    kubin = Kubin()
+    kubin.with_args(args)
+    kubin.with_envvars()
+    if is_tp_worker():
+        serve(kubin)
+        return
+
+    kubin.with_pipeline()
+
+    sizes = parse_sizes(args.sizes)
+    lengths = parse_ints(args.lengths)
+    steps = parse_ints(args.steps) if args.steps else [None]
+    sweep = list(itertools.product(sizes, lengths, steps))
+
+    failed = 0
+    with tempfile.TemporaryDirectory() as output_dir:
+        for index, ((height, width), length, num_steps) in enumerate(sweep, start=1):
+            k_log(
+                f"magcache calibration {index}/{len(sweep)}: {height}x{width}, {length}s, {num_steps or 'default'} steps"
+            )
+            params = {
+                "prompt": args.prompt,
+                "time_length": length,
+                "width": width,
+                "height": height,
+                "seed": args.seed,
+                "num_steps": num_steps,
+                "guidance_weight": args.guidance_weight,
+                "expand_prompts": False,
+                "magcache": True,
+                "pipeline_args": {"config_name": args.config_name},
+                ".output_dir": output_dir,
+            }
+            try:
+                kubin.scheduler.run("t2v", params)
+            except Exception as e:
+                failed += 1
+                k_error(
+                    f"magcache calibration of {height}x{width}, {length}s failed: {e}"
+                )
+
+    kubin.model.flush()
+    stop_workers()
+
+    k_log(
+        f"magcache calibration finished: {len(sweep) - failed} profiles written to {profile_store_path()}, {failed} failed"
+    )
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -45,6 +45,16 @@ class Kubin:
         if self.model is not None:
             self.model.flush()
 
+        if getattr(self, "scheduler", None) is None:
+            from scheduler import JobScheduler
+
+            self.scheduler = JobScheduler(
+                self,
+                max_wait=self.params("general", "scheduler_max_wait"),
+                max_skips=self.params("general", "scheduler_max_skips"),
+            )
+        self.scheduler.loaded_affinity = None
+
         if use_mock:
             from models.model_mock import Model_Mock
 
@@ -4,6 +4,8 @@ patch()
 
 from arguments import parse_arguments
 from env import Kubin
+from models.model_50.distributed import is_tp_worker, serve
+from progress import register_progress_stream
 from utils.platform import is_windows
 from web_gui import gradio_ui
 from pathlib import Path
@@ -44,6 +46,12 @@ def reload_app(ui, kubin):
         None
 
 
+def serve_tp_rank(kubin: Kubin):
+    kubin.with_args(args)
+    kubin.with_envvars()
+    serve(kubin)
+
+
 def start(kubin, ui):
     if ui is not None:
         reload_app(ui, kubin)
@@ -65,5 +73,10 @@ def start(kubin, ui):
         allowed_paths=[f"{Path(__file__).parent.parent.absolute()}/client"] + resources,
     )
 
+    register_progress_stream(app)
+
 
-start(kubin, None)
+if is_tp_worker():
+    serve_tp_rank(kubin)
+else:
+    start(kubin, None)
@@ -25,6 +25,7 @@ from models.model_30.kandinsky3.t2i_pipeline import Kandinsky3T2IPipeline
 from models.model_30.kandinsky3.inpainting_pipeline import Kandinsky3InpaintingPipeline
 from models.model_30.kandinsky3.utils import release_vram
 from models.model_30.model_kd30_env import Model_KD3_Environment
+from utils.nn import load_checkpoint_entries
 
 
 @no_type_check
@@ -119,10 +120,12 @@ def get_inpainting_unet(
 def get_T2I_nullemb_projections(
     weights_path: Optional[str] = None,
 ) -> (torch.Tensor, dict):
-    state_dict = torch.load(weights_path, map_location=torch.device("cpu"))
+    entries = load_checkpoint_entries(
+        weights_path, ["null_embedding", "projections"], sidecar_tag="nullemb"
+    )
 
-    projections_state_dict = state_dict["projections"]
-    null_embedding = state_dict["null_embedding"]
+    projections_state_dict = entries["projections"]
+    null_embedding = entries["null_embedding"]
 
     return null_embedding, projections_state_dict
 
@@ -231,6 +231,7 @@ class Kandinsky3InpaintingOptimizedPipeline:
                         negative_context_mask=bs_negative_context_mask,
                         mask=mask,
                         masked_latent=masked_latent,
+                        task="inpainting",
                     )
 
                     vram_info("used unet")
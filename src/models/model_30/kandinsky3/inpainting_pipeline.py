@@ -205,6 +205,7 @@ class Kandinsky3InpaintingPipeline:
                         negative_context_mask=bs_negative_context_mask,
                         mask=mask,
                         masked_latent=masked_latent,
+                        task="inpainting",
                     )
 
                     images = torch.cat(
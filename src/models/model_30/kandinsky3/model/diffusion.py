@@ -13,6 +13,7 @@ from tqdm import tqdm
 import pdb
 
 from models.model_30.kandinsky3.model.utils import get_tensor_items
+from progress import report_progress
 
 
 def get_named_beta_schedule(schedule_name, timesteps):
@@ -243,12 +244,13 @@ class BaseDiffusion:
         negative_context_mask=None,
         mask=None,
         masked_latent=None,
+        task="text2img",
     ):
         img = torch.randn(*shape, device=device)
         t_start = self.num_timesteps
-        time = list(range(t_start))[::-1]
+        times = list(range(t_start))[::-1]
 
-        for time in tqdm(time, position=0):
+        for step, time in enumerate(tqdm(times, position=0)):
             time = torch.tensor([time] * shape[0], device=device)
             img = self.p_sample(
                 model,
@@ -263,6 +265,15 @@ class BaseDiffusion:
                 mask=mask,
                 masked_latent=masked_latent,
             )
+            report_progress(
+                task,
+                "unet",
+                len(times),
+                step + 1,
+                times[step],
+                img,
+                latent_format="kandinsky3_movq",
+            )
         return img
 
 
@@ -31,6 +31,7 @@ from models.model_30.kandinsky3.model.diffusion import (
     get_named_beta_schedule,
 )
 from models.model_30.kandinsky3.utils import release_vram, vram_info
+from progress import calibrate_preview
 from utils.logging import k_log
 
 
@@ -167,6 +168,7 @@ class Kandinsky3T2IOptimizedPipeline:
                     vram_info("flushed movq")
 
                     images = torch.clip((images + 1.0) / 2.0, 0.0, 1.0)
+                    calibrate_preview("kandinsky3_movq", images[0])
                     for images_chunk in images.chunk(1):
                         pil_images += [self.to_pil(image) for image in images_chunk]
 
@@ -30,6 +30,7 @@ from models.model_30.kandinsky3.model.diffusion import (
     BaseDiffusion,
     get_named_beta_schedule,
 )
+from progress import calibrate_preview
 
 
 class Kandinsky3T2IPipeline:
@@ -135,6 +136,7 @@ class Kandinsky3T2IPipeline:
                         [self.movq.decode(image) for image in images.chunk(2)]
                     )
                     images = torch.clip((images + 1.0) / 2.0, 0.0, 1.0)
+                    calibrate_preview("kandinsky3_movq", images[0])
                     for images_chunk in images.chunk(1):
                         pil_images += [self.to_pil(image) for image in images_chunk]
 
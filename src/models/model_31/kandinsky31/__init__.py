@@ -29,8 +29,13 @@ from models.model_31.kandinsky31.inpainting_pipeline import Kandinsky3Inpainting
 from models.model_31.kandinsky31.t2i_lowvram_pipeline import (
     Kandinsky3T2ILowVRAMPipeline,
 )
+from models.model_31.kandinsky31.residency import (
+    ResidencyScope,
+    WeightResidencyManager,
+)
 from models.model_31.kandinsky31.utils import release_vram
 from models.model_31.model_kd31_env import Model_KD31_Environment
+from utils.nn import load_checkpoint_entries
 
 
 def get_T2I_unet(
@@ -260,6 +265,11 @@ def get_T2I_pipeline(
             dtype=dtype_map["movq"],
         )
 
+        residency = get_residency_manager(environment, "text2img")
+        if residency is not None:
+            unet_loader = residency.register("unet", unet_loader, device_map["unet"])
+            movq_loader = residency.register("movq", movq_loader, device_map["movq"])
+
         release_vram()
 
         return Kandinsky3T2ILowVRAMPipeline(
@@ -271,6 +281,7 @@ def get_T2I_pipeline(
             t5_encoder_loader=encoder_loader,
             movq_loader=movq_loader,
             gan=False,
+            residency=residency,
         )
     else:
         unet, null_embedding = get_T2I_unet(
@@ -299,12 +310,32 @@ def get_T2I_pipeline(
         )
 
 
+_residency_manager: Optional[WeightResidencyManager] = None
+
+
+def get_residency_manager(
+    environment: Model_KD31_Environment, pipeline: str
+) -> Optional[ResidencyScope]:
+    # one manager per process, so KD31_HOST_CACHE_MB bounds the pinned memory
+    # of all loaded low VRAM pipelines together
+    global _residency_manager
+
+    if environment.kd31_host_cache_mb <= 0:
+        return None
+    max_host_bytes = environment.kd31_host_cache_mb * 1024**2
+    if _residency_manager is None:
+        _residency_manager = WeightResidencyManager(max_host_bytes)
+    _residency_manager.max_host_bytes = max_host_bytes
+    return _residency_manager.scope(pipeline)
+
+
 @no_type_check
 def get_unet_nullemb_projections(
     weights_path: Optional[str] = None,
 ) -> (torch.Tensor, dict):
-    state_dict = torch.load(weights_path, map_location=torch.device("cpu"))
-    null_embedding = state_dict["null_embedding"]
+    null_embedding = load_checkpoint_entries(
+        weights_path, ["null_embedding"], sidecar_tag="nullemb"
+    )["null_embedding"]
 
     return null_embedding
 
@@ -391,6 +422,11 @@ def get_T2I_Flash_pipeline(
             dtype=dtype_map["movq"],
         )
 
+        residency = get_residency_manager(environment, "text2img")
+        if residency is not None:
+            unet_loader = residency.register("unet", unet_loader, device_map["unet"])
+            movq_loader = residency.register("movq", movq_loader, device_map["movq"])
+
         release_vram()
 
         return Kandinsky3T2ILowVRAMPipeline(
@@ -402,6 +438,7 @@ def get_T2I_Flash_pipeline(
             t5_encoder_loader=encoder_loader,
             movq_loader=movq_loader,
             gan=True,
+            residency=residency,
         )
 
     else:
@@ -504,6 +541,11 @@ def get_inpainting_pipeline(
             dtype=dtype_map["movq"],
         )
 
+        residency = get_residency_manager(environment, "inpainting")
+        if residency is not None:
+            unet_loader = residency.register("unet", unet_loader, device_map["unet"])
+            movq_loader = residency.register("movq", movq_loader, device_map["movq"])
+
         release_vram()
 
         return Kandinsky3InpaintingLowVRAMPipeline(
@@ -514,6 +556,7 @@ def get_inpainting_pipeline(
             t5_processor=processor,
             t5_encoder_loader=encoder_loader,
             movq_loader=movq_loader,
+            residency=residency,
         )
 
     else:
@@ -6,7 +6,7 @@ The code has been adopted from Kandinsky-3
 """
 
 import random
-from typing import Callable, Union, List
+from typing import Callable, Optional, Union, List
 import PIL
 import numpy as np
 
@@ -16,6 +16,7 @@ from einops import repeat
 
 from models.model_30.kandinsky3.utils import release_vram
 from models.model_31.kandinsky31.model.unet import UNet
+from models.model_31.kandinsky31.residency import ResidencyScope
 from models.model_31.kandinsky31.movq import MoVQ
 from models.model_31.kandinsky31.condition_encoders import T5TextConditionEncoder
 from models.model_31.kandinsky31.condition_processors import T5TextConditionProcessor
@@ -42,6 +43,7 @@ class Kandinsky3InpaintingLowVRAMPipeline:
         t5_processor: T5TextConditionProcessor,
         t5_encoder_loader: Callable[[], T5TextConditionEncoder],
         movq_loader: Callable[[], MoVQ],
+        residency: Optional[ResidencyScope] = None,
     ):
         k_log("running low vram inpainting pipeline")
 
@@ -55,6 +57,18 @@ class Kandinsky3InpaintingLowVRAMPipeline:
         self.t5_processor = t5_processor
         self.t5_encoder_loader = t5_encoder_loader
         self.movq_loader = movq_loader
+        self.residency = residency
+
+        self.t5_encoder = None
+        self.unet = None
+        self.movq = None
+
+    def offload(self, name: str):
+        if self.residency is not None and name in self.residency.loaders:
+            self.residency.release(name)
+        else:
+            getattr(self, name).to("cpu")
+        setattr(self, name, None)
 
     def shared_step(self, batch: dict) -> dict:
         image = batch["image"]
@@ -87,8 +101,7 @@ class Kandinsky3InpaintingLowVRAMPipeline:
         )
 
         report_mem_usage("loaded shared_step movq")
-        self.movq.to("cpu")
-        self.movq = None
+        self.offload("movq")
         release_vram()
         report_mem_usage("unloaded shared_step movq")
 
@@ -242,12 +255,12 @@ class Kandinsky3InpaintingLowVRAMPipeline:
                         negative_context_mask=bs_negative_context_mask,
                         mask=mask,
                         masked_latent=masked_latent,
+                        task="inpainting",
                         gan=False,
                     )
 
                     report_mem_usage("loaded unet")
-                    self.unet.to("cpu")
-                    self.unet = None
+                    self.offload("unet")
                     release_vram()
                     report_mem_usage("unloaded unet")
 
@@ -264,8 +277,7 @@ class Kandinsky3InpaintingLowVRAMPipeline:
                     pil_images += [self.to_pil(image) for image in images_chunk]
 
                 report_mem_usage("loaded movq")
-                self.movq.to("cpu")
-                self.movq = None
+                self.offload("movq")
                 release_vram()
                 report_mem_usage("unloaded movq")
 
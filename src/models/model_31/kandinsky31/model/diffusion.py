@@ -12,6 +12,7 @@ from einops import rearrange
 from tqdm import tqdm
 
 from models.model_31.kandinsky31.model.utils import get_tensor_items
+from progress import report_progress
 
 
 def get_named_beta_schedule(schedule_name, timesteps):
@@ -283,6 +284,7 @@ class BaseDiffusion:
         mask=None,
         masked_latent=None,
         gan=False,
+        task="text2img",
     ):
         img = torch.randn(*shape, device=device)
         times = times + [
@@ -290,7 +292,7 @@ class BaseDiffusion:
         ]
         times = list(zip(times[:-1], times[1:]))
 
-        for time, prev_time in tqdm(times):
+        for step, (time, prev_time) in enumerate(tqdm(times)):
             time = torch.tensor([time] * shape[0], device=device)
             if gan:
                 x_t = self.q_sample(img, time)
@@ -315,6 +317,15 @@ class BaseDiffusion:
                     mask=mask,
                     masked_latent=masked_latent,
                 )
+            report_progress(
+                task,
+                "unet",
+                len(times),
+                step + 1,
+                times[step][0],
+                img,
+                latent_format="kandinsky3_movq",
+            )
         return img
 
 
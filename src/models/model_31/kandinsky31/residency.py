@@ -0,0 +1,175 @@
+"""
+Host-RAM residency for the components of the low VRAM Kandinsky 3.1 pipelines.
+"""
+
+from collections import OrderedDict
+from itertools import chain
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+import torch
+import torch.nn as nn
+
+from utils.logging import k_log
+
+
+class _Resident:
+    def __init__(self, module: nn.Module):
+        self.module = module
+        self.tensors: List[torch.Tensor] = list(
+            chain(module.parameters(), module.buffers())
+        )
+        self.host: Optional[List[torch.Tensor]] = None
+        self.on_device = True
+
+    @property
+    def nbytes(self) -> int:
+        return sum(t.numel() * t.element_size() for t in self.tensors)
+
+
+class WeightResidencyManager:
+    """
+    Keeps low VRAM pipeline components alive in host RAM between uses.
+
+    The first ``acquire`` of a component calls its loader (disk read and module
+    construction). ``release`` then copies the weights once into pinned host
+    buffers and points the parameters at them, so every later ``acquire`` is a
+    single host-to-device ``copy_`` and every later ``release`` is free, as the
+    weights never change during inference. When the pinned copies would not
+    fit into ``max_host_bytes``, least recently used host-resident components
+    are dropped and reloaded from disk on their next use.
+    """
+
+    def __init__(self, max_host_bytes: int):
+        self.max_host_bytes = max_host_bytes
+        self.loaders: Dict[str, Callable[[], nn.Module]] = {}
+        self.devices: Dict[str, torch.device] = {}
+        self.residents: OrderedDict[str, _Resident] = OrderedDict()
+
+    @property
+    def host_bytes(self) -> int:
+        return sum(r.nbytes for r in self.residents.values() if r.host is not None)
+
+    def register(
+        self,
+        name: str,
+        loader: Callable[[], nn.Module],
+        device: Union[str, torch.device],
+    ) -> Callable[[], nn.Module]:
+        # a resident built by an earlier loader of the same name is stale
+        self._drop(name)
+        self.loaders[name] = loader
+        self.devices[name] = torch.device(device)
+        return lambda: self.acquire(name)
+
+    def acquire(self, name: str) -> nn.Module:
+        resident = self.residents.get(name)
+
+        if resident is None:
+            resident = _Resident(self.loaders[name]())
+            self.residents[name] = resident
+        elif not resident.on_device:
+            k_log(f"restoring resident {name} from host memory")
+            for tensor, host in zip(resident.tensors, resident.host):
+                tensor.data = torch.empty_like(host, device=self.devices[name])
+                tensor.data.copy_(host, non_blocking=True)
+            resident.on_device = True
+
+        self.residents.move_to_end(name)
+        return resident.module
+
+    def release(self, name: str):
+        resident = self.residents.get(name)
+        if resident is None or not resident.on_device:
+            return
+
+        if resident.host is None:
+            device = self.devices[name]
+            needed = resident.nbytes
+            if not self._make_room(needed, keep=name):
+                k_log(
+                    f"{name} ({round(needed / 1024**2)} MB) does not fit into host residency budget, dropping it"
+                )
+                self._drop(name)
+                return
+
+            pin = device.type == "cuda" and torch.cuda.is_available()
+            resident.host = [self._host_copy(t.data, pin) for t in resident.tensors]
+            if pin:
+                torch.cuda.current_stream(device).synchronize()
+
+        for tensor, host in zip(resident.tensors, resident.host):
+            tensor.data = host
+        resident.on_device = False
+
+    def clear(self, names: Optional[Iterable[str]] = None):
+        for name in list(self.residents.keys() if names is None else names):
+            self._drop(name)
+
+    def scope(self, prefix: str) -> "ResidencyScope":
+        return ResidencyScope(self, prefix)
+
+    def _make_room(self, needed: int, keep: str) -> bool:
+        if needed > self.max_host_bytes:
+            return False
+
+        for name in list(self.residents.keys()):
+            if self.host_bytes + needed <= self.max_host_bytes:
+                break
+            resident = self.residents[name]
+            if name != keep and resident.host is not None and not resident.on_device:
+                k_log(f"evicting {name} from host residency")
+                self._drop(name)
+
+        return self.host_bytes + needed <= self.max_host_bytes
+
+    def _drop(self, name: str):
+        resident = self.residents.pop(name, None)
+        if resident is not None:
+            resident.tensors = []
+            resident.host = None
+            resident.module = None
+
+    def _host_copy(self, tensor: torch.Tensor, pin: bool) -> torch.Tensor:
+        try:
+            host = torch.empty_like(tensor, device="cpu", pin_memory=pin)
+        except RuntimeError:
+            host = torch.empty_like(tensor, device="cpu")
+        host.copy_(tensor, non_blocking=pin)
+        return host
+
+
+class ResidencyScope:
+    """
+    The components of one pipeline in a ``WeightResidencyManager`` shared by
+    all of them, under their own names (``unet``, ``movq``) so the pipelines
+    share the host budget without clashing.
+    """
+
+    def __init__(self, manager: WeightResidencyManager, prefix: str):
+        self.manager = manager
+        self.prefix = f"{prefix}."
+
+    @property
+    def loaders(self) -> Dict[str, Callable[[], nn.Module]]:
+        return {
+            name[len(self.prefix) :]: loader
+            for name, loader in self.manager.loaders.items()
+            if name.startswith(self.prefix)
+        }
+
+    def register(
+        self,
+        name: str,
+        loader: Callable[[], nn.Module],
+        device: Union[str, torch.device],
+    ) -> Callable[[], nn.Module]:
+        return self.manager.register(self.prefix + name, loader, device)
+
+    def acquire(self, name: str) -> nn.Module:
+        return self.manager.acquire(self.prefix + name)
+
+    def release(self, name: str):
+        self.manager.release(self.prefix + name)
+
+    def clear(self):
+        self.manager.clear(self.prefix + name for name in self.loaders)
@@ -6,7 +6,7 @@ The code has been adopted from Kandinsky-3
 """
 
 import random
-from typing import Callable, Union, List
+from typing import Callable, Optional, Union, List
 import PIL
 from models.model_30.kandinsky3.utils import release_vram
 import numpy as np
@@ -15,6 +15,7 @@ import torchvision.transforms as T
 from einops import repeat
 
 from models.model_31.kandinsky31.model.unet import UNet
+from models.model_31.kandinsky31.residency import ResidencyScope
 from models.model_31.kandinsky31.movq import MoVQ
 from models.model_31.kandinsky31.condition_encoders import T5TextConditionEncoder
 from models.model_31.kandinsky31.condition_processors import T5TextConditionProcessor
@@ -23,6 +24,7 @@ from models.model_31.kandinsky31.model.diffusion import (
     get_named_beta_schedule,
 )
 from models.model_31.kandinsky31.utils import report_mem_usage
+from progress import calibrate_preview
 from utils.logging import k_log
 
 
@@ -38,6 +40,7 @@ class Kandinsky3T2ILowVRAMPipeline:
         t5_encoder_loader: Callable[[], T5TextConditionEncoder],
         movq_loader: Callable[[], MoVQ],
         gan: bool,
+        residency: Optional[ResidencyScope] = None,
     ):
         k_log("running low vram t2i pipeline")
 
@@ -50,9 +53,21 @@ class Kandinsky3T2ILowVRAMPipeline:
         self.t5_processor = t5_processor
         self.t5_encoder_loader = t5_encoder_loader
         self.movq_loader = movq_loader
+        self.residency = residency
+
+        self.t5_encoder = None
+        self.unet = None
+        self.movq = None
 
         self.gan = gan
 
+    def offload(self, name: str):
+        if self.residency is not None and name in self.residency.loaders:
+            self.residency.release(name)
+        else:
+            getattr(self, name).to("cpu")
+        setattr(self, name, None)
+
     def __call__(
         self,
         text: str,
@@ -151,8 +166,7 @@ class Kandinsky3T2ILowVRAMPipeline:
                     )
 
                     report_mem_usage("loaded unet")
-                    self.unet.to("cpu")
-                    self.unet = None
+                    self.offload("unet")
                     release_vram()
                     report_mem_usage("unloaded unet")
 
@@ -164,12 +178,12 @@ class Kandinsky3T2ILowVRAMPipeline:
                         [self.movq.decode(image) for image in images.chunk(2)]
                     )
                     images = torch.clip((images + 1.0) / 2.0, 0.0, 1.0)
+                    calibrate_preview("kandinsky3_movq", images[0])
                     for images_chunk in images.chunk(1):
                         pil_images += [self.to_pil(image) for image in images_chunk]
 
                     report_mem_usage("loaded movq")
-                    self.movq.to("cpu")
-                    self.movq = None
+                    self.offload("movq")
                     release_vram()
                     report_mem_usage("unloaded movq")
 
@@ -225,6 +225,9 @@ class Model_KD31:
                 if self.t2i_pipe.movq is not None:
                     self.t2i_pipe.movq.to("cpu")
 
+                if getattr(self.t2i_pipe, "residency", None) is not None:
+                    self.t2i_pipe.residency.clear()
+
                 self.t2i_pipe = None
                 cleared = True
 
@@ -241,6 +244,9 @@ class Model_KD31:
                 if self.inpainting_pipe.movq is not None:
                     self.inpainting_pipe.movq.to("cpu")
 
+                if getattr(self.inpainting_pipe, "residency", None) is not None:
+                    self.inpainting_pipe.residency.clear()
+
                 self.inpainting_pipe = None
                 cleared = True
 
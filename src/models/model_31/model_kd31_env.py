@@ -1,9 +1,12 @@
 from dataclasses import dataclass
 
+from utils.env_data import load_env_value
+
 
 @dataclass
 class Model_KD31_Environment:
     kd31_low_vram: bool = False
+    kd31_host_cache_mb: int = 8192
 
     def from_config(self, params):
         optimization_flags = [
@@ -11,4 +14,7 @@ class Model_KD31_Environment:
         ]
 
         self.kd31_low_vram = "kd31_low_vram" in optimization_flags
+        self.kd31_host_cache_mb = int(
+            load_env_value("KD31_HOST_CACHE_MB", self.kd31_host_cache_mb)
+        )
         return self
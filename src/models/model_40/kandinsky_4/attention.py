@@ -2,6 +2,80 @@ import torch
 import torch.nn.functional as F
 import math
 
+# upper bound for the score tensor materialized per chunk when the softmax
+# log-sum-exp is requested
+LSE_CHUNK_BYTES = 256 * 1024**2
+
+
+def unpack_query_key_value(query_key_value):
+    if query_key_value.dim() == 4:
+        if query_key_value.shape[1] == 3:
+            return query_key_value.unbind(1)
+        elif query_key_value.shape[2] == 3:
+            return query_key_value.unbind(2)
+        else:
+            raise ValueError(
+                f"Unexpected query_key_value shape: {query_key_value.shape}"
+            )
+    raise ValueError(f"Unexpected query_key_value shape: {query_key_value.shape}")
+
+
+def pad_sequences(tensors, cu_seqlens, seqlens, max_seqlen):
+    # (total_tokens, heads, dim) packed sequences -> (batch, heads, max_seqlen,
+    # dim); equal lengths are a plain view, otherwise rows past the end of a
+    # sequence repeat its last token and are masked out of the keys (rows of
+    # an empty sequence point at the last packed token, they are all masked)
+    batch_size = len(seqlens)
+    if all(seqlen == max_seqlen for seqlen in seqlens):
+        return [
+            t.reshape(batch_size, max_seqlen, *t.shape[1:]).transpose(1, 2)
+            for t in tensors
+        ], None
+
+    device = tensors[0].device
+    positions = torch.arange(max_seqlen, device=device)
+    lengths = torch.tensor(seqlens, device=device)
+    valid = positions.unsqueeze(0) < lengths.unsqueeze(1)
+    index = cu_seqlens[:-1].to(device).unsqueeze(1) + torch.minimum(
+        positions.unsqueeze(0), (lengths - 1).clamp(min=0).unsqueeze(1)
+    )
+    index = index.clamp(max=tensors[0].shape[0] - 1)
+    return [t[index].transpose(1, 2) for t in tensors], valid
+
+
+def attention_mask(valid, causal, max_seqlen, device):
+    mask = None
+    if valid is not None:
+        mask = valid[:, None, None, :]
+    if causal:
+        causal_mask = torch.ones(
+            max_seqlen, max_seqlen, device=device, dtype=torch.bool
+        ).tril()
+        mask = causal_mask if mask is None else mask & causal_mask
+    return mask
+
+
+def softmax_lse(q, k, mask, softmax_scale):
+    # log-sum-exp of the attention scores, query chunk by query chunk so the
+    # scores of all sequences and heads never exist at once
+    batch_size, num_heads, max_seqlen, _ = q.shape
+    row_bytes = batch_size * num_heads * k.shape[2] * 4
+    chunk_size = max(1, min(max_seqlen, LSE_CHUNK_BYTES // row_bytes))
+
+    lse = torch.empty(
+        batch_size, num_heads, max_seqlen, device=q.device, dtype=torch.float32
+    )
+    for start in range(0, max_seqlen, chunk_size):
+        end = min(start + chunk_size, max_seqlen)
+        scores = torch.matmul(q[:, :, start:end].float(), k.float().transpose(-2, -1))
+        scores = scores * softmax_scale
+        if mask is not None:
+            chunk_mask = mask[..., start:end, :] if mask.shape[-2] > 1 else mask
+            scores = scores.masked_fill(~chunk_mask, float("-inf"))
+        lse[:, :, start:end] = torch.logsumexp(scores, dim=-1)
+        del scores
+    return lse
+
 
 def standard_flash_attn_varlen_qkvpacked_func_replacement(
     query_key_value,
@@ -11,100 +85,51 @@ def standard_flash_attn_varlen_qkvpacked_func_replacement(
     softmax_scale=None,
     causal=False,
     return_attn_probs=False,
+    return_softmax_lse=True,
 ):
-    device = query_key_value.device
-    dtype = query_key_value.dtype
-
-    if query_key_value.dim() == 4:
-        if query_key_value.shape[1] == 3:
-            q, k, v = query_key_value.unbind(1)
-        elif query_key_value.shape[2] == 3:
-            q, k, v = query_key_value.unbind(2)
-        else:
-            raise ValueError(
-                f"Unexpected query_key_value shape: {query_key_value.shape}"
-            )
-    else:
-        raise ValueError(f"Unexpected query_key_value shape: {query_key_value.shape}")
+    """
+    ``flash_attn_varlen_qkvpacked_func`` on top of ``scaled_dot_product_attention``.
+
+    The packed sequences are laid out as one padded batch (a free view when
+    they all have the same length, which is the common case of the grouped
+    visual attention) and attended in a single call across all sequences and
+    heads. Returns ``(out, softmax_lse, None)`` with ``out`` of shape
+    (total_tokens, heads, head_dim) and ``softmax_lse`` of shape
+    (total_tokens, heads); the log-sum-exp costs an extra pass over the scores
+    and is skipped (``None``) with ``return_softmax_lse=False``.
+    """
+    q, k, v = unpack_query_key_value(query_key_value)
 
     total_tokens, num_heads, head_dim = q.shape
-    batch_size = len(large_cu_seqlens) - 1
-
     if softmax_scale is None:
         softmax_scale = 1.0 / math.sqrt(head_dim)
 
-    output = torch.zeros(total_tokens, num_heads, head_dim, device=device, dtype=dtype)
-    lse_output = torch.zeros(total_tokens, num_heads, device=device, dtype=dtype)
-
-    attn_probs_output = None
-
-    operation_count = 0
-    cache_clear_interval = 50
-
-    for batch_idx in range(batch_size):
-        start_idx = large_cu_seqlens[batch_idx].item()
-        end_idx = large_cu_seqlens[batch_idx + 1].item()
-        seq_len = end_idx - start_idx
-
-        if seq_len == 0:
-            continue
-
-        query_chunk_size = min(32, max(8, seq_len // 100))
-
-        head_group_size = min(4, num_heads)
-
-        for head_start in range(0, num_heads, head_group_size):
-            head_end = min(head_start + head_group_size, num_heads)
-            current_head_count = head_end - head_start
-
-            q_heads = q[start_idx:end_idx, head_start:head_end, :]
-            k_heads = k[start_idx:end_idx, head_start:head_end, :]
-            v_heads = v[start_idx:end_idx, head_start:head_end, :]
-
-            for q_start in range(0, seq_len, query_chunk_size):
-                q_end = min(q_start + query_chunk_size, seq_len)
-                chunk_size = q_end - q_start
-
-                q_chunk = q_heads[q_start:q_end]
-
-                scores = torch.einsum("qhd,khd->qhk", q_chunk, k_heads) * softmax_scale
-
-                if causal:
-                    mask = torch.triu(
-                        torch.ones(
-                            chunk_size, seq_len, device=device, dtype=torch.bool
-                        ),
-                        diagonal=q_start + 1,
-                    )
-                    scores = scores.masked_fill(mask.unsqueeze(1), float("-inf"))
-
-                lse = torch.logsumexp(scores, dim=-1)
-
-                attn_weights = torch.exp(scores - lse.unsqueeze(-1))
-
-                if dropout_p > 0.0 and torch.is_grad_enabled():
-                    attn_weights = F.dropout(attn_weights, p=dropout_p)
-
-                chunk_output = torch.einsum("qhk,khd->qhd", attn_weights, v_heads)
-
-                global_q_start = start_idx + q_start
-                global_q_end = start_idx + q_end
-                output[global_q_start:global_q_end, head_start:head_end, :] = (
-                    chunk_output
-                )
-                lse_output[global_q_start:global_q_end, head_start:head_end] = lse
-
-                del scores, lse, attn_weights, chunk_output
-
-                operation_count += 1
-                if operation_count % cache_clear_interval == 0:
-                    torch.cuda.empty_cache()
-
-            del q_heads, k_heads, v_heads
-
-    output = output.contiguous()
-    lse_output = lse_output.contiguous()
-
-    torch.cuda.empty_cache()
+    seqlens = torch.diff(large_cu_seqlens).tolist()
+    max_seqlen = max(seqlens)
+
+    (q, k, v), valid = pad_sequences([q, k, v], large_cu_seqlens, seqlens, max_seqlen)
+    mask = attention_mask(valid, causal, max_seqlen, q.device)
+
+    out = F.scaled_dot_product_attention(
+        q,
+        k,
+        v,
+        attn_mask=mask,
+        dropout_p=dropout_p if torch.is_grad_enabled() else 0.0,
+        scale=softmax_scale,
+    )
+
+    lse = None
+    if return_softmax_lse:
+        lse = softmax_lse(q, k, mask, softmax_scale).to(out.dtype)
+
+    if valid is None:
+        out = out.transpose(1, 2).reshape(total_tokens, num_heads, head_dim)
+        if lse is not None:
+            lse = lse.transpose(1, 2).reshape(total_tokens, num_heads)
+    else:
+        out = out.transpose(1, 2)[valid]
+        if lse is not None:
+            lse = lse.transpose(1, 2)[valid]
 
-    return output, lse_output, attn_probs_output
+    return out.contiguous(), lse, None
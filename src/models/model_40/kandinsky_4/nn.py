@@ -213,7 +213,11 @@ class MultiheadSelfAttention(nn.Module):
             )
         elif self.attention_type == "sdpa":
             out, softmax_lse, _ = standard_flash_attn_varlen_qkvpacked_func_replacement(
-                query_key_value, large_cu_seqlens, max_seqlen, return_attn_probs=True
+                query_key_value,
+                large_cu_seqlens,
+                max_seqlen,
+                return_attn_probs=True,
+                return_softmax_lse=return_attn_probs,
             )
 
         out = out.reshape(math.prod(num_groups), -1, *out.shape[1:]).flatten(-2, -1)
@@ -357,7 +361,11 @@ class MultiheadSelfAttentionTP(nn.Module):
 
         elif self.attention_type == "sdpa":
             out, softmax_lse, _ = standard_flash_attn_varlen_qkvpacked_func_replacement(
-                query_key_value, large_cu_seqlens, max_seqlen, return_attn_probs=True
+                query_key_value,
+                large_cu_seqlens,
+                max_seqlen,
+                return_attn_probs=True,
+                return_softmax_lse=return_attn_probs,
             )
 
         out = out.reshape(math.prod(num_groups), -1, *out.shape[1:]).flatten(-2, -1)
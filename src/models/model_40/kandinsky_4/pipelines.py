@@ -17,6 +17,7 @@ from models.model_40.model_kd40_env import (
     quantize_with_optimum_quanto,
     quantize_with_torch_ao,
 )
+from utils.block_offload import block_offloader
 from utils.logging import k_log
 from .dit import get_dit, parallelize
 from .text_embedders import get_text_embedder
@@ -116,27 +117,54 @@ def get_T2V_pipeline(
         conf = OmegaConf.load(conf_path)
     print(f"loaded configuration: {conf}")
 
+    quantized_cache_dir = (
+        os.path.join(cache_dir, "quantized")
+        if environment.use_save_quantized_weights
+        else None
+    )
+
     k_log("loading DiT...")
     dit = get_dit(conf.dit)
-    dit = dit.to(dtype=torch.bfloat16, device=device_map["dit"])
+    # with offloading the DiT stays on the host and its blocks are streamed
+    # to the GPU while it runs
+    use_block_offload = environment.use_model_offload and world_size == 1
+    dit = dit.to(
+        dtype=torch.bfloat16,
+        device="cpu" if use_block_offload else device_map["dit"],
+    )
     # dit = dit.to(dtype=torch.float8_e4m3fn, device=device_map["dit"])
 
-    path, ext = os.path.splitext(conf.dit.checkpoint_path)
     if environment.use_t2v_tenc_int8_ao_quantization:
         k_log("quantizing DiT [torchao-int8]...")
         dit = quantize_with_torch_ao(
             dit,
             True,
-            (f"{path}.q8_tao{ext}" if environment.use_save_quantized_weights else None),
+            quantized_cache_dir,
         )
     elif environment.use_t2v_dit_int8_oq_quantization:
         k_log("quantizing DiT [optimum-quanto]...")
         dit = quantize_with_optimum_quanto(
             dit,
             True,
-            (f"{path}.q8_oq{ext}" if environment.use_save_quantized_weights else None),
+            quantized_cache_dir,
         )
 
+    if use_block_offload:
+        offloader = None
+        if all(type(p.data) is torch.Tensor for p in dit.parameters()):
+            offloader = block_offloader(
+                dit,
+                [block for pair in dit.transformer_blocks for block in pair],
+                device_map["dit"],
+                environment.offload_resident_blocks,
+            )
+
+        if offloader is not None:
+            offloader.load()
+        else:
+            k_log("block offload is not available for this DiT, moving it whole")
+            dit = dit.to(device_map["dit"])
+
     noise_scheduler = CogVideoXDDIMScheduler.from_pretrained(conf.dit.scheduler)
 
     if world_size > 1:
@@ -145,20 +173,19 @@ def get_T2V_pipeline(
     k_log("loading text embedder...")
     text_embedder = get_text_embedder(conf)
 
-    path, ext = os.path.splitext(conf.text_embedder.params.checkpoint_path)
     if environment.use_t2v_tenc_int8_ao_quantization:
         k_log("quantizing embedder [torchao-int8]...")
         text_embedder.llm = quantize_with_torch_ao(
             text_embedder.llm,
             True,
-            (f"{path}.q8_tao{ext}" if environment.use_save_quantized_weights else None),
+            quantized_cache_dir,
         )
     elif environment.use_t2v_tenc_int8_oq_quantization:
         k_log("quantizing embedder [optimum-quanto]...")
         text_embedder.llm = quantize_with_optimum_quanto(
             text_embedder.llm,
             True,
-            (f"{path}.q8_oq{ext}" if environment.use_save_quantized_weights else None),
+            quantized_cache_dir,
         )
     else:
         text_embedder = text_embedder.freeze()
@@ -188,20 +215,19 @@ def get_T2V_pipeline(
     if local_rank == 0:
         vae = vae.to(device_map["vae"], dtype=torch.bfloat16)
 
-    path, ext = os.path.splitext(conf.vae.checkpoint_path)
     if environment.use_t2v_vae_int8_ao_quantization:
         k_log("quantizing vae [torchao-int8]...")
         vae = quantize_with_torch_ao(
             vae,
             True,
-            (f"{path}.q8_tao{ext}" if environment.use_save_quantized_weights else None),
+            quantized_cache_dir,
         )
     elif environment.use_t2v_vae_int8_oq_quantization:
         k_log("quantizing vae [optimum-quanto]...")
         vae = quantize_with_optimum_quanto(
             vae,
             True,
-            (f"{path}.q8_oq{ext}" if environment.use_save_quantized_weights else None),
+            quantized_cache_dir,
         )
 
     return Kandinsky4T2VPipeline(
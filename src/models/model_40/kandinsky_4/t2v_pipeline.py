@@ -21,6 +21,7 @@ from diffusers import AutoencoderKLCogVideoX
 from diffusers import CogVideoXDDIMScheduler
 
 from models.model_40.model_kd40_env import Model_KD40_Environment
+from progress import calibrate_preview, report_progress
 
 from .dit import DiffusionTransformer3D
 from .text_embedders import T5TextEmbedder
@@ -82,9 +83,10 @@ def diffusion_generate_renoise(
     noise_scheduler.set_timesteps(num_steps, device=device)
 
     timesteps = noise_scheduler.timesteps
+    host_timesteps = timesteps.tolist()
     if progress:
         timesteps = tqdm(timesteps)
-    for time in timesteps:
+    for step, time in enumerate(timesteps):
         model_time = time.unsqueeze(0).repeat(visual_cu_seqlens.shape[0] - 1)
         noise = (
             torch.randn(img.shape, generator=generator).to(torch.bfloat16).to(device)
@@ -109,6 +111,15 @@ def diffusion_generate_renoise(
             sample=img.to(device),
             device=device,
         )
+        report_progress(
+            "text2video",
+            "dit",
+            num_steps,
+            step + 1,
+            host_timesteps[step],
+            img,
+            latent_format="cogvideox",
+        )
 
     return img
 
@@ -278,6 +289,7 @@ class Kandinsky4T2VPipeline:
                     images.unsqueeze(2 if time_length == 0 else 0)
                 ).sample.float()
                 images = torch.clip((images + 1.0) / 2.0, 0.0, 1.0)
+                calibrate_preview("cogvideox", images[0, :, 0])
 
         torch.cuda.empty_cache()
 
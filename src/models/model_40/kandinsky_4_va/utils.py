@@ -6,15 +6,14 @@ The code has been adopted from Kandinsky-4
 """
 
 
-import os
-import uuid
+from fractions import Fraction
 from pathlib import Path
 
+import av
 import numpy as np
 import pydub
-import torchvision
+import torch
 from PIL import Image
-from moviepy.editor import AudioFileClip, ImageSequenceClip
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
 # from IPython.display import Video, clear_output, display
@@ -50,54 +49,137 @@ def image_to_audio(pil_image, target_dBFS=-30.0, device="cuda"):
     if target_dBFS is not None:
         segment = set_to_target_level(segment, target_dBFS)
 
-    save_path = f"./{uuid.uuid4()}.mp3"
-    segment.export(save_path, format="mp3")
+    return segment
 
-    return save_path
+
+PCM_FORMATS = {2: "s16", 4: "s32"}
+
+
+def encode_audio(container, segment):
+    """
+    Encodes a pydub segment into a new AAC stream of an open output container.
+    """
+    layout = "mono" if segment.channels == 1 else "stereo"
+    stream = container.add_stream("aac", rate=segment.frame_rate, layout=layout)
+
+    # packed PCM: a single plane of interleaved samples
+    samples = np.array(segment.get_array_of_samples()).reshape(1, -1)
+    frame = av.AudioFrame.from_ndarray(
+        samples, format=PCM_FORMATS[segment.sample_width], layout=layout
+    )
+    frame.sample_rate = segment.frame_rate
+    frame.time_base = Fraction(1, segment.frame_rate)
+    frame.pts = 0
+
+    for packet in stream.encode(frame):
+        container.mux(packet)
+    for packet in stream.encode(None):
+        container.mux(packet)
 
 
 def create_video(
     spectogram,
-    video,
+    video_path,
+    duration_sec,
     target_dBFS=-30.0,
     save_path=None,
-    display_video=False,
     device="cuda",
 ):
+    """
+    Muxes the audio reconstructed from ``spectogram`` with the first
+    ``duration_sec`` seconds of the source video stream. The video packets are
+    copied as they are, nothing but the audio gets encoded.
+    """
     spectogram = Image.fromarray(np.array(spectogram))
-    audio_temp_path = image_to_audio(spectogram, target_dBFS, device)
-    try:
-        audioclip = AudioFileClip(audio_temp_path)
+    segment = image_to_audio(spectogram, target_dBFS, device)
+
+    if save_path is None:
+        return segment
+
+    Path(save_path).parent.mkdir(parents=True, exist_ok=True)
+    with av.open(video_path) as source, av.open(save_path, "w") as output:
+        source_stream = source.streams.video[0]
+        video_stream = output.add_stream_from_template(source_stream)
 
-        images_list = [video[i].numpy() for i in range(video.shape[0])]
-        fps = video.shape[0] / audioclip.duration
-        videoclip = ImageSequenceClip(images_list, fps=fps)
+        encode_audio(output, segment)
 
-        video_with_new_audio = videoclip.set_audio(audioclip)
+        start_time = source_stream.start_time or 0
+        end_pts = start_time + duration_sec / source_stream.time_base
+        for packet in source.demux(source_stream):
+            # the flushing packet at the end of the stream has no timestamps
+            if packet.dts is None:
+                continue
+            if packet.pts is not None and packet.pts >= end_pts:
+                break
 
-        if save_path is not None:
-            Path(save_path).parent.mkdir(parents=True, exist_ok=True)
-            video_with_new_audio.write_videofile(save_path)
+            packet.stream = video_stream
+            output.mux(packet)
 
-        if display_video:
-            video_with_new_audio.write_videofile("temp.mp4")
-            # clear_output(wait=True)
-            # display(Video("temp.mp4"))
+    return segment
 
-        os.remove(audio_temp_path)
-    except Exception as ex:
-        os.remove(audio_temp_path)
-        raise ex
 
+def video_frame_count(container, stream):
+    fps = float(stream.average_rate)
+    if stream.frames:
+        return stream.frames
+    if stream.duration is not None:
+        return int(float(stream.duration * stream.time_base) * fps)
+    return int(container.duration / av.time_base * fps)
 
-def load_video(video, fps, num_frames=38, max_duration_sec=12):
-    duration_sec = int(video.shape[0] / fps)
-    if duration_sec > max_duration_sec:
-        duration_sec = max_duration_sec
-    total_frames = int(duration_sec * fps)
 
-    video = video[:total_frames]
-    frame_id_list = np.linspace(0, total_frames - 1, num_frames, dtype=int)
+def sample_video(video_path, num_frames=38, max_duration_sec=12):
+    """
+    Decodes only the ``num_frames`` evenly spaced frames of the first
+    ``max_duration_sec`` whole seconds of the clip, seeking to the nearest
+    keyframe whenever the next wanted frame is more than a second ahead.
+    Returns the frames as a [3, num_frames, H, W] uint8 tensor along with the
+    used duration in seconds.
+    """
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+
+        fps = float(stream.average_rate)
+        duration_sec = int(video_frame_count(container, stream) / fps)
+        if duration_sec > max_duration_sec:
+            duration_sec = max_duration_sec
+        total_frames = int(duration_sec * fps)
+
+        frame_id_list = np.linspace(0, total_frames - 1, num_frames, dtype=int)
+        start_time = (
+            float(stream.start_time * stream.time_base)
+            if stream.start_time is not None
+            else 0.0
+        )
 
-    video_input = video[frame_id_list].permute(3, 0, 1, 2)
-    return video_input, video, duration_sec
+        frames = {}
+        decoder = None
+        position, last = -1, None
+        for frame_id in sorted(set(frame_id_list.tolist())):
+            if last is not None and position >= frame_id:
+                frames[frame_id] = last
+                continue
+
+            if decoder is None or frame_id - position > fps:
+                offset = (start_time + frame_id / fps) / stream.time_base
+                container.seek(int(offset), stream=stream, backward=True)
+                decoder = container.decode(stream)
+
+            for frame in decoder:
+                if frame.time is None:
+                    position += 1
+                else:
+                    position = round((frame.time - start_time) * fps)
+                if position >= frame_id:
+                    last = frame.to_ndarray(format="rgb24")
+                    frames[frame_id] = last
+                    break
+            else:
+                break
+
+    if last is None:
+        raise ValueError(f"no frames could be decoded from {video_path}")
+
+    video_input = np.stack([frames.get(i, last) for i in frame_id_list.tolist()])
+    video_input = torch.from_numpy(video_input).permute(3, 0, 1, 2)
+    return video_input, duration_sec
@@ -7,9 +7,11 @@ The code has been adopted from Kandinsky-4
 
 
 import os
+from collections import OrderedDict
 from typing import List, Optional, Union
 
 import torch
+import torch.nn.functional as F
 from tqdm import tqdm
 
 from diffusers.image_processor import VaeImageProcessor
@@ -25,6 +27,9 @@ from models.model_40.model_kd40_env import (
 )
 from utils.logging import k_log
 
+MM_PAD_TOKEN_ID = 128002
+TEXT_EMBEDDING_CACHE_SIZE = 16
+
 
 class Video2AudioPipeline:
     scheduler = None
@@ -141,6 +146,12 @@ class Video2AudioPipeline:
         self.vae_scale_factor = 2 ** (len(self.vae.config.block_out_channels) - 1)
         self.image_processor = VaeImageProcessor(vae_scale_factor=8)
 
+        # multimodal outputs that do not depend on the input video content:
+        # text embeddings by text, unconditional video embeddings by the
+        # frame tensor shape (the unconditional input is all zeros)
+        self.text_embedding_cache = OrderedDict()
+        self.uncond_video_embedding_cache = {}
+
     def prepare_latents(
         self,
         batch_size,
@@ -215,28 +226,104 @@ class Video2AudioPipeline:
         }
         return inputs, gen_kwargs
 
-    def extract_video_embedding(self, images):
-        inputs, gen_kwargs = self.__prepare_inputs__(images=images)
+    def __prepare_batch_inputs__(self, entries):
+        # causal attention: right padding leaves the hidden states of the
+        # real tokens unchanged, so entries can share a single forward
+        batch = [
+            self.__prepare_inputs__(images=images, query=query)[0]
+            for images, query in entries
+        ]
+        max_len = max(inputs["input_ids"].shape[1] for inputs in batch)
+
+        def pad(inputs, key, value):
+            tensor = inputs[key]
+            return F.pad(tensor, (0, max_len - tensor.shape[1]), value=value)
+
+        inputs = {
+            "input_ids": torch.cat(
+                [pad(i, "input_ids", MM_PAD_TOKEN_ID) for i in batch]
+            ),
+            "token_type_ids": torch.cat([pad(i, "token_type_ids", 0) for i in batch]),
+            "attention_mask": torch.cat([pad(i, "attention_mask", 0) for i in batch]),
+        }
+
+        if "images" in batch[0]:
+            inputs["images"] = [i["images"][0] for i in batch]
+
+        return inputs
+
+    def extract_video_embeddings(self, videos):
+        inputs = self.__prepare_batch_inputs__([(video, "") for video in videos])
+
+        hidden_states = self.multimodal(
+            **inputs, output_hidden_states=True
+        ).hidden_states[-2]
+
+        embs = []
+        for i, video in enumerate(videos):
+            emb = hidden_states[i, inputs["token_type_ids"][i] == 1]
+            embs.append(emb.reshape((video.shape[1], -1, emb.shape[-1])).mean(dim=1))
+
+        return torch.stack(embs)
+
+    def extract_text_embeddings(self, texts, max_len=100):
+        inputs = self.__prepare_batch_inputs__([([], text) for text in texts])
+
+        hidden_states = self.multimodal(
+            **inputs, output_hidden_states=True
+        ).hidden_states[-2]
+        text_tokens = (inputs["token_type_ids"] == 0) & (inputs["attention_mask"] == 1)
+
+        embs = []
+        for i in range(len(texts)):
+            emb = hidden_states[i, text_tokens[i]]
+
+            pad_len = max_len - emb.shape[0]
+            if pad_len > 0:
+                emb = torch.cat(
+                    [emb, torch.zeros(pad_len, emb.shape[1], device=emb.device)], dim=0
+                )
+            embs.append(emb[:max_len])
 
-        emb = self.multimodal(**inputs, output_hidden_states=True)
-        emb = emb.hidden_states[-2][0, inputs["token_type_ids"][0] == 1]
-        emb = emb.reshape((images.shape[1], -1, emb.shape[-1])).mean(dim=1)
+        return torch.stack(embs)
 
-        return emb
+    def extract_video_embedding(self, images):
+        return self.extract_video_embeddings([images])[0]
 
     def extract_text_embedding(self, text, max_len=100):
-        inputs, gen_kwargs = self.__prepare_inputs__(query=text)
+        return self.extract_text_embeddings([text], max_len)[0]
 
-        emb = self.multimodal(**inputs, output_hidden_states=True)
-        emb = emb.hidden_states[-2][0, inputs["token_type_ids"][0] == 0]
+    def encode_texts(self, texts):
+        missing = list(
+            dict.fromkeys(t for t in texts if t not in self.text_embedding_cache)
+        )
+        if len(missing) > 0:
+            for text, emb in zip(missing, self.extract_text_embeddings(missing)):
+                self.text_embedding_cache[text] = emb
 
-        pad_len = max_len - emb.shape[0]
-        if pad_len > 0:
-            emb = torch.cat(
-                [emb, torch.zeros(pad_len, emb.shape[1], device=emb.device)], dim=0
-            )
+        for text in texts:
+            self.text_embedding_cache.move_to_end(text)
+        embs = torch.stack([self.text_embedding_cache[text] for text in texts])
+
+        while len(self.text_embedding_cache) > TEXT_EMBEDDING_CACHE_SIZE:
+            self.text_embedding_cache.popitem(last=False)
+
+        return embs
+
+    def encode_video(self, images, with_uncond):
+        if not with_uncond:
+            return self.extract_video_embeddings([images])
+
+        key = (tuple(images.shape), images.dtype, images.device)
+        uncond = self.uncond_video_embedding_cache.get(key)
+        if uncond is None:
+            k_log("encoding unconditional video embedding")
+            uncond, cond = self.extract_video_embeddings([images * 0, images])
+            self.uncond_video_embedding_cache[key] = uncond
+        else:
+            cond = self.extract_video_embeddings([images])[0]
 
-        return emb[:max_len]
+        return torch.stack([uncond, cond])
 
     def _encode_conditions(
         self,
@@ -247,26 +334,16 @@ class Video2AudioPipeline:
         negative_prompt=None,
     ):
         prompt_embeds_dtype = self.unet.dtype
-        prompt_embeds = self.extract_text_embedding(prompt).unsqueeze(0)
-        prompt_embeds = prompt_embeds.to(dtype=prompt_embeds_dtype, device=device)
-
-        image_embeds = self.extract_video_embedding(images).unsqueeze(0)
-        image_embeds = image_embeds.to(dtype=prompt_embeds_dtype, device=device)
 
+        texts = [prompt]
         if do_classifier_free_guidance:
-            negative_prompt_embeds = self.extract_text_embedding(
-                negative_prompt
-            ).unsqueeze(0)
-            negative_prompt_embeds = negative_prompt_embeds.to(
-                dtype=prompt_embeds_dtype, device=device
-            )
-            prompt_embeds = torch.cat([negative_prompt_embeds, prompt_embeds])
+            texts = [negative_prompt if negative_prompt is not None else "", prompt]
 
-            uncond_image_embeds = self.extract_video_embedding(images * 0).unsqueeze(0)
-            uncond_image_embeds = uncond_image_embeds.to(
-                dtype=prompt_embeds_dtype, device=device
-            )
-            image_embeds = torch.cat([uncond_image_embeds, image_embeds])
+        prompt_embeds = self.encode_texts(texts)
+        prompt_embeds = prompt_embeds.to(dtype=prompt_embeds_dtype, device=device)
+
+        image_embeds = self.encode_video(images, do_classifier_free_guidance)
+        image_embeds = image_embeds.to(dtype=prompt_embeds_dtype, device=device)
 
         return prompt_embeds, image_embeds
 
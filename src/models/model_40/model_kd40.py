@@ -3,7 +3,6 @@ import random
 import re
 import numpy as np
 import torch
-import torchvision
 import torch.backends
 import torch
 from torch.functional import F
@@ -18,7 +17,7 @@ from models.model_40.kandinsky_4.pipelines import get_T2V_pipeline
 from models.model_40.kandinsky_4.t2v_pipeline import Kandinsky4T2VPipeline
 from models.model_40.model_kd40_env import Model_KD40_Environment
 from models.model_40.kandinsky_4_va.video2audio_pipe import Video2AudioPipeline
-from models.model_40.kandinsky_4_va.utils import load_video, create_video
+from models.model_40.kandinsky_4_va.utils import sample_video, create_video
 
 from utils.file_system import save_output
 
@@ -161,9 +160,8 @@ class Model_KD40:
         num_steps = params["steps"]
         height = 512  # params["height"]
 
-        video, _, fps = torchvision.io.read_video(video)
-        video_input, video_complete, duration_sec = load_video(
-            video, fps["video_fps"], num_frames=96, max_duration_sec=12
+        video_input, duration_sec = sample_video(
+            video, num_frames=96, max_duration_sec=12
         )
 
         seed = (
@@ -273,8 +271,8 @@ class Model_KD40:
 
         create_video(
             spectrogram,
-            video_complete,
-            display_video=False,
+            video,
+            duration_sec,
             save_path=save_video_path,
             device=device,
         )
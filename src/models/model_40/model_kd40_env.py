@@ -18,7 +18,9 @@ from torchao.quantization import (
     int8_dynamic_activation_int8_weight as tao_int8_dynamic_activation_int8_weight,
 )
 
+from utils.env_data import load_env_value
 from utils.logging import k_log
+from utils.quantized_cache import quantize_cached
 
 tao_quantization = tao_int8_weight_only
 optq_quantization = optq_qfloat8
@@ -45,6 +47,7 @@ class Model_KD40_Environment:
     use_vae_slicing: bool = False
     use_model_offload: bool = False
     use_save_quantized_weights: bool = False
+    offload_resident_blocks: int = 4
 
     kd40_conf: DictConfig = None
 
@@ -98,6 +101,9 @@ class Model_KD40_Environment:
         self.use_vae_tiling = "kd40_vae_tiling" in optimization_flags
         self.use_vae_slicing = "kd40_vae_slicing" in optimization_flags
         self.use_model_offload = "kd40_model_offload" in optimization_flags
+        self.offload_resident_blocks = int(
+            load_env_value("KD40_OFFLOAD_RESIDENT_BLOCKS", self.offload_resident_blocks)
+        )
         self.use_save_quantized_weights = (
             "kd40_save_quantized_weights" in optimization_flags
         )
@@ -105,25 +111,26 @@ class Model_KD40_Environment:
         return self
 
 
-def quantize_with_torch_ao(model, freeze=False, save_name=None):
-    tao_quantize(model, tao_quantization())
-    if freeze:
-        # k_log("cannot (yet) freeze with torch_ao")
-        pass
-    if save_name is not None:
-        k_log("cannot (yet) save with torch_ao")
-    return model
-
-
-def quantize_with_optimum_quanto(model, freeze=False, save_name=None):
-    optq_quantize(model, weights=optq_qfloat8)
-    if freeze:
-        k_log("freezing...")
-        optq_freeze(model)
-    if save_name is not None:
-        k_log("saving to " + save_name)
-        model.save_pretrained(save_name)
-    return model
+def quantize_with_torch_ao(model, freeze=False, cache_dir=None):
+    def quantize(model):
+        tao_quantize(model, tao_quantization())
+        if freeze:
+            # k_log("cannot (yet) freeze with torch_ao")
+            pass
+        return model
+
+    return quantize_cached(model, "torchao_int8_weight_only", quantize, cache_dir)
+
+
+def quantize_with_optimum_quanto(model, freeze=False, cache_dir=None):
+    def quantize(model):
+        optq_quantize(model, weights=optq_qfloat8)
+        if freeze:
+            k_log("freezing...")
+            optq_freeze(model)
+        return model
+
+    return quantize_cached(model, "quanto_qfloat8", quantize, cache_dir)
 
 
 def bnb_config(nf4=False, int8=False):
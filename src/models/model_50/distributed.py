@@ -0,0 +1,150 @@
+"""
+Tensor-parallel serving of the Kandinsky 5 DiT on several local ranks.
+
+    torchrun --nproc-per-node 2 src/kubin.py --model-name=kd50 --pipeline=native
+
+Rank 0 runs the UI (or the batch runner), the text encoder and the VAE, and
+holds one DiT shard. Every other rank only holds its own DiT shard and follows
+rank 0 in ``serve``: rank 0 broadcasts a command before each step that needs
+the whole mesh (building the DiT, denoising, freeing it) and the DiT
+collectives keep the ranks in lockstep from there. With the ``cpu`` device the
+mesh runs on gloo.
+"""
+
+import gc
+import os
+from datetime import timedelta
+
+import torch
+import torch.distributed as dist
+from torch.distributed.device_mesh import init_device_mesh
+
+from utils.logging import k_log
+
+# commands go over their own gloo group, so idle ranks can wait for the next
+# job in a broadcast for as long as the UI stays up
+COMMAND_TIMEOUT = timedelta(days=365)
+
+_mesh = None
+_command_group = None
+
+
+def tp_world():
+    try:
+        return int(os.environ["LOCAL_RANK"]), int(os.environ["WORLD_SIZE"])
+    except (KeyError, ValueError):
+        return 0, 1
+
+
+def is_tp_worker():
+    rank, world_size = tp_world()
+    return world_size > 1 and rank > 0
+
+
+def tp_device(device, rank):
+    device = torch.device(device)
+    if device.type == "cuda" and torch.cuda.is_available():
+        return torch.device(f"cuda:{rank}")
+    return torch.device("cpu")
+
+
+def init_tp_mesh(device):
+    global _mesh, _command_group
+
+    if _mesh is None:
+        device = torch.device(device)
+        rank, world_size = tp_world()
+
+        if not dist.is_initialized():
+            if device.type == "cuda":
+                torch.cuda.set_device(device)
+            dist.init_process_group(backend="nccl" if device.type == "cuda" else "gloo")
+
+        _mesh = init_device_mesh(
+            device.type, (world_size,), mesh_dim_names=("tensor_parallel",)
+        )
+        _command_group = dist.new_group(backend="gloo", timeout=COMMAND_TIMEOUT)
+        k_log(f"tensor parallel mesh ready: rank {rank} of {world_size} on {device}")
+
+    return _mesh
+
+
+def move_tensors(value, device):
+    if isinstance(value, torch.Tensor):
+        return value.to(device)
+    if isinstance(value, dict):
+        return {key: move_tensors(item, device) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(move_tensors(item, device) for item in value)
+    return value
+
+
+def send_command(name, **kwargs):
+    if _command_group is None:
+        return
+    command = [(name, move_tensors(kwargs, "cpu"))]
+    dist.broadcast_object_list(command, src=0, group=_command_group)
+
+
+def receive_command():
+    command = [None]
+    dist.broadcast_object_list(command, src=0, group=_command_group)
+    return command[0]
+
+
+def free_memory(device):
+    gc.collect()
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+
+
+def serve(kubin):
+    """
+    Command loop of the ranks other than 0, returns on the "stop" command.
+    """
+    from omegaconf import OmegaConf
+
+    from .generation_utils import denoise
+    from .magcache_profiles import set_profile_cache_dir
+    from .models.parallelize import parallelize_dit
+    from .utils import configure_runtime, load_dit
+
+    rank, world_size = tp_world()
+    device = tp_device(kubin.params("general", "device"), rank)
+    set_profile_cache_dir(kubin.params("general", "cache_dir"))
+    mesh = init_tp_mesh(device)
+
+    dit, conf = None, None
+    while True:
+        name, kwargs = receive_command()
+
+        if name == "load":
+            dit = None
+            free_memory(device)
+
+            configure_runtime(
+                kwargs["use_torch_compile_dit"],
+                kwargs["use_torch_compile_vae"],
+                kwargs["use_flash_attention"],
+            )
+            conf = OmegaConf.create(kwargs["conf"])
+            dit = load_dit(conf, device)
+            dit = parallelize_dit(dit, mesh["tensor_parallel"])
+            k_log(f"rank {rank}: DiT shard loaded")
+
+        elif name == "denoise":
+            denoise(dit, conf, device, **move_tensors(kwargs, device))
+
+        elif name == "unload":
+            dit, conf = None, None
+            free_memory(device)
+            k_log(f"rank {rank}: DiT shard released")
+
+        elif name == "stop":
+            break
+
+    k_log(f"rank {rank}: stopped serving")
+
+
+def stop_workers():
+    send_command("stop")
@@ -13,7 +13,14 @@ import torch
 import time
 from tqdm import tqdm
 
-from .models.utils import fast_sta_nabla
+from .models.attention import bind_attention
+from .models.utils import nabla_mask_cache, sta_mask_cache
+from .enhance import is_enhance_enabled
+from progress import calibrate_preview, report_progress
+from utils.block_offload import block_offloader
+from utils.tracing import DEBUG, tracer
+
+trace = tracer("generate")
 
 
 def log_vram_usage(stage_name: str):
@@ -21,20 +28,22 @@ def log_vram_usage(stage_name: str):
     if torch.cuda.is_available():
         current_vram = torch.cuda.memory_allocated() / (1024**3)  # GB
         peak_vram = torch.cuda.max_memory_allocated() / (1024**3)  # GB
-        print(
+        trace.log(
             f"  {stage_name} VRAM - Current: {current_vram:.2f} GB | Peak: {peak_vram:.2f} GB"
         )
     else:
-        print(f"  {stage_name} - CUDA not available")
+        trace.log(f"  {stage_name} - CUDA not available")
 
 
 def get_sparse_params(conf, batch_embeds, device):
     assert conf.model.dit_params.patch_size[0] == 1
     T, H, W, _ = batch_embeds["visual"].shape
-    print(f"\n{'='*80}")
-    print(f"GET_SPARSE_PARAMS - Computing sequence length:")
-    print(f"Visual embed shape (raw): {batch_embeds['visual'].shape} [T, H, W, C]")
-    print(f"Patch size: {conf.model.dit_params.patch_size}")
+    trace.log(f"\n{'='*80}", DEBUG)
+    trace.log(f"GET_SPARSE_PARAMS - Computing sequence length:", DEBUG)
+    trace.log(
+        f"Visual embed shape (raw): {batch_embeds['visual'].shape} [T, H, W, C]", DEBUG
+    )
+    trace.log(f"Patch size: {conf.model.dit_params.patch_size}", DEBUG)
 
     T, H, W = (
         T // conf.model.dit_params.patch_size[0],
@@ -42,18 +51,19 @@ def get_sparse_params(conf, batch_embeds, device):
         W // conf.model.dit_params.patch_size[2],
     )
 
-    print(f"After patching: T={T}, H={H}, W={W}")
-    print(f"Attention type: {conf.model.attention.type}")
+    trace.log(f"After patching: T={T}, H={H}, W={W}", DEBUG)
+    trace.log(f"Attention type: {conf.model.attention.type}", DEBUG)
 
     if conf.model.attention.type == "nabla":
-        print(f"Creating NABLA sparse params:")
-        print(f"  STA dimensions: T={T}, H//8={H//8}, W//8={W//8}")
-        print(f"  Sequence length will be: T*H*W = {T*H*W}")
-        print(
-            f"  Nabla params: P={conf.model.attention.P}, wT={conf.model.attention.wT}, wH={conf.model.attention.wH}, wW={conf.model.attention.wW}"
+        trace.log(f"Creating NABLA sparse params:", DEBUG)
+        trace.log(f"  STA dimensions: T={T}, H//8={H//8}, W//8={W//8}", DEBUG)
+        trace.log(f"  Sequence length will be: T*H*W = {T*H*W}", DEBUG)
+        trace.log(
+            f"  Nabla params: P={conf.model.attention.P}, wT={conf.model.attention.wT}, wH={conf.model.attention.wH}, wW={conf.model.attention.wW}",
+            DEBUG,
         )
 
-        sta_mask = fast_sta_nabla(
+        sta_mask = sta_mask_cache.get(
             T,
             H // 8,
             W // 8,
@@ -62,7 +72,7 @@ def get_sparse_params(conf, batch_embeds, device):
             conf.model.attention.wW,
             device=device,
         )
-        print(f"  STA mask created with shape: {sta_mask.shape}")
+        trace.log(f"  STA mask created with shape: {sta_mask.shape}", DEBUG)
 
         sparse_params = {
             "sta_mask": sta_mask.unsqueeze_(0).unsqueeze_(0),
@@ -75,17 +85,51 @@ def get_sparse_params(conf, batch_embeds, device):
             "add_sta": conf.model.attention.add_sta,
             "visual_shape": (T, H, W),
             "method": getattr(conf.model.attention, "method", "topcdf"),
+            # block mask reuse across steps (models.utils.NablaMaskCache);
+            # generate sets the step, get_velocity the CFG branch
+            "mask_refresh_steps": getattr(
+                conf.model.attention, "mask_refresh_steps", 1
+            ),
+            "mask_drift_threshold": getattr(
+                conf.model.attention, "mask_drift_threshold", 0.0
+            ),
+            "step": None,
+            "branch": 0,
         }
-        print(f"  STA mask shape (after unsqueeze): {sparse_params['sta_mask'].shape}")
-        print(f"{'='*80}\n")
+        trace.log(
+            f"  STA mask shape (after unsqueeze): {sparse_params['sta_mask'].shape}",
+            DEBUG,
+        )
+        trace.log(f"{'='*80}\n", DEBUG)
     else:
-        print(f"Using standard attention (no sparse params)")
-        print(f"{'='*80}\n")
+        trace.log(f"Using standard attention (no sparse params)", DEBUG)
+        trace.log(f"{'='*80}\n", DEBUG)
         sparse_params = None
 
     return sparse_params
 
 
+def can_batch_cfg(dit, visual_shape, device):
+    """Check whether one extra CFG branch worth of DiT activations fits in VRAM."""
+    if not hasattr(dit, "forward_cfg"):
+        return False
+    if device.type != "cuda":
+        return True
+
+    duration, height, width = visual_shape[:3]
+    patch_size = dit.patch_size
+    visual_tokens = (
+        duration // patch_size[0] * (height // patch_size[1]) * (width // patch_size[2])
+    )
+    ff_dim = dit.visual_transformer_blocks[0].feed_forward.in_layer.out_features
+    # residual stream, q/k/v, attention output and feed-forward hidden state
+    # of the second branch in bf16, doubled as headroom for the allocator
+    required = visual_tokens * (6 * dit.model_dim + ff_dim) * 2 * 2
+
+    free_memory, _ = torch.cuda.mem_get_info(device)
+    return free_memory > required
+
+
 @torch.no_grad()
 def get_velocity(
     dit,
@@ -99,7 +143,23 @@ def get_velocity(
     guidance_weight,
     conf,
     sparse_params=None,
+    batched_cfg=False,
 ):
+    if batched_cfg and abs(guidance_weight - 1.0) > 1e-6:
+        pred_velocity, uncond_pred_velocity = dit.forward_cfg(
+            x,
+            [text_embeds["text_embeds"], null_text_embeds["text_embeds"]],
+            [text_embeds["pooled_embed"], null_text_embeds["pooled_embed"]],
+            t * 1000,
+            visual_rope_pos,
+            [text_rope_pos, null_text_rope_pos],
+            scale_factor=conf.metrics.scale_factor,
+            sparse_params=sparse_params,
+        ).unbind(0)
+        return uncond_pred_velocity + guidance_weight * (
+            pred_velocity - uncond_pred_velocity
+        )
+
     pred_velocity = dit(
         x,
         text_embeds["text_embeds"],
@@ -119,7 +179,9 @@ def get_velocity(
             visual_rope_pos,
             null_text_rope_pos,
             scale_factor=conf.metrics.scale_factor,
-            sparse_params=sparse_params,
+            sparse_params=(
+                dict(sparse_params, branch=1) if sparse_params is not None else None
+            ),
         )
         pred_velocity = uncond_pred_velocity + guidance_weight * (
             pred_velocity - uncond_pred_velocity
@@ -143,19 +205,35 @@ def generate(
     conf,
     progress=False,
     seed=6554,
+    batched_cfg=False,
 ):
-    g = torch.Generator(device="cuda")
+    g = torch.Generator(device=device)
     g.manual_seed(seed)
     img = torch.randn(*shape, device=device, generator=g)
 
     sparse_params = get_sparse_params(conf, {"visual": img}, device)
+
+    use_batched_cfg = (
+        batched_cfg
+        and abs(guidance_weight - 1.0) > 1e-6
+        and not is_enhance_enabled()
+        and can_batch_cfg(model, shape, device)
+    )
+    if batched_cfg and abs(guidance_weight - 1.0) > 1e-6:
+        trace.log(
+            f"CFG mode: {'batched (single batch-2 forward)' if use_batched_cfg else 'sequential'}"
+        )
+
     timesteps = torch.linspace(1, 0, num_steps + 1, device=device)
     timesteps = scheduler_scale * timesteps / (1 + (scheduler_scale - 1) * timesteps)
 
-    for timestep, timestep_diff in tqdm(
-        list(zip(timesteps[:-1], torch.diff(timesteps)))
+    host_timesteps = timesteps.tolist()
+    for step, (timestep, timestep_diff) in enumerate(
+        tqdm(list(zip(timesteps[:-1], torch.diff(timesteps))))
     ):
         time = timestep.unsqueeze(0)
+        if sparse_params is not None:
+            sparse_params["step"] = step
         if model.visual_cond:
             visual_cond = torch.zeros_like(img)
             visual_cond_mask = torch.zeros(
@@ -164,7 +242,7 @@ def generate(
             model_input = torch.cat([img, visual_cond, visual_cond_mask], dim=-1)
         else:
             model_input = img
-        pred_velocity = get_velocity(
+        velocity_args = (
             model,
             model_input,
             time,
@@ -175,12 +253,225 @@ def generate(
             null_text_rope_pos,
             guidance_weight,
             conf,
-            sparse_params=sparse_params,
         )
+        try:
+            pred_velocity = get_velocity(
+                *velocity_args,
+                sparse_params=sparse_params,
+                batched_cfg=use_batched_cfg,
+            )
+        except torch.cuda.OutOfMemoryError:
+            if not use_batched_cfg:
+                raise
+            print(
+                "  ⚠️  Batched CFG ran out of memory - falling back to sequential CFG"
+            )
+            use_batched_cfg = False
+            torch.cuda.empty_cache()
+            pred_velocity = get_velocity(
+                *velocity_args, sparse_params=sparse_params, batched_cfg=False
+            )
         img = img + timestep_diff * pred_velocity
+        report_progress(
+            "text2video",
+            "dit",
+            num_steps,
+            step + 1,
+            host_timesteps[step],
+            img,
+            latent_format="hunyuan_video",
+        )
+
+    nabla_mask_cache.report()
+    nabla_mask_cache.clear()
     return img
 
 
+def prepare_magcache(dit, conf, magcache, guidance_weight, num_steps, shape):
+    # Handle magcache state: setup/reset if enabled, disable if not requested
+    from .magcache_profiles import magcache_key, magcache_ratios
+    from .magcache_utils import (
+        reset_magcache_state,
+        disable_magcache,
+        set_magcache_params,
+    )
+
+    if not magcache:
+        # Disable magcache if it was previously enabled but now disabled in UI
+        disable_magcache(dit)
+        return
+
+    no_cfg = abs(guidance_weight - 1.0) < 0.01
+    if os.environ.get("MAGCACHE_CALIBRATE", "0") == "1":
+        set_magcache_params(
+            dit,
+            [],
+            num_steps,
+            no_cfg,
+            calibrate=True,
+            profile=magcache_key(conf, shape, num_steps, no_cfg),
+        )
+        return
+
+    # the closest calibrated profile for this resolution, length and step
+    # count, the config ratios otherwise
+    mag_ratios, source = magcache_ratios(conf, shape, num_steps, no_cfg)
+    if mag_ratios is None:
+        print("   ⚠️  Magcache requested but config missing mag_ratios")
+        return
+
+    thresh = (
+        float(getattr(conf.magcache, "threshold", 0.12))
+        if hasattr(conf, "magcache")
+        else 0.12
+    )
+    if (
+        getattr(dit, "_magcache_enabled", False)
+        and getattr(dit, "magcache_source", None) == source
+        and dit.num_steps == num_steps * 2
+        and dit.no_cfg == no_cfg
+        and dit.magcache_thresh == thresh
+    ):
+        # Magcache already set up for these ratios - just reset state
+        reset_magcache_state(dit)
+        return
+
+    trace.log(f"   → Setting up Magcache ({source} ratios, threshold {thresh})", DEBUG)
+    set_magcache_params(
+        dit, mag_ratios, num_steps, no_cfg, thresh=thresh, source=source
+    )
+
+
+def denoise(
+    dit,
+    conf,
+    device,
+    shape,
+    num_steps,
+    text_embeds,
+    null_text_embeds,
+    text_length,
+    null_text_length,
+    guidance_weight,
+    scheduler_scale,
+    seed,
+    magcache=False,
+    progress=False,
+    batched_cfg=False,
+):
+    """
+    Phase 2 of ``generate_sample``, from noise to the final latents. Under
+    tensor parallelism rank 0 calls it from ``generate_sample`` and every other
+    rank with the same arguments from ``distributed.serve``.
+    """
+    bs, duration, height, width, dim = shape
+
+    visual_rope_pos = [
+        torch.arange(duration),
+        torch.arange(height // conf.model.dit_params.patch_size[1]),
+        torch.arange(width // conf.model.dit_params.patch_size[2]),
+    ]
+    text_rope_pos = torch.arange(text_length)
+    null_text_rope_pos = torch.arange(null_text_length)
+
+    prepare_magcache(dit, conf, magcache, guidance_weight, num_steps, shape)
+    bind_attention(dit, device)
+
+    with torch.no_grad():
+        # Use autocast only if CUDA is available, otherwise run without it
+        autocast_context = (
+            torch.autocast(device_type="cuda", dtype=torch.bfloat16)
+            if device.type == "cuda"
+            else torch.no_grad()
+        )
+        with autocast_context:
+            return generate(
+                dit,
+                device,
+                (bs * duration, height, width, dim),
+                num_steps,
+                text_embeds,
+                null_text_embeds,
+                visual_rope_pos,
+                text_rope_pos,
+                null_text_rope_pos,
+                guidance_weight,
+                scheduler_scale,
+                conf,
+                seed=seed,
+                progress=progress,
+                batched_cfg=batched_cfg,
+            )
+
+
+def encode_prompts(text_embedder, caption, negative_caption, type_of_content, device):
+    """
+    Phase 1 of ``generate_sample``: embeddings of both prompts on ``device``
+    and their token counts.
+    """
+    with torch.no_grad():
+        text_embeds, text_cu_seqlens = text_embedder.encode(
+            [caption], type_of_content=type_of_content
+        )
+        null_text_embeds, null_text_cu_seqlens = text_embedder.encode(
+            [negative_caption], type_of_content=type_of_content
+        )
+
+    for key in text_embeds:
+        text_embeds[key] = text_embeds[key].to(device=device)
+        null_text_embeds[key] = null_text_embeds[key].to(device=device)
+
+    return (
+        text_embeds,
+        null_text_embeds,
+        text_cu_seqlens[-1].item(),
+        null_text_cu_seqlens[-1].item(),
+    )
+
+
+def decode_latents(vae, latent_visual, bs, vae_device, stream_writer=None):
+    """
+    Phase 3 of ``generate_sample``: uint8 ``[bs, 3, frames, H, W]`` images,
+    or ``None`` once the frames have been handed to ``stream_writer``.
+    """
+    vae_device = torch.device(vae_device)
+    with torch.no_grad():
+        # Use autocast only if CUDA is available, otherwise run without it
+        autocast_context = (
+            torch.autocast(device_type="cuda", dtype=torch.bfloat16)
+            if vae_device.type == "cuda"
+            else torch.no_grad()
+        )
+        with autocast_context:
+            images = latent_visual.reshape(
+                bs,
+                -1,
+                latent_visual.shape[-3],
+                latent_visual.shape[-2],
+                latent_visual.shape[-1],
+            )
+            images = images.to(device=vae_device)
+            images = (images / vae.config.scaling_factor).permute(0, 4, 1, 2, 3)
+            if stream_writer is not None:
+                trace.log("  → Streaming decoded frames to the video encoder", DEBUG)
+                try:
+                    for index, chunk in enumerate(vae.decode_stream(images)):
+                        if index == 0:
+                            calibrate_preview(
+                                "hunyuan_video", (chunk[0, :, 0] + 1.0) / 2.0
+                            )
+                        chunk = ((chunk.clamp(-1.0, 1.0) + 1.0) * 127.5).to(torch.uint8)
+                        stream_writer.write(chunk[0].permute(1, 2, 3, 0).cpu().numpy())
+                finally:
+                    stream_writer.close()
+                trace.log(f"  → Encoded {stream_writer.frames_written} frames", DEBUG)
+                return None
+
+            images = vae.decode(images).sample
+            calibrate_preview("hunyuan_video", (images[0, :, 0] + 1.0) / 2.0)
+            return ((images.clamp(-1.0, 1.0) + 1.0) * 127.5).to(torch.uint8)
+
+
 def generate_sample(
     shape,
     caption,
@@ -200,9 +491,23 @@ def generate_sample(
     offload=False,
     dit_is_quantized=False,
     text_embedder_is_quantized=False,
+    quantized_cache_dir=None,
     return_loaded_models=False,
     magcache=False,
+    batched_cfg=False,
+    stream_writer=None,
+    world_size=1,
+    offload_resident_blocks=0,
 ):
+    """
+    When ``stream_writer`` is given (a ``StreamingVideoWriter``), decoded
+    frames are handed to it chunk by chunk and ``None`` is returned in place
+    of the image tensor.
+
+    With ``offload`` and ``offload_resident_blocks`` > 0 the visual DiT blocks
+    stay in pinned host memory and at most that many are on the GPU at once
+    (``utils.block_offload``); quantized DiTs are moved as a whole.
+    """
     bs, duration, height, width, dim = shape
     if duration == 1:
         type_of_content = "image"
@@ -220,34 +525,48 @@ def generate_sample(
         else "STANDARD"
     )
 
-    print(f"\n{'='*80}")
-    print(f"🔧 ATTENTION CONFIGURATION:")
-    print(f"  Kernel (all models): {attn_mode.upper()}")
-    print(f"  DIT sparse pattern: {dit_arch}")
-    print(f"{'='*80}\n")
+    trace.log(f"\n{'='*80}", DEBUG)
+    trace.log(f"🔧 ATTENTION CONFIGURATION:", DEBUG)
+    trace.log(f"  Kernel (all models): {attn_mode.upper()}", DEBUG)
+    trace.log(f"  DIT sparse pattern: {dit_arch}", DEBUG)
+    trace.log(f"{'='*80}\n", DEBUG)
+
+    prompts_cached = all(
+        hasattr(text_embedder, "is_cached")
+        and text_embedder.is_cached([prompt], type_of_content=type_of_content)
+        for prompt in (caption, negative_caption)
+    )
 
     # Text embedder should already be on GPU if offload is enabled (moved in pipeline)
-    print(f"Offload: Phase 1 - Text encoding on {text_embedder_device}")
+    if prompts_cached:
+        trace.log("Offload: Phase 1 - Prompt embeddings served from cache")
+    else:
+        trace.log(f"Offload: Phase 1 - Text encoding on {text_embedder_device}")
 
     phase1_start = time.time()
     if torch.cuda.is_available():
         torch.cuda.reset_peak_memory_stats()
-    with torch.no_grad():
-        bs_text_embed, text_cu_seqlens = text_embedder.encode(
-            [caption], type_of_content=type_of_content
-        )
-        bs_null_text_embed, null_text_cu_seqlens = text_embedder.encode(
-            [negative_caption], type_of_content=type_of_content
-        )
+    (
+        bs_text_embed,
+        bs_null_text_embed,
+        text_cu_seqlens,
+        null_text_cu_seqlens,
+    ) = encode_prompts(
+        text_embedder, caption, negative_caption, type_of_content, device
+    )
 
     phase1_time = time.time() - phase1_start
-    print(f"  ⏱️  Phase 1 (Text Encoding) completed in {phase1_time:.2f}s")
+    trace.log(f"  ⏱️  Phase 1 (Text Encoding) completed in {phase1_time:.2f}s")
 
-    if offload:
+    if offload and prompts_cached:
+        trace.log("Offload: Phase 1 complete - Text embedder was not needed on GPU")
+    elif offload:
         log_vram_usage("Text Embedder")
         if text_embedder_is_quantized:
-            print("Offload: Phase 1 complete - Moving quantized text embedder to CPU")
-            print(f"  → Using .to() method to preserve quantization state")
+            trace.log(
+                "Offload: Phase 1 complete - Moving quantized text embedder to CPU"
+            )
+            trace.log(f"  → Using .to() method to preserve quantization state", DEBUG)
             try:
                 if hasattr(text_embedder, "embedder") and hasattr(
                     text_embedder.embedder, "model"
@@ -261,7 +580,7 @@ def generate_sample(
                     text_embedder.clip_embedder.model = (
                         text_embedder.clip_embedder.model.to("cpu")
                     )
-                print(f"  → Quantized text embedder moved to CPU")
+                trace.log(f"  → Quantized text embedder moved to CPU", DEBUG)
             except Exception as e:
                 print(f"  ⚠️  ERROR moving quantized text embedder: {e}")
             torch.cuda.empty_cache()
@@ -269,7 +588,7 @@ def generate_sample(
 
             gc.collect()
         else:
-            print(
+            trace.log(
                 "Offload: Phase 1 complete - Moving text embedder to CPU (text processing done)"
             )
             text_embedder.to("cpu")
@@ -278,25 +597,18 @@ def generate_sample(
 
             gc.collect()
 
-    for key in bs_text_embed:
-        bs_text_embed[key] = bs_text_embed[key].to(device=device)
-        bs_null_text_embed[key] = bs_null_text_embed[key].to(device=device)
-    text_cu_seqlens = text_cu_seqlens.to(device=device)[-1].item()
-    null_text_cu_seqlens = null_text_cu_seqlens.to(device=device)[-1].item()
-
-    visual_rope_pos = [
-        torch.arange(duration),
-        torch.arange(shape[-3] // conf.model.dit_params.patch_size[1]),
-        torch.arange(shape[-2] // conf.model.dit_params.patch_size[2]),
-    ]
-    text_rope_pos = torch.arange(text_cu_seqlens)
-    null_text_rope_pos = torch.arange(null_text_cu_seqlens)
+    use_block_offload = (
+        offload
+        and offload_resident_blocks > 0
+        and not dit_is_quantized
+        and device.type == "cuda"
+    )
 
     # Load DIT if it wasn't loaded yet (deferred loading in offload mode)
     if dit is None and offload:
-        print("DEFERRED LOADING: Loading DIT model now (after text processing)")
+        trace.log("DEFERRED LOADING: Loading DIT model now (after text processing)")
         from .models.dit import get_dit
-        from .magcache_utils import set_magcache_params, disable_magcache
+        from .utils import use_fused_qkv
         from safetensors.torch import load_file
 
         # Get deferred loading params from somewhere - they should be passed in
@@ -350,88 +662,96 @@ def generate_sample(
         if full_model_path is None:
             raise FileNotFoundError(f"No model file found in {checkpoint_path}")
 
-        print(f"   → Loading DIT weights from: {full_model_path}")
+        trace.log(f"   → Loading DIT weights from: {full_model_path}", DEBUG)
 
         # Load weights - for CUDA, load directly to GPU to save one copy operation
-        if device.type == "cuda":
-            print(f"   → Loading weights directly to {device}")
+        if device.type == "cuda" and not use_block_offload:
+            trace.log(f"   → Loading weights directly to {device}", DEBUG)
             state_dict = load_file(full_model_path, device=str(device))
             dit.load_state_dict(state_dict, assign=True)
             # Parameters are now on GPU, but buffers are still on CPU
             # .to() is smart - it only moves what's not already there
             dit = dit.to(device)
-            print(f"   → Model fully moved to {device}")
+            trace.log(f"   → Model fully moved to {device}", DEBUG)
         else:
             state_dict = load_file(full_model_path)
             dit.load_state_dict(state_dict, assign=True)
+        del state_dict
+
+        if use_fused_qkv(conf):
+            dit.fuse_qkv()
 
         # Apply quantization if needed (passed via generate_sample params)
         if dit_is_quantized:
             from .model_kd50_env import quantize_with_torch_ao
 
-            print("   → Applying int8 quantization to DIT")
-            dit = quantize_with_torch_ao(dit)
-
-        # Apply magcache if needed (deferred loading during offload)
-        if (
-            magcache
-            and hasattr(conf, "magcache")
-            and hasattr(conf.magcache, "mag_ratios")
-        ):
-            print("   → Setting up Magcache (deferred)")
-            mag_ratios = conf.magcache.mag_ratios
-            no_cfg = abs(guidance_weight - 1.0) < 0.01
-            calibrate_mode = os.environ.get("MAGCACHE_CALIBRATE", "0") == "1"
-            set_magcache_params(
-                dit, mag_ratios, num_steps, no_cfg, calibrate=calibrate_mode
-            )
-        elif magcache:
-            print("   ⚠️  Magcache requested but config missing mag_ratios")
-        else:
-            # Ensure magcache is disabled
-            disable_magcache(dit)
+            trace.log("   → Applying int8 quantization to DIT", DEBUG)
+            dit = quantize_with_torch_ao(dit, cache_dir=quantized_cache_dir)
 
-        print(f"   → DIT loaded and ready (weights on {next(dit.parameters()).device})")
+        trace.log(
+            f"   → DIT loaded and ready (weights on {next(dit.parameters()).device})",
+            DEBUG,
+        )
 
     current_device = next(dit.parameters()).device
 
-    if dit_is_quantized and offload and current_device.type == "cpu":
-        print(f"Offload: Phase 2 - Moving quantized DIT from CPU to {device}")
-        print(f"  → Using .to() method to preserve quantization state")
+    offloader = (
+        block_offloader(
+            dit, dit.visual_transformer_blocks, device, offload_resident_blocks
+        )
+        if use_block_offload
+        else None
+    )
+    if offloader is not None:
+        trace.log(
+            f"Offload: Phase 2 - Streaming DIT blocks to {device}, {offloader.resident_blocks} resident at a time"
+        )
+        offloader.load()
+    elif dit_is_quantized and offload and current_device.type == "cpu":
+        trace.log(f"Offload: Phase 2 - Moving quantized DIT from CPU to {device}")
+        trace.log(f"  → Using .to() method to preserve quantization state", DEBUG)
         try:
             dit = dit.to(device)
             actual_device = next(dit.parameters()).device
-            print(f"  → DIT now on: {actual_device}")
+            trace.log(f"  → DIT now on: {actual_device}", DEBUG)
         except Exception as e:
             print(f"  ⚠️  ERROR moving quantized DIT: {e}")
     elif dit_is_quantized and offload:
-        print(f"Offload: Phase 2 - Quantized DIT already on {current_device} (ready)")
+        trace.log(
+            f"Offload: Phase 2 - Quantized DIT already on {current_device} (ready)"
+        )
     elif offload and current_device.type == "cpu":
-        print(
+        trace.log(
             f"Offload: Phase 2 - Moving DIT from CPU to {device} for latent generation"
         )
-        print(f"  → Target device: {device}, type: {device.type}")
+        trace.log(f"  → Target device: {device}, type: {device.type}", DEBUG)
         try:
             dit.to(device)  # This modifies in-place
             actual_device = next(dit.parameters()).device
-            print(f"  → DIT now on: {actual_device} (type: {actual_device.type})")
+            trace.log(
+                f"  → DIT now on: {actual_device} (type: {actual_device.type})", DEBUG
+            )
             if actual_device.type != "cuda":
                 print(
                     f"  ⚠️  WARNING: DIT failed to move to GPU! Still on {actual_device}"
                 )
             else:
-                print("  ✓ TEXT PROCESSING COMPLETE - Starting DIT LATENT GENERATION")
+                trace.log(
+                    "  ✓ TEXT PROCESSING COMPLETE - Starting DIT LATENT GENERATION"
+                )
         except Exception as e:
             print(f"  ⚠️  ERROR moving DIT to GPU: {e}")
     elif offload and current_device.type == "cuda":
-        print(
+        trace.log(
             f"Offload: Phase 2 - DIT already on {current_device} (ready for generation)"
         )
     else:
-        print(f"Offload: Phase 2 - DIT already on {current_device} (offload disabled)")
+        trace.log(
+            f"Offload: Phase 2 - DIT already on {current_device} (offload disabled)"
+        )
 
     dit_gen_device = next(dit.parameters()).device
-    print(
+    trace.log(
         f"Offload: Phase 2 - Starting latent generation with DIT on: {dit_gen_device}"
     )
     if dit_gen_device.type == "cpu" and device.type == "cuda":
@@ -439,81 +759,52 @@ def generate_sample(
             "  ⚠️  CRITICAL: DIT is on CPU but should be on GPU! This will be VERY slow!"
         )
 
-    # Handle magcache state: setup/reset if enabled, disable if not requested
-    from .magcache_utils import (
-        reset_magcache_state,
-        disable_magcache,
-        set_magcache_params,
+    denoise_args = dict(
+        shape=shape,
+        num_steps=num_steps,
+        text_embeds=bs_text_embed,
+        null_text_embeds=bs_null_text_embed,
+        text_length=text_cu_seqlens,
+        null_text_length=null_text_cu_seqlens,
+        guidance_weight=guidance_weight,
+        scheduler_scale=scheduler_scale,
+        seed=seed,
+        magcache=magcache,
+        progress=progress,
+        batched_cfg=batched_cfg,
     )
+    if world_size > 1:
+        from .distributed import send_command
 
-    if magcache:
-        # Check if magcache is already enabled, if not, set it up
-        if not (hasattr(dit, "_magcache_enabled") and dit._magcache_enabled):
-            # Magcache not enabled - set it up now
-            if hasattr(conf, "magcache") and hasattr(conf.magcache, "mag_ratios"):
-                print("   → Setting up Magcache (was disabled, now enabling)")
-                mag_ratios = conf.magcache.mag_ratios
-                no_cfg = abs(guidance_weight - 1.0) < 0.01
-                calibrate_mode = os.environ.get("MAGCACHE_CALIBRATE", "0") == "1"
-                set_magcache_params(
-                    dit, mag_ratios, num_steps, no_cfg, calibrate=calibrate_mode
-                )
-            else:
-                print("   ⚠️  Magcache requested but config missing mag_ratios")
-        else:
-            # Magcache already enabled - just reset state for new generation
-            reset_magcache_state(dit)
-    else:
-        # Disable magcache if it was previously enabled but now disabled in UI
-        disable_magcache(dit)
+        send_command("denoise", **denoise_args)
 
     phase2_start = time.time()
     if torch.cuda.is_available():
         torch.cuda.reset_peak_memory_stats()
-    with torch.no_grad():
-        # Use autocast only if CUDA is available, otherwise run without it
-        autocast_context = (
-            torch.autocast(device_type="cuda", dtype=torch.bfloat16)
-            if device.type == "cuda"
-            else torch.no_grad()
-        )
-        with autocast_context:
-            latent_visual = generate(
-                dit,
-                device,
-                (bs * duration, height, width, dim),
-                num_steps,
-                bs_text_embed,
-                bs_null_text_embed,
-                visual_rope_pos,
-                text_rope_pos,
-                null_text_rope_pos,
-                guidance_weight,
-                scheduler_scale,
-                conf,
-                seed=seed,
-                progress=progress,
-            )
+    latent_visual = denoise(dit, conf, device, **denoise_args)
 
     phase2_time = time.time() - phase2_start
-    print(f"  ⏱️  Phase 2 (DIT Latent Generation) completed in {phase2_time:.2f}s")
+    trace.log(f"  ⏱️  Phase 2 (DIT Latent Generation) completed in {phase2_time:.2f}s")
 
     if offload:
         log_vram_usage("DIT")
-        if dit_is_quantized:
-            print("Offload: Phase 2 complete - Moving quantized DIT back to CPU")
-            print(f"  → Using .to() method to preserve quantization state")
+        if offloader is not None:
+            trace.log("Offload: Phase 2 complete - Dropping DIT blocks from the GPU")
+            offloader.release()
+        elif dit_is_quantized:
+            trace.log("Offload: Phase 2 complete - Moving quantized DIT back to CPU")
+            trace.log(f"  → Using .to() method to preserve quantization state", DEBUG)
             try:
                 dit = dit.to("cpu")
                 dit_after = next(dit.parameters()).device
-                print(f"  → Quantized DIT moved back to: {dit_after}")
+                trace.log(f"  → Quantized DIT moved back to: {dit_after}", DEBUG)
             except Exception as e:
                 print(f"  ⚠️  ERROR moving quantized DIT to CPU: {e}")
         else:
-            print("Offload: Phase 2 complete - Moving DIT back to CPU")
+            trace.log("Offload: Phase 2 complete - Moving DIT back to CPU")
             dit.to("cpu")
             dit_after = next(dit.parameters()).device
-            print(f"  → DIT moved back to: {dit_after}")
+            trace.log(f"  → DIT moved back to: {dit_after}", DEBUG)
         torch.cuda.empty_cache()
         import gc
 
@@ -523,54 +814,36 @@ def generate_sample(
 
     # Load VAE if it wasn't loaded yet (deferred loading in offload mode)
     if vae is None and offload:
-        print("DEFERRED LOADING: Loading VAE model now (for video decoding)")
+        trace.log("DEFERRED LOADING: Loading VAE model now (for video decoding)")
         from .models.vae import build_vae
 
         vae_low_vram_mode = conf.model.vae.get("low_vram_mode", False)
         vae = build_vae(conf.model.vae, low_vram_mode=vae_low_vram_mode)
         vae = vae.eval()
-        print(f"   → VAE loaded and ready")
+        trace.log(f"   → VAE loaded and ready", DEBUG)
 
     if offload:
-        print(f"Offload: Phase 3 - Moving VAE to {vae_device} for video decoding")
+        trace.log(f"Offload: Phase 3 - Moving VAE to {vae_device} for video decoding")
         vae.to(vae_device)
         vae_actual = next(vae.parameters()).device
-        print(f"  → VAE now on: {vae_actual}")
+        trace.log(f"  → VAE now on: {vae_actual}", DEBUG)
 
-    print("Offload: Phase 3 - VAE decoding latents to final video...")
+    trace.log("Offload: Phase 3 - VAE decoding latents to final video...")
 
     phase3_start = time.time()
     if torch.cuda.is_available():
         torch.cuda.reset_peak_memory_stats()
-    with torch.no_grad():
-        # Use autocast only if CUDA is available, otherwise run without it
-        autocast_context = (
-            torch.autocast(device_type="cuda", dtype=torch.bfloat16)
-            if device.type == "cuda"
-            else torch.no_grad()
-        )
-        with autocast_context:
-            images = latent_visual.reshape(
-                bs,
-                -1,
-                latent_visual.shape[-3],
-                latent_visual.shape[-2],
-                latent_visual.shape[-1],
-            )
-            images = images.to(device=vae_device)
-            images = (images / vae.config.scaling_factor).permute(0, 4, 1, 2, 3)
-            images = vae.decode(images).sample
-            images = ((images.clamp(-1.0, 1.0) + 1.0) * 127.5).to(torch.uint8)
+    images = decode_latents(vae, latent_visual, bs, vae_device, stream_writer)
 
     phase3_time = time.time() - phase3_start
-    print(f"  ⏱️  Phase 3 (VAE Decoding) completed in {phase3_time:.2f}s")
+    trace.log(f"  ⏱️  Phase 3 (VAE Decoding) completed in {phase3_time:.2f}s")
 
     if offload:
         log_vram_usage("VAE")
-        print("Offload: Phase 3 complete - Moving VAE back to CPU")
+        trace.log("Offload: Phase 3 complete - Moving VAE back to CPU")
         vae.to("cpu")
         vae_after = next(vae.parameters()).device
-        print(f"  → VAE moved back to: {vae_after}")
+        trace.log(f"  → VAE moved back to: {vae_after}", DEBUG)
         torch.cuda.empty_cache()
         import gc
 
@@ -579,19 +852,19 @@ def generate_sample(
         torch.cuda.empty_cache()
 
     total_time = time.time() - total_start_time
-    print(f"\n{'='*60}")
-    print(f"⏱️  TOTAL GENERATION TIME: {total_time:.2f}s")
-    print(
+    trace.log(f"\n{'='*60}")
+    trace.log(f"⏱️  TOTAL GENERATION TIME: {total_time:.2f}s")
+    trace.log(
         f"  Phase 1 (Text Encoding):     {phase1_time:.2f}s ({phase1_time/total_time*100:.1f}%)"
     )
-    print(
+    trace.log(
         f"  Phase 2 (DIT Generation):    {phase2_time:.2f}s ({phase2_time/total_time*100:.1f}%)"
     )
-    print(
+    trace.log(
         f"  Phase 3 (VAE Decoding):      {phase3_time:.2f}s ({phase3_time/total_time*100:.1f}%)"
     )
-    print(f"{'='*60}\n")
-    print("Offload: All phases complete - Video generation finished!")
+    trace.log(f"{'='*60}\n")
+    trace.log("Offload: All phases complete - Video generation finished!")
 
     if return_loaded_models:
         return images, dit, vae
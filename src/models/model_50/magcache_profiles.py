@@ -0,0 +1,143 @@
+"""
+Calibrated MagCache ratio profiles, kept per (variant, resolution, frame count,
+step count, CFG on/off) in one JSON file.
+
+``magcache_ratios`` picks the profile closest to a generation and falls back to
+the ``magcache.mag_ratios`` of the YAML config when the variant has none.
+Profiles are written by the calibration forward pass, see
+``src/calibrate_magcache.py``.
+"""
+
+import json
+import math
+import os
+import time
+
+PROFILES_FILE = "magcache_profiles.json"
+
+_cache_dir = None
+
+
+def set_profile_cache_dir(cache_dir):
+    # general.cache_dir of the process, see Model_KD50 and distributed.serve
+    global _cache_dir
+    _cache_dir = cache_dir
+
+
+def profile_store_path():
+    path = os.environ.get("KD50_MAGCACHE_PROFILES")
+    if path:
+        return path
+    # resolved like the weights in Model_KD50.prepare_model
+    cache_dir = os.environ.get("KD50_CACHE_DIR", _cache_dir or "./weights/")
+    return os.path.join(os.path.abspath(os.path.normpath(cache_dir)), PROFILES_FILE)
+
+
+def magcache_variant(conf):
+    # profiles follow the weights rather than the config name, so edited
+    # configs of the same checkpoint share them
+    checkpoint_path = str(conf.model.checkpoint_path).rstrip("/\\")
+    return os.path.splitext(os.path.basename(checkpoint_path))[0]
+
+
+def profile_key(variant, height, width, frames, num_steps, cfg):
+    return {
+        "variant": variant,
+        "height": int(height),
+        "width": int(width),
+        "frames": int(frames),
+        "num_steps": int(num_steps),
+        "cfg": bool(cfg),
+    }
+
+
+def profile_distance(profile, key):
+    # resolution and length count by their relative difference, the step
+    # count less since mismatching ratios are interpolated to it anyway
+    pixels = (profile["height"] * profile["width"]) / (key["height"] * key["width"])
+    return (
+        abs(math.log(pixels))
+        + abs(math.log(profile["frames"] / key["frames"]))
+        + 0.5 * abs(math.log(profile["num_steps"] / key["num_steps"]))
+    )
+
+
+class MagcacheProfileStore:
+    def __init__(self, path=None):
+        self.path = path or profile_store_path()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f).get("profiles", [])
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Cannot read Magcache profiles from {self.path}: {e}")
+            return []
+
+    def save(self, key, mag_ratios):
+        profiles = [
+            profile
+            for profile in self.load()
+            if any(profile.get(name) != value for name, value in key.items())
+        ]
+        profiles.append(
+            dict(
+                key,
+                mag_ratios=[round(float(ratio), 5) for ratio in mag_ratios],
+                created=time.strftime("%Y-%m-%d %H:%M:%S"),
+            )
+        )
+        profiles.sort(
+            key=lambda p: (
+                p["variant"],
+                p["cfg"],
+                p["height"] * p["width"],
+                p["frames"],
+                p["num_steps"],
+            )
+        )
+
+        # written under a temporary name so a concurrent reader never sees a
+        # partial file
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"profiles": profiles}, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def closest(self, key):
+        candidates = [
+            profile
+            for profile in self.load()
+            if profile.get("variant") == key["variant"]
+            and profile.get("cfg") == key["cfg"]
+            and profile.get("mag_ratios")
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda profile: profile_distance(profile, key))
+
+
+def magcache_key(conf, shape, num_steps, no_cfg):
+    _, frames, height, width, _ = shape
+    return profile_key(
+        magcache_variant(conf), height * 8, width * 8, frames, num_steps, not no_cfg
+    )
+
+
+def magcache_ratios(conf, shape, num_steps, no_cfg):
+    """
+    ``(mag_ratios, source)`` for a generation of latent ``shape``: the closest
+    calibrated profile, else the config ratios, else ``(None, None)``.
+    """
+    key = magcache_key(conf, shape, num_steps, no_cfg)
+    profile = MagcacheProfileStore().closest(key)
+    if profile is not None:
+        source = f"profile {profile['height']}x{profile['width']}x{profile['frames']}, {profile['num_steps']} steps"
+        return list(profile["mag_ratios"]), source
+
+    if hasattr(conf, "magcache") and hasattr(conf.magcache, "mag_ratios"):
+        return list(conf.magcache.mag_ratios), "config"
+    return None, None
@@ -7,10 +7,18 @@ The code has been adopted from Kandinsky-5
 
 # This is an adaptation of Magcache from https://github.com/Zehong-Ma/MagCache/
 
+import os
+
 import numpy as np
 import torch
 
-from .models.nn import kd5_compile
+from utils.tracing import DEBUG, tracer
+
+# 0: silent, 1: setup and summary, 2: every forward pass (KUBIN_TRACE
+# magcache=N takes precedence)
+trace = tracer(
+    "magcache", default_level=int(os.environ.get("KD5_MAGCACHE_LOG", "1"))
+)
 
 
 def nearest_interp(src_array, target_length):
@@ -23,7 +31,99 @@ def nearest_interp(src_array, target_length):
     return src_array[mapped_indices]
 
 
-def set_magcache_params(dit, mag_ratios, num_steps, no_cfg, calibrate=False):
+def magcache_schedule(mag_ratios, num_steps, thresh, K, retention_ratio):
+    """
+    Skip decision of every forward pass, as ``(skip, err, consecutive)``.
+
+    The accumulators of a branch (even passes conditional, odd passes
+    unconditional) only grow from pass to pass and restart whenever a pass is
+    computed, so the whole schedule follows from the ratios up front. A pass
+    is never skipped before its branch has computed one.
+    """
+    retention_start = int(num_steps * retention_ratio)
+    ratio, steps, err = [1.0, 1.0], [0, 0], [0.0, 0.0]
+    schedule = []
+    for cnt in range(num_steps):
+        branch = cnt % 2
+        if cnt < retention_start:
+            schedule.append((False, err[branch], steps[branch]))
+            continue
+
+        ratio[branch] *= float(mag_ratios[cnt])
+        steps[branch] += 1
+        err[branch] += abs(1 - ratio[branch])
+
+        if cnt >= 2 and err[branch] < thresh and steps[branch] <= K:
+            schedule.append((True, err[branch], steps[branch]))
+        else:
+            ratio[branch], steps[branch], err[branch] = 1.0, 0, 0.0
+            schedule.append((False, 0.0, 0))
+    return schedule
+
+
+def set_magcache_schedule(dit):
+    schedule = magcache_schedule(
+        dit.mag_ratios,
+        dit.num_steps,
+        dit.magcache_thresh,
+        dit.K,
+        dit.retention_ratio,
+    )
+    dit.magcache_skip = [skip for skip, _, _ in schedule]
+    dit.magcache_err = [(err, consecutive) for _, err, consecutive in schedule]
+    # the residual of a pass is only needed when the next pass of the same
+    # branch reuses it
+    dit.magcache_keep_residual = [
+        cnt + 2 < dit.num_steps and dit.magcache_skip[cnt + 2]
+        for cnt in range(dit.num_steps)
+    ]
+    trace.log(
+        f"   → Schedule: {sum(dit.magcache_skip)} of {dit.num_steps} forward passes skipped"
+    )
+
+
+def magcache_residual_buffer(self, branch, like):
+    """
+    Residual slot of ``branch``, reused across steps and generations and only
+    reallocated when the visual embedding changes shape, dtype or device.
+    """
+    buffer = self.residual_cache[branch]
+    if (
+        buffer is None
+        or buffer.shape != like.shape
+        or buffer.dtype != like.dtype
+        or buffer.device != like.device
+    ):
+        buffer = torch.empty_like(like, memory_format=torch.contiguous_format)
+        self.residual_cache[branch] = buffer
+    return buffer
+
+
+def magcache_store_residual(self, cnt, output, visual_embed):
+    if self.magcache_keep_residual[cnt]:
+        buffer = magcache_residual_buffer(self, cnt % 2, output)
+        torch.sub(output, visual_embed, out=buffer)
+
+
+def magcache_log_skip(self, cnt):
+    if trace.debug:
+        err, consecutive = self.magcache_err[cnt]
+        trace.log(
+            f"⚡ Magcache: Forward pass {cnt}/{self.num_steps} SKIPPED (err: {err:.4f}, consecutive: {consecutive})",
+            DEBUG,
+        )
+
+
+def set_magcache_params(
+    dit,
+    mag_ratios,
+    num_steps,
+    no_cfg,
+    calibrate=False,
+    thresh=0.12,
+    source="config",
+    profile=None,
+):
     """
     Setup magcache on the DIT model.
 
@@ -33,33 +133,45 @@ def set_magcache_params(dit, mag_ratios, num_steps, no_cfg, calibrate=False):
         num_steps: Number of denoising steps
         no_cfg: Whether this is a no-CFG model
         calibrate: If True, run calibration mode to compute mag_ratios
+        thresh: Accumulated error up to which forward passes are skipped
+        source: Where mag_ratios come from ("config" or a calibrated profile)
+        profile: Profile key the calibrated ratios are stored under
     """
     if calibrate:
-        print(f"🔬 Initializing Magcache CALIBRATION mode")
+        trace.log(f"🔬 Initializing Magcache CALIBRATION mode")
     else:
-        print(f"🚀 Initializing Magcache")
-    print(f"   → Mode: {'no_cfg (counter +2)' if no_cfg else 'cfg (counter +1)'}")
-    print(f"   → Num steps: {num_steps}")
-    print(f"   → Total steps: {num_steps * 2}")
+        trace.log(f"🚀 Initializing Magcache")
+    trace.log(
+        f"   → Mode: {'no_cfg (counter +2)' if no_cfg else 'cfg (counter +1)'}"
+    )
+    trace.log(f"   → Num steps: {num_steps}")
+    trace.log(f"   → Total steps: {num_steps * 2}")
 
     # Store original forward method if not already stored
     if not hasattr(dit.__class__, "_original_forward"):
         dit.__class__._original_forward = dit.__class__.forward
+    if hasattr(dit.__class__, "forward_cfg") and not hasattr(
+        dit.__class__, "_original_forward_cfg"
+    ):
+        dit.__class__._original_forward_cfg = dit.__class__.forward_cfg
 
     # Choose forward method based on calibrate flag
     if calibrate:
         dit.__class__.forward = magcache_calibration
+        if hasattr(dit.__class__, "_original_forward_cfg"):
+            dit.__class__.forward_cfg = magcache_calibration_cfg
+        dit.magcache_profile = profile
         # Initialize calibration tracking lists
         dit.norm_ratio = []
         dit.norm_std = []
         dit.cos_dis = []
-        print(f"   → Using CALIBRATION forward (will compute mag_ratios)")
+        trace.log(f"   → Using CALIBRATION forward (will compute mag_ratios)")
     else:
         dit.__class__.forward = magcache_forward
-        dit.accumulated_err = [0.0, 0.0]
-        dit.accumulated_steps = [0, 0]
-        dit.accumulated_ratio = [1.0, 1.0]
-        dit.magcache_thresh = 0.12
+        if hasattr(dit.__class__, "_original_forward_cfg"):
+            dit.__class__.forward_cfg = magcache_forward_cfg
+        dit.magcache_thresh = thresh
+        dit.magcache_source = source
         dit.K = 2
         dit.retention_ratio = 0.2
         dit.mag_ratios = np.array([1.0] * 2 + mag_ratios)
@@ -68,7 +180,7 @@ def set_magcache_params(dit, mag_ratios, num_steps, no_cfg, calibrate=False):
         dit._compute_count = 0
 
         if len(dit.mag_ratios) != num_steps * 2:
-            print(
+            trace.log(
                 f"   → Interpolating mag_ratios: {len(dit.mag_ratios)} -> {num_steps * 2}"
             )
             mag_ratio_con = nearest_interp(dit.mag_ratios[0::2], num_steps)
@@ -84,17 +196,23 @@ def set_magcache_params(dit, mag_ratios, num_steps, no_cfg, calibrate=False):
     dit.no_cfg = no_cfg
 
     if calibrate:
-        print(f"✓ Calibration mode initialized - will save results to JSON files")
+        trace.log(
+            f"✓ Calibration mode initialized - will save results to {'the profile store' if profile is not None else 'JSON files'}"
+        )
     else:
-        print(f"✓ Magcache initialized successfully")
+        set_magcache_schedule(dit)
+        trace.log(f"✓ Magcache initialized successfully")
 
 
 def disable_magcache(dit):
     """Disable magcache and restore original forward method."""
     if hasattr(dit.__class__, "_original_forward"):
         dit.__class__.forward = dit.__class__._original_forward
+        if hasattr(dit.__class__, "_original_forward_cfg"):
+            dit.__class__.forward_cfg = dit.__class__._original_forward_cfg
         dit._magcache_enabled = False
-        print("✓ Magcache disabled, restored original forward method")
+        dit.residual_cache = [None, None]
+        trace.log("✓ Magcache disabled, restored original forward method")
 
 
 def reset_magcache_state(dit):
@@ -102,18 +220,40 @@ def reset_magcache_state(dit):
     if hasattr(dit, "_magcache_enabled") and dit._magcache_enabled:
         old_cnt = dit.cnt
         dit.cnt = 0
-        dit.accumulated_ratio = [1.0, 1.0]
-        dit.accumulated_err = [0.0, 0.0]
-        dit.accumulated_steps = [0, 0]
-        dit.residual_cache = [None, None]
         if hasattr(dit, "_skip_count"):
             dit._skip_count = 0
         if hasattr(dit, "_compute_count"):
             dit._compute_count = 0
-        print(f"🔄 Magcache state reset for new generation (cnt: {old_cnt} -> {dit.cnt})")
+        trace.log(
+            f"🔄 Magcache state reset for new generation (cnt: {old_cnt} -> {dit.cnt})"
+        )
+
+
+def magcache_finish_generation(self):
+    if self.cnt < self.num_steps:
+        return
+
+    total_processed = self._skip_count + self._compute_count
+    trace.log(f"")
+    trace.log(f"✓ Magcache Summary:")
+    trace.log(f"   → Total forward passes: {self.num_steps}")
+    trace.log(f"   → Passes processed: {total_processed}")
+    trace.log(f"   → Passes computed: {self._compute_count}")
+    trace.log(f"   → Passes skipped: {self._skip_count}")
+    if total_processed > 0:
+        trace.log(f"   → Skip ratio: {self._skip_count/total_processed*100:.1f}%")
+        trace.log(
+            f"   → Performance gain: {self._skip_count/self.num_steps*100:.1f}%"
+        )
+    trace.log(f"")
+    self.cnt = 0
+    self._skip_count = 0
+    self._compute_count = 0
 
 
-@kd5_compile(mode="max-autotune-no-cudagraphs")
+# Not compiled as a whole: the skip lookup by step counter stays in Python and
+# the embedding, block and output modules compile on their own, so no graph
+# is specialized on (and recompiled for) the counter.
 def magcache_forward(
     self,
     x,
@@ -154,56 +294,22 @@ def magcache_forward(
         )
     )
 
-    skip_forward = False
     ori_visual_embed = visual_embed
 
-    # Debug: Log first forward pass to verify reset worked
     if self.cnt == 0:
-        print(f"🎬 Magcache: Starting new generation (cnt={self.cnt})")
+        trace.log(f"🎬 Magcache: Starting new generation (cnt={self.cnt})", DEBUG)
 
-    retention_start = int(self.num_steps * self.retention_ratio)
-    if self.cnt >= retention_start:
-        cur_mag_ratio = self.mag_ratios[self.cnt]
-        self.accumulated_ratio[self.cnt % 2] = (
-            self.accumulated_ratio[self.cnt % 2] * cur_mag_ratio
-        )
-        self.accumulated_steps[self.cnt % 2] += 1
-        cur_skip_err = np.abs(1 - self.accumulated_ratio[self.cnt % 2])
-        self.accumulated_err[self.cnt % 2] += cur_skip_err
-
-        can_skip = (
-            self.accumulated_err[self.cnt % 2] < self.magcache_thresh
-            and self.accumulated_steps[self.cnt % 2] <= self.K
-        )
-
-        if can_skip:
-            skip_forward = True
-            residual_visual_embed = self.residual_cache[self.cnt % 2]
-        else:
-            # Log why we're NOT skipping
-            if self.cnt == retention_start:
-                print(
-                    f"🔍 Magcache: Starting from forward pass {retention_start} (retention_ratio={self.retention_ratio})"
-                )
-            self.accumulated_err[self.cnt % 2] = 0
-            self.accumulated_steps[self.cnt % 2] = 0
-            self.accumulated_ratio[self.cnt % 2] = 1.0
-
-    if skip_forward:
-        visual_embed = visual_embed + residual_visual_embed
+    if self.magcache_skip[self.cnt]:
+        visual_embed = visual_embed + self.residual_cache[self.cnt % 2]
         self._skip_count += 1
-        print(
-            f"⚡ Magcache: Forward pass {self.cnt}/{self.num_steps} SKIPPED (err: {self.accumulated_err[self.cnt % 2]:.4f}, consecutive: {self.accumulated_steps[self.cnt % 2]})"
-        )
+        magcache_log_skip(self, self.cnt)
     else:
         self._compute_count += 1
         for visual_transformer_block in self.visual_transformer_blocks:
             visual_embed = visual_transformer_block(
                 visual_embed, text_embed, time_embed, visual_rope, sparse_params
             )
-        residual_visual_embed = visual_embed - ori_visual_embed
-
-    self.residual_cache[self.cnt % 2] = residual_visual_embed
+        magcache_store_residual(self, self.cnt, visual_embed, ori_visual_embed)
 
     x = self.after_blocks(
         visual_embed, visual_shape, to_fractal, text_embed, time_embed
@@ -216,24 +322,103 @@ def magcache_forward(
     else:
         self.cnt += 1
 
-    if self.cnt >= self.num_steps:
-        total_processed = self._skip_count + self._compute_count
-        print(f"")
-        print(f"✓ Magcache Summary:")
-        print(f"   → Total forward passes: {self.num_steps}")
-        print(f"   → Passes processed: {total_processed}")
-        print(f"   → Passes computed: {self._compute_count}")
-        print(f"   → Passes skipped: {self._skip_count}")
-        if total_processed > 0:
-            print(f"   → Skip ratio: {self._skip_count/total_processed*100:.1f}%")
-            print(f"   → Performance gain: {self._skip_count/self.num_steps*100:.1f}%")
-        print(f"")
-        self.cnt = 0
-        self.accumulated_ratio = [1.0, 1.0]
-        self.accumulated_err = [0.0, 0.0]
-        self.accumulated_steps = [0, 0]
-        self._skip_count = 0
-        self._compute_count = 0
+    magcache_finish_generation(self)
+    return x
+
+
+def magcache_forward_cfg(
+    self,
+    x,
+    text_embeds,
+    pooled_text_embeds,
+    time,
+    visual_rope_pos,
+    text_rope_pos,
+    scale_factor=(1.0, 1.0, 1.0),
+    sparse_params=None,
+):
+    """
+    Batched-CFG counterpart of ``magcache_forward``. One call covers the
+    conditional (even counter) and unconditional (odd counter) passes, so the
+    skip decision and ``residual_cache`` slot are looked up per branch.
+    Branches that cannot be skipped are computed together; residuals and
+    counters are only written after the blocks succeed, so an OOM fallback to
+    sequential CFG stays consistent.
+    """
+    if not getattr(self, "_magcache_enabled", False) or not hasattr(self, "cnt"):
+        return self.__class__._original_forward_cfg(
+            self,
+            x,
+            text_embeds,
+            pooled_text_embeds,
+            time,
+            visual_rope_pos,
+            text_rope_pos,
+            scale_factor,
+            sparse_params,
+        )
+
+    (
+        text_embeds,
+        time_embed,
+        visual_embed,
+        visual_shape,
+        to_fractal,
+        visual_rope,
+    ) = self.before_cfg_blocks(
+        x,
+        text_embeds,
+        pooled_text_embeds,
+        time,
+        visual_rope_pos,
+        text_rope_pos,
+        scale_factor,
+        sparse_params,
+    )
+
+    if self.cnt == 0:
+        trace.log(f"🎬 Magcache: Starting new generation (cnt={self.cnt})", DEBUG)
+
+    counters = [self.cnt + branch for branch in range(len(text_embeds))]
+    skips = [self.magcache_skip[cnt] for cnt in counters]
+    computed = [branch for branch, skip in enumerate(skips) if not skip]
+
+    outputs = [
+        visual_embed + self.residual_cache[cnt % 2] if skip else None
+        for cnt, skip in zip(counters, skips)
+    ]
+    if computed:
+        computed_embed = self.visual_cfg_blocks(
+            visual_embed,
+            [text_embeds[branch] for branch in computed],
+            time_embed[computed],
+            visual_rope,
+            # the NABLA masks of a branch subset are kept apart from the
+            # other subsets (models.utils.NablaMaskCache)
+            (
+                dict(sparse_params, branch=tuple(computed))
+                if sparse_params is not None
+                else None
+            ),
+        )
+        for branch, branch_embed in zip(computed, computed_embed):
+            outputs[branch] = branch_embed
+
+    for cnt, skip, output in zip(counters, skips, outputs):
+        if skip:
+            self._skip_count += 1
+            magcache_log_skip(self, cnt)
+        else:
+            self._compute_count += 1
+            magcache_store_residual(self, cnt, output, visual_embed)
+
+    visual_embed = torch.stack(outputs)
+    x = self.after_cfg_blocks(
+        visual_embed, visual_shape, to_fractal, text_embeds, time_embed
+    )
+
+    self.cnt += len(counters)
+    magcache_finish_generation(self)
     return x
 
 
@@ -304,7 +489,7 @@ def magcache_calibration(
         self.norm_ratio.append(round(norm_ratio, 5))
         self.norm_std.append(round(norm_std, 5))
         self.cos_dis.append(round(cos_dis, 5))
-        print(
+        trace.log(
             f"📊 Calibration step {self.cnt}: norm_ratio={norm_ratio:.5f}, norm_std={norm_std:.5f}, cos_dis={cos_dis:.5f}"
         )
 
@@ -331,19 +516,85 @@ def magcache_calibration(
         print("\n📐 Cosine Distance:")
         print(self.cos_dis)
 
-        import json
-
-        with open("kandy_mag_ratio.json", "w") as f:
-            json.dump(self.norm_ratio, f, indent=2)
-        with open("kandy_mag_std.json", "w") as f:
-            json.dump(self.norm_std, f, indent=2)
-        with open("kandy_cos_dis.json", "w") as f:
-            json.dump(self.cos_dis, f, indent=2)
-
-        print("\n✓ Results saved to:")
-        print("  → kandy_mag_ratio.json (copy these values to your config!)")
-        print("  → kandy_mag_std.json")
-        print("  → kandy_cos_dis.json")
+        profile = getattr(self, "magcache_profile", None)
+        if profile is not None:
+            save_calibrated_profile(self, profile)
+        else:
+            import json
+
+            with open("kandy_mag_ratio.json", "w") as f:
+                json.dump(self.norm_ratio, f, indent=2)
+            with open("kandy_mag_std.json", "w") as f:
+                json.dump(self.norm_std, f, indent=2)
+            with open("kandy_cos_dis.json", "w") as f:
+                json.dump(self.cos_dis, f, indent=2)
+
+            print("\n✓ Results saved to:")
+            print("  → kandy_mag_ratio.json (copy these values to your config!)")
+            print("  → kandy_mag_std.json")
+            print("  → kandy_cos_dis.json")
         print("=" * 70 + "\n")
 
     return x
+
+
+def magcache_calibration_cfg(
+    self,
+    x,
+    text_embeds,
+    pooled_text_embeds,
+    time,
+    visual_rope_pos,
+    text_rope_pos,
+    scale_factor=(1.0, 1.0, 1.0),
+    sparse_params=None,
+):
+    """
+    Batched-CFG entry point during calibration: the branches are measured one
+    after the other, in the counter order of sequential CFG.
+    """
+    return torch.stack(
+        [
+            magcache_calibration(
+                self,
+                x,
+                text_embed,
+                pooled_text_embed,
+                time,
+                visual_rope_pos,
+                branch_text_rope_pos,
+                scale_factor,
+                (
+                    dict(sparse_params, branch=branch)
+                    if sparse_params is not None
+                    else None
+                ),
+            )
+            for branch, (
+                text_embed,
+                pooled_text_embed,
+                branch_text_rope_pos,
+            ) in enumerate(zip(text_embeds, pooled_text_embeds, text_rope_pos))
+        ]
+    )
+
+
+def save_calibrated_profile(self, profile):
+    from .distributed import tp_world
+    from .magcache_profiles import MagcacheProfileStore
+
+    # the other tensor-parallel ranks measure the same ratios
+    if tp_world()[0] != 0:
+        return
+
+    # same layout as the config ratios: one entry per forward pass from the
+    # third on, the unconditional passes of no-CFG models being 0
+    mag_ratios = self.norm_ratio
+    if getattr(self, "no_cfg", False):
+        mag_ratios = [value for ratio in mag_ratios for value in (ratio, 0)]
+
+    store = MagcacheProfileStore()
+    store.save(profile, mag_ratios)
+    print(
+        f"\n✓ Profile {profile['variant']} {profile['height']}x{profile['width']}x{profile['frames']}, {profile['num_steps']} steps, cfg={profile['cfg']} saved to {store.path}"
+    )
@@ -4,6 +4,7 @@ import random
 import re
 import json
 from datetime import datetime
+from types import SimpleNamespace
 
 import numpy as np
 import torch
@@ -33,6 +34,13 @@ from models.model_50.utils import get_T2V_pipeline
 from models.model_50.t2v_pipeline import Kandinsky5T2VPipeline
 from models.model_50.model_kd50_env import Model_KD50_Environment
 from models.model_50.ui_config_manager import UIConfigManager
+from models.model_50.distributed import (
+    init_tp_mesh,
+    send_command,
+    tp_device,
+    tp_world,
+)
+from models.model_50.magcache_profiles import set_profile_cache_dir
 
 
 class Model_KD50:
@@ -44,6 +52,18 @@ class Model_KD50:
         self.current_config_name = None
         self.current_torch_compile_state = None
         self.config_manager = UIConfigManager()
+        self.reserved_paths = set()
+        set_profile_cache_dir(self.kparams("general", "cache_dir"))
+
+        # the other tensor-parallel ranks wait in distributed.serve from
+        # startup, so rank 0 joins the mesh right away as well
+        rank, world_size = tp_world()
+        if world_size > 1:
+            init_tp_mesh(tp_device(self.kparams("general", "device"), rank))
+
+    def affinity(self, task, params):
+        pipeline_args = params.get("pipeline_args", {})
+        return (task, pipeline_args.get("config_name", "5s_sft"))
 
     def prepare_model(self, task, config_name, kd50_conf, use_custom_config=False):
         k_log(f"task queued: {task}")
@@ -283,9 +303,15 @@ class Model_KD50:
                     magcache=use_magcache,
                     quantize_dit=use_dit_int8_ao_quantization,
                     quantize_text_embedder=use_text_embedder_int8_ao_quantization,
+                    quantized_cache_dir=(
+                        os.path.join(cache_dir, "quantized")
+                        if use_save_quantized_weights
+                        else None
+                    ),
                     use_torch_compile_dit=use_torch_compile_dit,
                     use_torch_compile_vae=use_torch_compile_vae,
                     use_flash_attention=use_flash_attention,
+                    offload_resident_blocks=environment.offload_resident_blocks,
                 )
 
                 self.t2v_pipe.conf = conf
@@ -348,6 +374,42 @@ class Model_KD50:
         return os.path.join(configs_dir, config_file)
 
     def t2v(self, params):
+        job, pipeline_kwargs = self.t2v_job(params)
+        try:
+            result = self.t2v_pipe(**pipeline_kwargs)
+        finally:
+            self.reserved_paths.discard(job.save_video_path)
+        return self.t2v_result(params, job, result)
+
+    def t2v_many(self, params_list):
+        """
+        Runs text2video jobs sharing one config back to back with
+        ``Kandinsky5T2VPipeline.pipelined``, yielding ``(output, error)`` per
+        job in order.
+        """
+        jobs, results = [], None
+        try:
+            for params in params_list:
+                jobs.append(self.t2v_job(params))
+            results = self.t2v_pipe.pipelined([kwargs for _, kwargs in jobs])
+            for params, (job, _), (result, error) in zip(params_list, jobs, results):
+                self.reserved_paths.discard(job.save_video_path)
+                if error is not None:
+                    yield None, error
+                    continue
+                try:
+                    yield self.t2v_result(params, job, result), None
+                except Exception as e:
+                    yield None, e
+        finally:
+            # stops the pipeline stages, then releases the paths of the jobs
+            # left over by a failure or an early close of the generator
+            if results is not None:
+                results.close()
+            for job, _ in jobs:
+                self.reserved_paths.discard(job.save_video_path)
+
+    def t2v_job(self, params):
         task = "text2video"
 
         config_name = params["pipeline_args"].get("config_name", "5s_sft")
@@ -409,7 +471,6 @@ class Model_KD50:
         use_custom_config = False  # Old system disabled, use YAML configs only
         self.prepare_model(task, config_name, kd50_conf, use_custom_config)
 
-        save_image_path = None
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         save_video_path = os.path.join(
             params.get(
@@ -418,10 +479,31 @@ class Model_KD50:
             ),
             f"k5v-{config_name}-{timestamp}-{'_'.join(prompt.split()[:5])}.mp4",
         )
-
+        # jobs started within the same second would share a file name
+        base_path, extension = os.path.splitext(save_video_path)
+        suffix = 1
+        while os.path.exists(save_video_path) or save_video_path in self.reserved_paths:
+            suffix += 1
+            save_video_path = f"{base_path}-{suffix}{extension}"
         os.makedirs(os.path.dirname(save_video_path), exist_ok=True)
+        self.reserved_paths.add(save_video_path)
 
-        result = self.t2v_pipe(
+        job = SimpleNamespace(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            config_name=config_name,
+            width=width,
+            height=height,
+            time_length=time_length,
+            seed=seed,
+            num_steps=num_steps,
+            guidance_weight=guidance_weight,
+            expand_prompts=expand_prompts,
+            generate_image=generate_image,
+            timestamp=timestamp,
+            save_video_path=save_video_path,
+        )
+        pipeline_kwargs = dict(
             text=prompt,
             negative_caption=negative_prompt,
             save_path=save_video_path if not generate_image else None,
@@ -436,6 +518,18 @@ class Model_KD50:
             magcache=params.get("magcache", None),
             enhance_options=enhance_options,
         )
+        return job, pipeline_kwargs
+
+    def t2v_result(self, params, job, result):
+        task = "text2video"
+        prompt, negative_prompt = job.prompt, job.negative_prompt
+        config_name, timestamp = job.config_name, job.timestamp
+        width, height, time_length = job.width, job.height, job.time_length
+        seed, num_steps = job.seed, job.num_steps
+        guidance_weight, expand_prompts = job.guidance_weight, job.expand_prompts
+        generate_image, save_video_path = job.generate_image, job.save_video_path
+
+        save_image_path = None
 
         # Extract expanded prompt and actual result from dict
         expanded_prompt = None
@@ -538,6 +632,8 @@ class Model_KD50:
             self.current_config_name = None
             cleared = True
 
+            send_command("unload")
+
         if cleared:
             # Aggressive garbage collection
             gc.collect()
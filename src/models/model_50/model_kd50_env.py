@@ -9,7 +9,8 @@ from torchao.quantization import (
     int8_weight_only as tao_int8_weight_only,
 )
 
-from utils.logging import k_log
+from utils.env_data import load_env_value
+from utils.quantized_cache import quantize_cached
 
 tao_quantization = tao_int8_weight_only
 
@@ -21,6 +22,7 @@ class Model_KD50_Environment:
     use_dit_int8_ao_quantization: bool = False
     use_save_quantized_weights: bool = False
     use_text_embedder_int8_ao_quantization: bool = False
+    offload_resident_blocks: int = 4
 
     kd50_conf: DictConfig = None
 
@@ -43,11 +45,20 @@ class Model_KD50_Environment:
         self.use_text_embedder_int8_ao_quantization = (
             "kd50_text_embedder_int8_ao_quantization" in optimization_flags
         )
+        self.offload_resident_blocks = int(
+            load_env_value("KD50_OFFLOAD_RESIDENT_BLOCKS", self.offload_resident_blocks)
+        )
 
         return self
 
 
-def quantize_with_torch_ao(model, freeze=False, save_name=None):
+def quantize_with_torch_ao(model, freeze=False, cache_dir=None):
+    return quantize_cached(
+        model, "torchao_int8_weight_only", quantize_int8_weight_only, cache_dir
+    )
+
+
+def quantize_int8_weight_only(model):
     print("   Applying torchao int8_weight_only quantization...")
 
     initial_params = list(model.parameters())
@@ -101,11 +112,4 @@ def quantize_with_torch_ao(model, freeze=False, save_name=None):
         print(f"   ⚠️  WARNING: Quantization failed - no quantized tensor types found")
         print(f"   → Model is still using full precision weights")
 
-    if freeze:
-        print("   Freezing quantized weights...")
-        pass
-    if save_name is not None:
-        k_log(
-            "⚠️  Cannot (yet) save quantized weights with torch_ao - feature not implemented"
-        )
     return model
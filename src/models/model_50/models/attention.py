@@ -0,0 +1,246 @@
+"""
+Attention backends of the Kandinsky 5 DiT.
+
+A backend is a kernel taking query, key and value as [batch, seq, heads, dim]
+and returning [batch, seq, heads * dim]. Which one runs is decided by
+``bind_attention`` when the DiT is loaded (and again only if
+``KD5_ATTENTION_MODE`` changes): every attention module gets the kernel as
+``attention_fn``, so the forward pass does no environment lookups or
+branching. Kernels are imported on first use, and nothing touches CUDA on
+hosts without it.
+
+Modes: ``flash`` (FlashAttention 3 on Hopper, else 2), ``sage``, ``sdpa`` and
+``auto``, which times the available kernels once per input shape and keeps
+the fastest. Unavailable kernels fall back to ``sdpa``.
+"""
+
+import os
+import time
+
+import torch
+import torch.nn.functional as F
+
+AUTO_BENCHMARK_RUNS = 3
+
+
+class AttentionBackend:
+    def __init__(self, name, load):
+        self.name = name
+        self._load = load
+        self._kernels = {}
+
+    def kernel(self, device):
+        # (None when the library or the device does not support it)
+        device = torch.device(device)
+        if device.type not in self._kernels:
+            try:
+                self._kernels[device.type] = self._load(device)
+            except Exception as e:
+                print(f"⚠️  {self.name} attention unavailable: {e}")
+                self._kernels[device.type] = None
+        return self._kernels[device.type]
+
+
+ATTENTION_BACKENDS = {}
+
+
+def register_attention_backend(name, load):
+    ATTENTION_BACKENDS[name] = AttentionBackend(name, load)
+
+
+def _flatten_output(out):
+    if isinstance(out, tuple):  # FlashAttention 3 also returns the lse
+        out = out[0]
+    return out.flatten(-2, -1)
+
+
+def _load_flash(device):
+    if device.type != "cuda":
+        return None
+
+    flash_attn_func = None
+    if torch.cuda.get_device_capability(device)[0] >= 9:
+        try:
+            from flash_attn_interface import flash_attn_func  # type: ignore
+
+            print("✓ FlashAttention 3 found")
+        except ImportError:
+            pass
+    if flash_attn_func is None:
+        try:
+            from flash_attn import flash_attn_func
+
+            print("✓ FlashAttention 2 found")
+        except ImportError:
+            print("⚠️  Flash Attention not found - will use PyTorch SDPA fallback")
+            print("   Install FlashAttention with: pip install flash-attn")
+            return None
+
+    def flash(query, key, value):
+        return _flatten_output(flash_attn_func(q=query, k=key, v=value))
+
+    return flash
+
+
+def _load_sage(device):
+    if device.type != "cuda":
+        return None
+    try:
+        from sageattention import sageattn
+    except ImportError:
+        print("⚠️  Sage Attention not found - install with: pip install sageattention")
+        return None
+
+    def sage(query, key, value):
+        return (
+            sageattn(query.transpose(1, 2), key.transpose(1, 2), value.transpose(1, 2))
+            .transpose(1, 2)
+            .flatten(-2, -1)
+        )
+
+    return sage
+
+
+def _load_sdpa(device):
+    def sdpa(query, key, value):
+        return (
+            F.scaled_dot_product_attention(
+                query.transpose(1, 2),  # [B, heads, seq, dim]
+                key.transpose(1, 2),
+                value.transpose(1, 2),
+            )
+            .transpose(1, 2)
+            .flatten(-2, -1)
+        )
+
+    return sdpa
+
+
+register_attention_backend("flash", _load_flash)
+register_attention_backend("sage", _load_sage)
+register_attention_backend("sdpa", _load_sdpa)
+
+
+def attention_mode():
+    mode = os.environ.get("KD5_ATTENTION_MODE", "flash").lower()
+    # the "flash_sdpa" UI option keeps the flash mode for the text encoders
+    # and turns FlashAttention off for the DiT
+    if mode == "flash" and os.environ.get("KD5_USE_FLASH_ATTENTION", "1") == "0":
+        return "sdpa"
+    return mode
+
+
+def available_backends(device):
+    return {
+        name: kernel
+        for name, backend in ATTENTION_BACKENDS.items()
+        if (kernel := backend.kernel(device)) is not None
+    }
+
+
+def benchmark_attention(kernels, query, key, value, runs=AUTO_BENCHMARK_RUNS):
+    """
+    Seconds per call of each kernel on the given inputs, the first (warm-up)
+    call not counted. Kernels that fail are left out.
+    """
+    timings = {}
+    synchronize = (
+        torch.cuda.synchronize if query.device.type == "cuda" else (lambda: None)
+    )
+    for name, kernel in kernels.items():
+        try:
+            kernel(query, key, value)
+            synchronize()
+            start = time.perf_counter()
+            for _ in range(runs):
+                kernel(query, key, value)
+            synchronize()
+            timings[name] = (time.perf_counter() - start) / runs
+        except Exception as e:
+            print(f"⚠️  {name} attention failed during benchmark: {e}")
+    return timings
+
+
+class AutoAttention:
+    """
+    Dispatches to the fastest available kernel for each query/key shape and
+    dtype, timed on the first call with that shape.
+    """
+
+    def __init__(self, device):
+        self.kernels = available_backends(device)
+        self.choice = {}
+
+    @torch.compiler.disable
+    def __call__(self, query, key, value):
+        shape_key = (tuple(query.shape), tuple(key.shape), query.dtype)
+        kernel = self.choice.get(shape_key)
+        if kernel is None:
+            with torch.no_grad():
+                timings = benchmark_attention(self.kernels, query, key, value)
+            name = min(timings, key=timings.get)
+            print(
+                f"→ Attention for {tuple(query.shape)} x {tuple(key.shape)}: {name} ("
+                + ", ".join(
+                    f"{backend} {seconds * 1000:.2f} ms"
+                    for backend, seconds in timings.items()
+                )
+                + ")"
+            )
+            kernel = self.choice[shape_key] = self.kernels[name]
+        return kernel(query, key, value)
+
+
+_resolved = {}
+
+
+def resolve_attention(mode, device):
+    """
+    ``(name, kernel)`` for ``mode`` on ``device``, shared by all modules.
+    """
+    device = torch.device(device)
+    resolved = _resolved.get((mode, device.type))
+    if resolved is not None:
+        return resolved
+
+    if mode == "auto":
+        resolved = ("auto", AutoAttention(device))
+    else:
+        backend = ATTENTION_BACKENDS.get(mode)
+        kernel = backend.kernel(device) if backend is not None else None
+        if kernel is None:
+            if mode != "sdpa":
+                print(
+                    f"⚠️  {mode} attention requested but not available - falling back to PyTorch SDPA"
+                )
+            kernel = ATTENTION_BACKENDS["sdpa"].kernel(device)
+            resolved = ("sdpa", kernel)
+        else:
+            resolved = (mode, kernel)
+
+    _resolved[(mode, device.type)] = resolved
+    return resolved
+
+
+def bind_attention(model, device=None, mode=None):
+    """
+    Resolves the attention kernel for ``model`` and binds it to every module
+    with an ``attention_fn`` slot. A no-op when the model is already bound
+    for the same mode and device.
+    """
+    mode = mode or attention_mode()
+    if device is None:
+        param = next(model.parameters(), None)
+        device = param.device if param is not None else torch.device("cpu")
+    device = torch.device(device)
+
+    binding = (mode, device.type)
+    if getattr(model, "_attention_binding", None) == binding:
+        return
+    name, kernel = resolve_attention(mode, device)
+
+    for module in model.modules():
+        if hasattr(module, "attention_fn"):
+            module.attention_fn = kernel
+    model._attention_binding = binding
+    print(f"→ Using {name} attention (mode={mode}) on {device}")
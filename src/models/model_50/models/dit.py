@@ -144,6 +144,19 @@ class DiffusionTransformer3D(nn.Module):
 
         self.out_layer = OutLayer(model_dim, time_dim, out_visual_dim, patch_size)
 
+    def fuse_qkv(self, tp_size=1):
+        """
+        Packs the query, key and value projections of every attention module
+        into one linear layer. The visual blocks are split column-wise under
+        tensor parallelism (``parallelize_dit``), so their packed rows are
+        ordered shard by shard.
+        """
+        for block in self.text_transformer_blocks:
+            block.self_attention.fuse_qkv()
+        for block in self.visual_transformer_blocks:
+            block.self_attention.fuse_qkv(tp_size)
+            block.cross_attention.fuse_qkv(tp_size)
+
     @kd5_compile()
     def before_text_transformer_blocks(
         self, text_embed, time, pooled_text_embed, x, text_rope_pos
@@ -216,6 +229,118 @@ class DiffusionTransformer3D(nn.Module):
         )
         return x
 
+    def before_cfg_blocks(
+        self,
+        x,
+        text_embeds,
+        pooled_text_embeds,
+        time,
+        visual_rope_pos,
+        text_rope_pos,
+        scale_factor,
+        sparse_params,
+    ):
+        # Text sequences of the branches differ in length, so the text blocks
+        # run per branch; the visual stream is shared and batched afterwards
+        branch_text_embeds, branch_time_embeds = [], []
+        for text_embed, pooled_text_embed, branch_text_rope_pos in zip(
+            text_embeds, pooled_text_embeds, text_rope_pos
+        ):
+            text_embed, time_embed, text_rope, visual_embed = (
+                self.before_text_transformer_blocks(
+                    text_embed, time, pooled_text_embed, x, branch_text_rope_pos
+                )
+            )
+            for text_transformer_block in self.text_transformer_blocks:
+                text_embed = text_transformer_block(text_embed, time_embed, text_rope)
+            branch_text_embeds.append(text_embed)
+            branch_time_embeds.append(time_embed)
+
+        visual_embed, visual_shape, to_fractal, visual_rope = (
+            self.before_visual_transformer_blocks(
+                visual_embed, visual_rope_pos, scale_factor, sparse_params
+            )
+        )
+        time_embed = torch.stack(branch_time_embeds)
+        return (
+            branch_text_embeds,
+            time_embed,
+            visual_embed,
+            visual_shape,
+            to_fractal,
+            visual_rope,
+        )
+
+    def visual_cfg_blocks(
+        self, visual_embed, text_embeds, time_embed, visual_rope, sparse_params
+    ):
+        visual_embed = visual_embed.unsqueeze(0).expand(len(text_embeds), -1, -1)
+        for visual_transformer_block in self.visual_transformer_blocks:
+            visual_embed = visual_transformer_block(
+                visual_embed, text_embeds, time_embed, visual_rope, sparse_params
+            )
+        return visual_embed
+
+    def after_cfg_blocks(
+        self, visual_embed, visual_shape, to_fractal, text_embeds, time_embed
+    ):
+        return torch.stack(
+            [
+                self.after_blocks(
+                    visual_embed[i],
+                    visual_shape,
+                    to_fractal,
+                    text_embeds[i],
+                    time_embed[i],
+                )
+                for i in range(len(text_embeds))
+            ]
+        )
+
+    @kd5_compile(mode="max-autotune-no-cudagraphs")
+    def forward_cfg(
+        self,
+        x,
+        text_embeds,
+        pooled_text_embeds,
+        time,
+        visual_rope_pos,
+        text_rope_pos,
+        scale_factor=(1.0, 1.0, 1.0),
+        sparse_params=None,
+    ):
+        """
+        Run several guidance branches (conditional and unconditional) in one
+        batched forward. ``text_embeds``, ``pooled_text_embeds`` and
+        ``text_rope_pos`` hold one entry per branch; the stacked per-branch
+        predictions are returned.
+        """
+        (
+            text_embeds,
+            time_embed,
+            visual_embed,
+            visual_shape,
+            to_fractal,
+            visual_rope,
+        ) = self.before_cfg_blocks(
+            x,
+            text_embeds,
+            pooled_text_embeds,
+            time,
+            visual_rope_pos,
+            text_rope_pos,
+            scale_factor,
+            sparse_params,
+        )
+
+        visual_embed = self.visual_cfg_blocks(
+            visual_embed, text_embeds, time_embed, visual_rope, sparse_params
+        )
+
+        return self.after_cfg_blocks(
+            visual_embed, visual_shape, to_fractal, text_embeds, time_embed
+        )
+
 
 def get_dit(conf):
     dit = DiffusionTransformer3D(**conf)
@@ -8,14 +8,19 @@ The code has been adopted from Kandinsky-5
 
 import math
 import os
+from collections import OrderedDict
 
 import torch
 from torch import nn
 from torch.nn.attention.flex_attention import flex_attention
 
-from .utils import get_freqs, nablaT_v2
+from .attention import attention_mode, resolve_attention
+from .utils import get_freqs, nabla_mask_cache
+from utils.tracing import DEBUG, tracer
 from ..enhance import compute_enhance_multiplier, is_enhance_enabled
 
+trace = tracer("nabla")
+
 
 def kd5_compile(*args, **kwargs):
     def decorator(fn):
@@ -57,39 +62,12 @@ def kd5_compile(*args, **kwargs):
     return decorator
 
 
-if torch.cuda.get_device_capability()[0] >= 9:
-    try:
-        from flash_attn import flash_attn_func as FA
-
-        print("✓ FlashAttention 2 found")
-    except:
-        FA = None
-
-    try:
-        from flash_attn_interface import flash_attn_func as FA  # type: ignore
-
-        print("✓ FlashAttention 3 found (overriding FA2)")
-    except:
-        FA = FA
-else:
-    try:
-        from flash_attn import flash_attn_func as FA
-
-        print("✓ FlashAttention 2 found")
-    except:
-        FA = None
-
-if FA is None:
-    print("⚠️  Flash Attention not found - will use PyTorch SDPA fallback")
-    print("   Install FlashAttention with: pip install flash-attn")
-
-try:
-    from sageattention import sageattn
-
-    SAGE_ATTN = sageattn
-except ImportError:
-    SAGE_ATTN = None
-    print("⚠️  Sage Attention not found - install with: pip install sageattention")
+def to_attention_batch(query, key, value):
+    # Attention inputs are [seq, heads, dim] for a single branch and
+    # [batch, seq, heads, dim] when CFG branches are batched together
+    if query.dim() == 4:
+        return query, key, value, True
+    return query.unsqueeze(0), key.unsqueeze(0), value.unsqueeze(0), False
 
 
 @kd5_compile()
@@ -168,6 +146,49 @@ class VisualEmbeddings(nn.Module):
         return self.in_layer(x)
 
 
+ROPE_CACHE_SIZE = 4
+
+
+class RopeCache:
+    """
+    Rotary tables of the last few position sets. They only depend on the
+    positions (short host-side ranges, rebuilt identically for every step and
+    CFG branch) and the frequency buffer, whose device is part of the key.
+    """
+
+    def __init__(self, max_entries=ROPE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def key(self, args, positions, *extra):
+        # device-side positions would need a sync to be keyed
+        if any(pos.device.type != "cpu" for pos in positions):
+            return None
+        return (
+            args.device,
+            args.dtype,
+            tuple(tuple(pos.tolist()) for pos in positions),
+            *extra,
+        )
+
+    def get(self, key, compute):
+        if key is None:
+            return compute()
+
+        if self.entries and next(iter(self.entries))[0] != key[0]:
+            # the module moved, tables on the old device are of no use
+            self.entries.clear()
+
+        rope = self.entries.get(key)
+        if rope is None:
+            rope = self.entries[key] = compute()
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return rope
+
+
 class RoPE1D(nn.Module):
     def __init__(self, dim, max_pos=1024, max_period=10000.0):
         super().__init__()
@@ -177,9 +198,15 @@ class RoPE1D(nn.Module):
         freq = get_freqs(dim // 2, max_period)
         pos = torch.arange(max_pos, dtype=freq.dtype)
         self.register_buffer(f"args", torch.outer(pos, freq), persistent=False)
+        self.cache = RopeCache()
 
-    @torch.autocast(device_type="cuda", enabled=False)
     def forward(self, pos):
+        return self.cache.get(
+            self.cache.key(self.args, [pos]), lambda: self.compute(pos)
+        )
+
+    @torch.autocast(device_type="cuda", enabled=False)
+    def compute(self, pos):
         args = self.args[pos]
         cosine = torch.cos(args)
         sine = torch.sin(args)
@@ -199,9 +226,14 @@ class RoPE3D(nn.Module):
             freq = get_freqs(axes_dim // 2, max_period)
             pos = torch.arange(ax_max_pos, dtype=freq.dtype)
             self.register_buffer(f"args_{i}", torch.outer(pos, freq), persistent=False)
+        self.cache = RopeCache()
 
-    @torch.autocast(device_type="cuda", enabled=False)
     def forward(self, shape, pos, scale_factor=(1.0, 1.0, 1.0)):
+        key = self.cache.key(self.args_0, pos, tuple(shape), tuple(scale_factor))
+        return self.cache.get(key, lambda: self.compute(shape, pos, scale_factor))
+
+    @torch.autocast(device_type="cuda", enabled=False)
+    def compute(self, shape, pos, scale_factor=(1.0, 1.0, 1.0)):
         duration, height, width = shape
         args_t = self.args_0[pos[0]] / scale_factor[0]
         args_h = self.args_1[pos[1]] / scale_factor[1]
@@ -236,6 +268,63 @@ class Modulation(nn.Module):
         return self.out_layer(self.activation(x))
 
 
+def fuse_linears(linears, shards=1):
+    """
+    One ``nn.Linear`` computing the outputs of ``linears`` (same input size)
+    with a single GEMM. With ``shards`` > 1 the output rows are ordered shard
+    by shard, so a column-wise split into ``shards`` parts gives every part
+    its slice of each projection.
+    """
+    first = linears[0]
+    weight = torch.cat(
+        [
+            chunk
+            for shard in zip(*(l.weight.data.chunk(shards, dim=0) for l in linears))
+            for chunk in shard
+        ]
+    )
+    fused = nn.Linear(
+        first.in_features,
+        weight.shape[0],
+        bias=first.bias is not None,
+        device="meta",
+    )
+    fused.weight = nn.Parameter(weight, requires_grad=first.weight.requires_grad)
+    if first.bias is not None:
+        bias = torch.cat(
+            [
+                chunk
+                for shard in zip(*(l.bias.data.chunk(shards, dim=0) for l in linears))
+                for chunk in shard
+            ]
+        )
+        fused.bias = nn.Parameter(bias, requires_grad=first.bias.requires_grad)
+    return fused
+
+
+def fuse_projections(module, names, fused_name, shards=1):
+    # replaces the projections ``names`` of ``module`` by ``fused_name``;
+    # checkpoints with the separate projections still load into it
+    setattr(
+        module,
+        fused_name,
+        fuse_linears([getattr(module, name) for name in names], shards),
+    )
+    for name in names:
+        delattr(module, name)
+
+    def load_separate(module, state_dict, prefix, *args):
+        for param in ("weight", "bias"):
+            keys = [f"{prefix}{name}.{param}" for name in names]
+            if all(key in state_dict for key in keys):
+                chunks = [state_dict.pop(key).chunk(shards, dim=0) for key in keys]
+                state_dict[f"{prefix}{fused_name}.{param}"] = torch.cat(
+                    [chunk for shard in zip(*chunks) for chunk in shard]
+                )
+
+    module._register_load_state_dict_pre_hook(load_separate, with_module=True)
+
+
 class MultiheadSelfAttentionEnc(nn.Module):
     def __init__(self, num_channels, head_dim):
         super().__init__()
@@ -249,12 +338,23 @@ class MultiheadSelfAttentionEnc(nn.Module):
         self.key_norm = nn.RMSNorm(head_dim)
 
         self.out_layer = nn.Linear(num_channels, num_channels, bias=True)
+        self.attention_fn = None
+        self.fused_qkv = False
+
+    def fuse_qkv(self, shards=1):
+        fuse_projections(
+            self, ["to_query", "to_key", "to_value"], "to_query_key_value", shards
+        )
+        self.fused_qkv = True
 
     @kd5_compile()
     def get_qkv(self, x):
-        query = self.to_query(x)
-        key = self.to_key(x)
-        value = self.to_value(x)
+        if self.fused_qkv:
+            query, key, value = self.to_query_key_value(x).chunk(3, dim=-1)
+        else:
+            query = self.to_query(x)
+            key = self.to_key(x)
+            value = self.to_value(x)
 
         shape = query.shape[:-1]
         query = query.reshape(*shape, self.num_heads, -1)
@@ -271,53 +371,12 @@ class MultiheadSelfAttentionEnc(nn.Module):
 
     @kd5_compile()
     def scaled_dot_product_attention(self, query, key, value):
-        attn_mode = os.environ.get("KD5_ATTENTION_MODE", "flash")
-
-        if attn_mode == "sage" and SAGE_ATTN is not None:
-            # Use Sage Attention (plug-and-play replacement)
-            if not hasattr(self, "_sage_logged"):
-                print(f"→ Using Sage Attention (mode={attn_mode})")
-                self._sage_logged = True
-            out = (
-                SAGE_ATTN(
-                    query.unsqueeze(0).transpose(1, 2),  # [B, heads, seq, dim]
-                    key.unsqueeze(0).transpose(1, 2),
-                    value.unsqueeze(0).transpose(1, 2),
-                )
-                .transpose(1, 2)[0]
-                .flatten(-2, -1)
-            )
-        elif attn_mode == "flash" and FA is not None:
-            if not hasattr(self, "_flash_logged"):
-                print(f"→ Using Flash Attention (mode={attn_mode})")
-                self._flash_logged = True
-            out = FA(q=query.unsqueeze(0), k=key.unsqueeze(0), v=value.unsqueeze(0))[
-                0
-            ].flatten(-2, -1)
-        else:
-            # Use PyTorch native SDPA (fallback)
-            if not hasattr(self, "_sdpa_logged"):
-                if attn_mode == "sage" and SAGE_ATTN is None:
-                    print(
-                        f"⚠️  Sage Attention requested but not found - falling back to PyTorch SDPA"
-                    )
-                elif attn_mode == "flash" and FA is None:
-                    print(
-                        f"⚠️  Flash Attention requested but not found - falling back to PyTorch SDPA"
-                    )
-                else:
-                    print(f"→ Using PyTorch SDPA (mode={attn_mode})")
-                self._sdpa_logged = True
-            out = (
-                torch.nn.functional.scaled_dot_product_attention(
-                    query.unsqueeze(0).transpose(1, 2),  # [B, heads, seq, dim]
-                    key.unsqueeze(0).transpose(1, 2),
-                    value.unsqueeze(0).transpose(1, 2),
-                )
-                .transpose(1, 2)[0]
-                .flatten(-2, -1)
-            )
-        return out
+        query, key, value, batched = to_attention_batch(query, key, value)
+        if self.attention_fn is None:
+            # not bound by bind_attention (models.attention) yet
+            _, self.attention_fn = resolve_attention(attention_mode(), query.device)
+        out = self.attention_fn(query, key, value)
+        return out if batched else out[0]
 
     @kd5_compile()
     def out_l(self, x):
@@ -348,12 +407,23 @@ class MultiheadSelfAttentionDec(nn.Module):
         self.key_norm = nn.RMSNorm(head_dim)
 
         self.out_layer = nn.Linear(num_channels, num_channels, bias=True)
+        self.attention_fn = None
+        self.fused_qkv = False
+
+    def fuse_qkv(self, shards=1):
+        fuse_projections(
+            self, ["to_query", "to_key", "to_value"], "to_query_key_value", shards
+        )
+        self.fused_qkv = True
 
     @kd5_compile()
     def get_qkv(self, x):
-        query = self.to_query(x)
-        key = self.to_key(x)
-        value = self.to_value(x)
+        if self.fused_qkv:
+            query, key, value = self.to_query_key_value(x).chunk(3, dim=-1)
+        else:
+            query = self.to_query(x)
+            key = self.to_key(x)
+            value = self.to_value(x)
 
         shape = query.shape[:-1]
         query = query.reshape(*shape, self.num_heads, -1)
@@ -370,77 +440,45 @@ class MultiheadSelfAttentionDec(nn.Module):
 
     @kd5_compile()
     def attention(self, query, key, value):
-        attn_mode = os.environ.get("KD5_ATTENTION_MODE", "flash")
-
-        if attn_mode == "sage" and SAGE_ATTN is not None:
-            # Use Sage Attention (plug-and-play replacement)
-            out = (
-                SAGE_ATTN(
-                    query.unsqueeze(0).transpose(1, 2),  # [B, heads, seq, dim]
-                    key.unsqueeze(0).transpose(1, 2),
-                    value.unsqueeze(0).transpose(1, 2),
-                )
-                .transpose(1, 2)[0]
-                .flatten(-2, -1)
-            )
-        elif attn_mode == "flash" and FA is not None:
-            out = FA(q=query.unsqueeze(0), k=key.unsqueeze(0), v=value.unsqueeze(0))[
-                0
-            ].flatten(-2, -1)
-        else:
-            out = (
-                torch.nn.functional.scaled_dot_product_attention(
-                    query.unsqueeze(0).transpose(1, 2),  # [B, heads, seq, dim]
-                    key.unsqueeze(0).transpose(1, 2),
-                    value.unsqueeze(0).transpose(1, 2),
-                )
-                .transpose(1, 2)[0]
-                .flatten(-2, -1)
-            )
-        return out
+        query, key, value, batched = to_attention_batch(query, key, value)
+        if self.attention_fn is None:
+            # not bound by bind_attention (models.attention) yet
+            _, self.attention_fn = resolve_attention(attention_mode(), query.device)
+        out = self.attention_fn(query, key, value)
+        return out if batched else out[0]
 
     # NOTE: torch.compile disabled for nabla by default (see kd5_compile decorator)
     # This prevents FlexAttention from falling back to dense math_attention (OOM with 457GB allocation)
     # Set KD5_COMPILE_NABLA=1 to enable torch.compile for nabla (experimental, may cause OOM)
     @kd5_compile(mode="max-autotune-no-cudagraphs", dynamic=True)
     def nabla(self, query, key, value, sparse_params=None):
-        print(f"\n{'='*80}")
-        print(f"NABLA ATTENTION CALLED")
-        print(f"Query shape (before): {query.shape}")
-        print(f"Key shape (before): {key.shape}")
-        print(f"Value shape (before): {value.shape}")
-
-        query = query.unsqueeze(0).transpose(1, 2).contiguous()
-        key = key.unsqueeze(0).transpose(1, 2).contiguous()
-        value = value.unsqueeze(0).transpose(1, 2).contiguous()
-
-        print(f"Query shape (after reshape): {query.shape}  [B, heads, seq, dim]")
-        print(f"Key shape (after reshape): {key.shape}")
-        print(f"Value shape (after reshape): {value.shape}")
-        print(
-            f"STA mask shape: {sparse_params['sta_mask'].shape if sparse_params and 'sta_mask' in sparse_params else 'MISSING'}"
-        )
-        print(
-            f"Threshold P: {sparse_params.get('P', 'MISSING') if sparse_params else 'MISSING'}"
-        )
-        print(f"Sequence length S: {query.shape[2]}")
-        print(f"S // 64 = {query.shape[2] // 64} (must be > 0 for nabla to work)")
-        print(f"{'='*80}\n")
-
-        block_mask = nablaT_v2(
-            query,
-            key,
-            sparse_params["sta_mask"],
-            thr=sparse_params["P"],
-        )
+        if trace.debug:
+            trace.log(
+                f"nabla attention: query {tuple(query.shape)}, key {tuple(key.shape)}, value {tuple(value.shape)}",
+                DEBUG,
+            )
+
+        query, key, value, batched = to_attention_batch(query, key, value)
+        query = query.transpose(1, 2).contiguous()
+        key = key.transpose(1, 2).contiguous()
+        value = value.transpose(1, 2).contiguous()
+
+        if trace.debug:
+            trace.log(
+                f"nabla attention: [B, heads, seq, dim] {tuple(query.shape)}, "
+                f"STA mask {tuple(sparse_params['sta_mask'].shape)}, P={sparse_params['P']}, "
+                f"{query.shape[2] // 64} blocks of 64",
+                DEBUG,
+            )
+
+        block_mask = nabla_mask_cache.block_mask(self, query, key, sparse_params)
         out = (
             flex_attention(query, key, value, block_mask=block_mask)
             .transpose(1, 2)
-            .squeeze(0)
             .contiguous()
         )
         out = out.flatten(-2, -1)
-        return out
+        return out if batched else out[0]
 
     @kd5_compile()
     def out_l(self, x):
@@ -482,12 +520,24 @@ class MultiheadCrossAttention(nn.Module):
         self.key_norm = nn.RMSNorm(head_dim)
 
         self.out_layer = nn.Linear(num_channels, num_channels, bias=True)
+        self.attention_fn = None
+        self.fused_qkv = False
+
+    def fuse_qkv(self, shards=1):
+        # the query projects the visual tokens, only key and value share an
+        # input
+        fuse_projections(self, ["to_key", "to_value"], "to_key_value", shards)
+        self.fused_qkv = True
+
+    def get_kv(self, cond):
+        if self.fused_qkv:
+            return self.to_key_value(cond).chunk(2, dim=-1)
+        return self.to_key(cond), self.to_value(cond)
 
     @kd5_compile()
     def get_qkv(self, x, cond):
         query = self.to_query(x)
-        key = self.to_key(cond)
-        value = self.to_value(cond)
+        key, value = self.get_kv(cond)
 
         shape, cond_shape = query.shape[:-1], key.shape[:-1]
         query = query.reshape(*shape, self.num_heads, -1)
@@ -504,40 +554,21 @@ class MultiheadCrossAttention(nn.Module):
 
     @kd5_compile()
     def attention(self, query, key, value):
-        attn_mode = os.environ.get("KD5_ATTENTION_MODE", "flash")
-
-        if attn_mode == "sage" and SAGE_ATTN is not None:
-            # Use Sage Attention (plug-and-play replacement)
-            out = (
-                SAGE_ATTN(
-                    query.unsqueeze(0).transpose(1, 2),  # [B, heads, seq, dim]
-                    key.unsqueeze(0).transpose(1, 2),
-                    value.unsqueeze(0).transpose(1, 2),
-                )
-                .transpose(1, 2)[0]
-                .flatten(-2, -1)
-            )
-        elif attn_mode == "flash" and FA is not None:
-            out = FA(q=query.unsqueeze(0), k=key.unsqueeze(0), v=value.unsqueeze(0))[
-                0
-            ].flatten(-2, -1)
-        else:
-            out = (
-                torch.nn.functional.scaled_dot_product_attention(
-                    query.unsqueeze(0).transpose(1, 2),  # [B, heads, seq, dim]
-                    key.unsqueeze(0).transpose(1, 2),
-                    value.unsqueeze(0).transpose(1, 2),
-                )
-                .transpose(1, 2)[0]
-                .flatten(-2, -1)
-            )
-        return out
+        query, key, value, batched = to_attention_batch(query, key, value)
+        if self.attention_fn is None:
+            # not bound by bind_attention (models.attention) yet
+            _, self.attention_fn = resolve_attention(attention_mode(), query.device)
+        out = self.attention_fn(query, key, value)
+        return out if batched else out[0]
 
     @kd5_compile()
     def out_l(self, x):
         return self.out_layer(x)
 
     def forward(self, x, cond):
+        if isinstance(cond, (list, tuple)):
+            return self.forward_branches(x, cond)
+
         query, key, value = self.get_qkv(x, cond)
         query, key = self.norm_qk(query, key)
 
@@ -545,6 +576,23 @@ class MultiheadCrossAttention(nn.Module):
         out = self.out_l(out)
         return out
 
+    def forward_branches(self, x, conds):
+        # x is [branches, seq, dim] and conds holds one text sequence per branch;
+        # text lengths differ between branches, so only the key/value side is split
+        query = self.to_query(x)
+        query = query.reshape(*query.shape[:-1], self.num_heads, -1)
+
+        out = []
+        for branch_query, cond in zip(query, conds):
+            key, value = self.get_kv(cond)
+            key = key.reshape(*key.shape[:-1], self.num_heads, -1)
+            value = value.reshape(*value.shape[:-1], self.num_heads, -1)
+            branch_query, key = self.norm_qk(branch_query, key)
+            out.append(self.attention(branch_query, key, value))
+
+        out = self.out_l(torch.stack(out))
+        return out
+
 
 class FeedForward(nn.Module):
     def __init__(self, dim, ff_dim):
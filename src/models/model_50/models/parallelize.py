@@ -47,15 +47,6 @@ def parallelize_dit(model, tp_mesh):
                 "self_attention_norm": SequenceParallel(
                     sequence_dim=0, use_local_output=True
                 ),
-                "self_attention.to_query": ColwiseParallel(
-                    input_layouts=Replicate(),
-                ),
-                "self_attention.to_key": ColwiseParallel(
-                    input_layouts=Replicate(),
-                ),
-                "self_attention.to_value": ColwiseParallel(
-                    input_layouts=Replicate(),
-                ),
                 "self_attention.query_norm": SequenceParallel(
                     sequence_dim=0, use_local_output=True
                 ),
@@ -71,12 +62,6 @@ def parallelize_dit(model, tp_mesh):
                 "cross_attention.to_query": ColwiseParallel(
                     input_layouts=Replicate(),
                 ),
-                "cross_attention.to_key": ColwiseParallel(
-                    input_layouts=Replicate(),
-                ),
-                "cross_attention.to_value": ColwiseParallel(
-                    input_layouts=Replicate(),
-                ),
                 "cross_attention.query_norm": SequenceParallel(
                     sequence_dim=0, use_local_output=True
                 ),
@@ -92,6 +77,27 @@ def parallelize_dit(model, tp_mesh):
                 "feed_forward.in_layer": ColwiseParallel(),
                 "feed_forward.out_layer": RowwiseParallel(),
             }
+            # packed projections (DiffusionTransformer3D.fuse_qkv) are laid
+            # out shard by shard and split like the separate ones
+            self_attn_projections = (
+                ["to_query_key_value"]
+                if visual_transformer_block.self_attention.fused_qkv
+                else ["to_query", "to_key", "to_value"]
+            )
+            cross_attn_projections = (
+                ["to_key_value"]
+                if visual_transformer_block.cross_attention.fused_qkv
+                else ["to_key", "to_value"]
+            )
+            for name in self_attn_projections:
+                plan[f"self_attention.{name}"] = ColwiseParallel(
+                    input_layouts=Replicate(),
+                )
+            for name in cross_attn_projections:
+                plan[f"cross_attention.{name}"] = ColwiseParallel(
+                    input_layouts=Replicate(),
+                )
+
             self_attn = visual_transformer_block.self_attention
             self_attn.num_heads = self_attn.num_heads // tp_mesh.size()
 
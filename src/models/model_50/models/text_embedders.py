@@ -17,6 +17,7 @@ from transformers import (
 )
 
 from .utils import freeze
+from ..prompt_cache import prompt_cache_from_env
 
 
 def _ensure_module_dtype(module: torch.nn.Module, dtype: torch.dtype) -> List[str]:
@@ -309,11 +310,40 @@ class Kandinsky5TextEmbedder:
         self.embedder = Qwen2_5_VLTextEmbedder(conf.qwen, device, use_torch_compile)
         self.clip_embedder = ClipTextEmbedder(conf.clip, device)
         self.conf = conf
+        self.cache = prompt_cache_from_env(
+            namespace="|".join(
+                str(value)
+                for value in (
+                    conf.qwen.checkpoint_path,
+                    conf.qwen.max_length,
+                    conf.clip.checkpoint_path,
+                    conf.clip.max_length,
+                )
+            )
+        )
+
+    def is_cached(self, texts: Sequence[str], type_of_content: str = "image"):
+        return (
+            self.cache is not None
+            and len(texts) == 1
+            and self.cache.contains(texts[0], type_of_content)
+        )
 
     def encode(self, texts: Sequence[str], type_of_content: str = "image"):
+        # Cached entries live on the CPU; callers move them to the DiT device
+        if self.cache is not None and len(texts) == 1:
+            cached = self.cache.get(texts[0], type_of_content)
+            if cached is not None:
+                embeds, cu_seqlens = cached
+                return dict(embeds), cu_seqlens
+
         text_embeds, cu_seqlens = self.embedder(texts, type_of_content=type_of_content)
         pooled_embed = self.clip_embedder(texts)
-        return {"text_embeds": text_embeds, "pooled_embed": pooled_embed}, cu_seqlens
+        embeds = {"text_embeds": text_embeds, "pooled_embed": pooled_embed}
+
+        if self.cache is not None and len(texts) == 1:
+            self.cache.put(texts[0], type_of_content, (embeds, cu_seqlens))
+        return embeds, cu_seqlens
 
     def to(self, device: str):
         self.embedder.model = self.embedder.model.to(device)
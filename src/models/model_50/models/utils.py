@@ -7,6 +7,9 @@ The code has been adopted from Kandinsky-5
 
 
 import math
+import os
+from collections import OrderedDict
+from typing import Tuple
 
 import torch
 
@@ -15,6 +18,10 @@ from torch.nn.attention.flex_attention import BlockMask, _mask_mod_signature
 
 from einops import rearrange
 
+from utils.tracing import tracer
+
+trace = tracer("nabla")
+
 
 def exist(item):
     return item is not None
@@ -141,18 +148,71 @@ def fast_sta_nabla(
     return sta.reshape(T * H * W, T * H * W)
 
 
-def nablaT_v2(
-    q: Tensor,
-    k: Tensor,
-    sta: Tensor,
-    thr: float = 0.9,
-) -> BlockMask:
-    # Map estimation
+def pack_mask(mask: BoolTensor) -> Tensor:
+    # eight columns per byte, rows padded to whole bytes
+    rows, cols = mask.shape
+    padded = torch.zeros(
+        rows, (cols + 7) // 8 * 8, dtype=torch.uint8, device=mask.device
+    )
+    padded[:, :cols] = mask
+    shifts = torch.arange(8, dtype=torch.uint8, device=mask.device)
+    return (padded.view(rows, -1, 8) << shifts).sum(-1, dtype=torch.uint8)
+
+
+def unpack_mask(packed: Tensor, cols: int) -> BoolTensor:
+    shifts = torch.arange(8, dtype=torch.uint8, device=packed.device)
+    bits = (packed.unsqueeze(-1) >> shifts) & 1
+    return bits.view(packed.shape[0], -1)[:, :cols].bool()
+
+
+class StaMaskCache:
+    """
+    Bit-packed ``fast_sta_nabla`` masks by shape and device, least recently
+    used first out. The windows are part of the mask, so a change of
+    ``wT``/``wH``/``wW`` drops every entry built with the previous ones.
+    """
+
+    def __init__(self, max_entries: int = 4):
+        self.max_entries = max_entries
+        self.windows = None
+        self.entries = OrderedDict()
+
+    def get(self, T, H, W, wT, wH, wW, device="cuda") -> BoolTensor:
+        if self.windows != (wT, wH, wW):
+            self.entries.clear()
+            self.windows = (wT, wH, wW)
+
+        key = (T, H, W, str(device))
+        packed = self.entries.get(key)
+        if packed is None:
+            packed = pack_mask(fast_sta_nabla(T, H, W, wT, wH, wW, device=device))
+            self.entries[key] = packed
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+
+        return unpack_mask(packed, T * H * W)
+
+
+sta_mask_cache = StaMaskCache()
+
+
+def nabla_pool(q: Tensor, k: Tensor) -> Tuple[Tensor, Tensor]:
+    # queries and keys averaged over each block of 64 tokens
     B, h, S, D = q.shape
     s1 = S // 64
     qa = q.reshape(B, h, s1, 64, D).mean(-2)
-    ka = k.reshape(B, h, s1, 64, D).mean(-2).transpose(-2, -1)
-    map = qa @ ka
+    ka = k.reshape(B, h, s1, 64, D).mean(-2)
+    return qa, ka
+
+
+def nabla_kv_blocks(
+    qa: Tensor, ka: Tensor, sta: Tensor, thr: float = 0.9
+) -> Tuple[IntTensor, IntTensor]:
+    # Map estimation
+    D = qa.shape[-1]
+    map = qa @ ka.transpose(-2, -1)
 
     map = torch.softmax(map / math.sqrt(D), dim=-1)
     # Map binarization
@@ -163,9 +223,185 @@ def nablaT_v2(
 
     mask = torch.logical_or(mask, sta)
 
-    # BlockMask creation
     kv_nb = mask.sum(-1).to(torch.int32)
     kv_inds = mask.argsort(dim=-1, descending=True).to(torch.int32)
+    return kv_nb, kv_inds
+
+
+def nabla_block_mask(kv_nb: IntTensor, kv_inds: IntTensor) -> BlockMask:
     return BlockMask.from_kv_blocks(
         torch.zeros_like(kv_nb), kv_inds, kv_nb, kv_inds, BLOCK_SIZE=64, mask_mod=None
     )
+
+
+def nablaT_v2(
+    q: Tensor,
+    k: Tensor,
+    sta: Tensor,
+    thr: float = 0.9,
+) -> BlockMask:
+    qa, ka = nabla_pool(q, k)
+    kv_nb, kv_inds = nabla_kv_blocks(qa, ka, sta, thr)
+    return nabla_block_mask(kv_nb, kv_inds)
+
+
+def nabla_drift(qa: Tensor, ka: Tensor, ref_qa: Tensor, ref_ka: Tensor) -> float:
+    # relative change of the pooled queries and keys, the larger of the two
+    return (
+        torch.stack(
+            [
+                (qa - ref_qa).float().norm() / ref_qa.float().norm(),
+                (ka - ref_ka).float().norm() / ref_ka.float().norm(),
+            ]
+        )
+        .max()
+        .item()
+    )
+
+
+class NablaMaskEntry:
+    def __init__(self, step, shape, thr, kv_nb, kv_inds, density, qa, ka):
+        self.step = step
+        self.shape = shape
+        self.thr = thr
+        self.kv_nb = kv_nb
+        # the selected key blocks of each query block, the unused tail of the
+        # rows cut off
+        self.kv_inds = kv_inds
+        self.density = density
+        self.qa = qa
+        self.ka = ka
+
+    @property
+    def nbytes(self) -> int:
+        tensors = [self.kv_nb, self.kv_inds, self.qa, self.ka]
+        return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+
+class NablaLayerStats:
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.density = 0.0
+
+    def add(self, hit, density):
+        self.calls += 1
+        self.hits += int(hit)
+        self.density += density
+
+
+class NablaMaskCache:
+    """
+    NABLA block masks of the visual self-attention layers, reused across
+    denoising steps. The mask of a layer (and CFG branch) is rebuilt every
+    ``mask_refresh_steps`` steps, or sooner when its pooled queries and keys
+    moved by more than ``mask_drift_threshold`` since it was built; the
+    sparse parameters of the generation set both, along with the current
+    ``step``. Without a step, or with a refresh every step and no drift
+    threshold, every call builds its mask as before.
+
+    Only the selected key blocks are kept, as int16, and no more than
+    ``max_bytes`` of them; layers past the budget rebuild their mask on every
+    call.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.stats = OrderedDict()
+        self.nbytes = 0
+
+    @staticmethod
+    def enabled(sparse_params) -> bool:
+        return sparse_params.get("step") is not None and (
+            sparse_params.get("mask_refresh_steps", 1) > 1
+            or sparse_params.get("mask_drift_threshold", 0.0) > 0
+        )
+
+    @torch.compiler.disable
+    def block_mask(self, layer, q: Tensor, k: Tensor, sparse_params) -> BlockMask:
+        sta, thr = sparse_params["sta_mask"], sparse_params["P"]
+        if not self.enabled(sparse_params):
+            return nablaT_v2(q, k, sta, thr=thr)
+
+        step = sparse_params["step"]
+        refresh_steps = sparse_params.get("mask_refresh_steps", 1)
+        drift_threshold = sparse_params.get("mask_drift_threshold", 0.0)
+        key = (id(layer), sparse_params.get("branch", 0))
+        stats = self.stats.setdefault(id(layer), NablaLayerStats())
+
+        entry = self.entries.get(key)
+        qa = ka = None
+        if (
+            entry is not None
+            and entry.shape == q.shape
+            and entry.thr == thr
+            and 0 <= step - entry.step < refresh_steps
+        ):
+            reuse = True
+            if drift_threshold > 0:
+                qa, ka = nabla_pool(q, k)
+                reuse = nabla_drift(qa, ka, entry.qa, entry.ka) <= drift_threshold
+            if reuse:
+                stats.add(True, entry.density)
+                kv_inds = torch.zeros(
+                    *entry.kv_nb.shape,
+                    q.shape[2] // 64,
+                    dtype=torch.int32,
+                    device=q.device,
+                )
+                kv_inds[..., : entry.kv_inds.shape[-1]] = entry.kv_inds
+                return nabla_block_mask(entry.kv_nb, kv_inds)
+
+        if qa is None:
+            qa, ka = nabla_pool(q, k)
+        kv_nb, kv_inds = nabla_kv_blocks(qa, ka, sta, thr)
+        max_blocks, kept = torch.stack([kv_nb.max(), kv_nb.sum()]).tolist()
+        density = kept / (kv_nb.numel() * kv_inds.shape[-1])
+        stats.add(False, density)
+
+        self.drop(key)
+        entry = NablaMaskEntry(
+            step,
+            q.shape,
+            thr,
+            kv_nb,
+            kv_inds[..., : max(1, max_blocks)].to(torch.int16),
+            density,
+            qa if drift_threshold > 0 else None,
+            ka if drift_threshold > 0 else None,
+        )
+        if self.nbytes + entry.nbytes <= self.max_bytes:
+            self.entries[key] = entry
+            self.nbytes += entry.nbytes
+
+        return nabla_block_mask(kv_nb, kv_inds)
+
+    def drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+
+    def report(self):
+        # per layer in the order of the first call, which is the block order
+        if len(self.stats) == 0 or not trace.info:
+            return
+        calls = sum(stats.calls for stats in self.stats.values())
+        hits = sum(stats.hits for stats in self.stats.values())
+        trace.log(
+            f"NABLA masks: {hits}/{calls} reused ({hits / calls:.0%}), {self.nbytes / 1024**2:.0f} MB cached"
+        )
+        for index, stats in enumerate(self.stats.values()):
+            trace.log(
+                f"   block {index}: {stats.hits}/{stats.calls} reused ({stats.hits / stats.calls:.0%}), {1 - stats.density / stats.calls:.1%} sparse"
+            )
+
+    def clear(self):
+        self.entries.clear()
+        self.stats.clear()
+        self.nbytes = 0
+
+
+nabla_mask_cache = NablaMaskCache(
+    int(os.environ.get("KD5_NABLA_MASK_CACHE_MB", "2048")) * 1024**2
+)
@@ -719,6 +719,52 @@ class HunyuanVideoDecoder3D(nn.Module):
         return hidden_states
 
 
+_BLEND_RAMPS = {}
+
+
+def blend_ramp(
+    blend_extent: int, device: torch.device
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Returns cached ``(weight_b, weight_a)`` linear ramps for a blend extent."""
+    key = (blend_extent, str(device))
+    ramps = _BLEND_RAMPS.get(key)
+    if ramps is None:
+        # computed in float64 like the Python scalars of the per-slice loop,
+        # then rounded once to the float32 the kernels multiply with
+        ramp = (
+            torch.arange(blend_extent, dtype=torch.float64, device=device)
+            / blend_extent
+        )
+        ramps = (ramp.float(), (1 - ramp).float())
+        _BLEND_RAMPS[key] = ramps
+    return ramps
+
+
+def blend_tiles(
+    a: torch.Tensor, b: torch.Tensor, blend_extent: int, dim: int
+) -> torch.Tensor:
+    """
+    Cross-fades the last ``blend_extent`` slices of ``a`` into the first
+    ``blend_extent`` slices of ``b`` along the (negative) dimension ``dim``,
+    in place on ``b``, with one broadcasted kernel instead of a per-slice loop.
+    """
+    blend_extent = min(a.shape[dim], b.shape[dim], blend_extent)
+    if blend_extent <= 0:
+        return b
+
+    weight_b, weight_a = blend_ramp(blend_extent, b.device)
+    broadcast_shape = (blend_extent,) + (1,) * (-dim - 1)
+    weight_b = weight_b.view(broadcast_shape)
+    weight_a = weight_a.view(broadcast_shape)
+
+    head = b.narrow(dim, 0, blend_extent)
+    tail = a.narrow(dim, a.shape[dim] - blend_extent, blend_extent)
+    # both products are rounded to the tile dtype before the sum, as they
+    # were with scalar weights
+    head.mul_(weight_b).add_((tail * weight_a).to(b.dtype))
+    return b
+
+
 class AutoencoderKLHunyuanVideo(ModelMixin, ConfigMixin):
     r"""
     A VAE model with KL loss for encoding videos into latents
@@ -946,32 +992,17 @@ class AutoencoderKLHunyuanVideo(ModelMixin, ConfigMixin):
     def blend_v(
         self, a: torch.Tensor, b: torch.Tensor, blend_extent: int
     ) -> torch.Tensor:
-        blend_extent = min(a.shape[-2], b.shape[-2], blend_extent)
-        for y in range(blend_extent):
-            b[:, :, :, y, :] = a[:, :, :, -blend_extent + y, :] * (
-                1 - y / blend_extent
-            ) + b[:, :, :, y, :] * (y / blend_extent)
-        return b
+        return blend_tiles(a, b, blend_extent, dim=-2)
 
     def blend_h(
         self, a: torch.Tensor, b: torch.Tensor, blend_extent: int
     ) -> torch.Tensor:
-        blend_extent = min(a.shape[-1], b.shape[-1], blend_extent)
-        for x in range(blend_extent):
-            b[:, :, :, :, x] = a[:, :, :, :, -blend_extent + x] * (
-                1 - x / blend_extent
-            ) + b[:, :, :, :, x] * (x / blend_extent)
-        return b
+        return blend_tiles(a, b, blend_extent, dim=-1)
 
     def blend_t(
         self, a: torch.Tensor, b: torch.Tensor, blend_extent: int
     ) -> torch.Tensor:
-        blend_extent = min(a.shape[-3], b.shape[-3], blend_extent)
-        for x in range(blend_extent):
-            b[:, :, x, :, :] = a[:, :, -blend_extent + x, :, :] * (
-                1 - x / blend_extent
-            ) + b[:, :, x, :, :] * (x / blend_extent)
-        return b
+        return blend_tiles(a, b, blend_extent, dim=-3)
 
     def tiled_encode(self, x: torch.Tensor) -> AutoencoderKLOutput:
         r"""Encode a batch of images using a tiled encoder.
@@ -1218,6 +1249,18 @@ class AutoencoderKLHunyuanVideo(ModelMixin, ConfigMixin):
     def _temporal_tiled_decode(
         self, z: torch.Tensor, return_dict: bool = True
     ) -> Union[DecoderOutput, torch.Tensor]:
+        dec = torch.cat(list(self.iter_temporal_tiled_decode(z)), dim=2)
+
+        if not return_dict:
+            return (dec,)
+        return DecoderOutput(sample=dec)
+
+    def iter_temporal_tiled_decode(self, z: torch.Tensor):
+        """
+        Decode temporal tiles one by one and yield each finished chunk of
+        frames as soon as its seam with the previous tile has been blended.
+        Only the previous tile is kept alive, so memory stays O(tile).
+        """
         import gc
 
         _, _, num_frames, _, _ = z.shape
@@ -1239,7 +1282,6 @@ class AutoencoderKLHunyuanVideo(ModelMixin, ConfigMixin):
             self.tile_sample_min_num_frames - self.tile_sample_stride_num_frames
         )
 
-        row = []
         temporal_range = list(
             range(
                 0,
@@ -1247,7 +1289,11 @@ class AutoencoderKLHunyuanVideo(ModelMixin, ConfigMixin):
                 tile_latent_stride_num_frames,
             )
         )
-        for i in tqdm(temporal_range, desc="VAE Temporal Decode", leave=False):
+        previous = None
+        emitted_frames = 0
+        for index, i in enumerate(
+            tqdm(temporal_range, desc="VAE Temporal Decode", leave=False)
+        ):
             tile = z[:, :, i : i + tile_latent_min_num_frames + 1, :, :]
             if self.use_tiling and (
                 tile.shape[-1] > tile_latent_min_width
@@ -1259,35 +1305,50 @@ class AutoencoderKLHunyuanVideo(ModelMixin, ConfigMixin):
                 decoded = self.decoder(tile)
                 if not self.low_vram_mode:
                     decoded = decoded.clone()
-            if i > 0:
+
+            if previous is None:
+                t_lim = self.tile_sample_stride_num_frames + 1
+            else:
                 decoded = decoded[:, :, 1:, :, :]
-            row.append(decoded)
+                decoded = self.blend_t(previous, decoded, blend_num_frames)
+                t_lim = (
+                    self.tile_sample_min_num_frames
+                    if index == len(temporal_range) - 1
+                    else self.tile_sample_stride_num_frames
+                )
+            previous = decoded
+
+            chunk = decoded[:, :, : min(t_lim, num_sample_frames - emitted_frames)]
+            emitted_frames += chunk.shape[2]
 
             # Free memory in low VRAM mode
             if self.low_vram_mode and torch.cuda.is_available():
                 gc.collect()
                 torch.cuda.empty_cache()
 
-        result_row = []
-        for i, tile in enumerate(row):
-            if i > 0:
-                tile = self.blend_t(row[i - 1], tile, blend_num_frames)
-                t_lim = (
-                    self.tile_sample_min_num_frames
-                    if i == len(row) - 1
-                    else self.tile_sample_stride_num_frames
-                )
-                result_row.append(tile[:, :, :t_lim, :, :])
-            else:
-                result_row.append(
-                    tile[:, :, : self.tile_sample_stride_num_frames + 1, :, :]
-                )
+            if chunk.shape[2] > 0:
+                yield chunk
 
-        dec = torch.cat(result_row, dim=2)[:, :, :num_sample_frames]
+    def decode_stream(self, z: torch.Tensor):
+        """
+        Decode a batch of latents as a sequence of frame chunks along the
+        temporal axis. Falls back to a single chunk when the input is too
+        short for temporal tiling.
+        """
+        tile_size, tile_stride = self.get_dec_optimal_tiling(z.shape)
+        if tile_size != self.tile_size:
+            self.tile_size = tile_size
+            self.apply_tiling(tile_size, tile_stride)
 
-        if not return_dict:
-            return (dec,)
-        return DecoderOutput(sample=dec)
+        tile_latent_min_num_frames = (
+            self.tile_sample_min_num_frames // self.temporal_compression_ratio
+        )
+        if self.use_framewise_decoding and z.shape[2] > (
+            tile_latent_min_num_frames + 1
+        ):
+            yield from self.iter_temporal_tiled_decode(z)
+        else:
+            yield self._decode(z).sample
 
     def forward(
         self,
@@ -0,0 +1,145 @@
+"""Prompt embedding cache for the Kandinsky-5 text embedder."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import torch
+from safetensors.torch import load_file, save_file
+
+CacheEntry = Tuple[Dict[str, torch.Tensor], torch.Tensor]
+
+
+def _entry_bytes(entry: CacheEntry) -> int:
+    embeds, cu_seqlens = entry
+    tensors = list(embeds.values()) + [cu_seqlens]
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class PromptEmbeddingCache:
+    """
+    LRU cache of ``(text, type_of_content) -> (embeds, cu_seqlens)``.
+
+    Entries are kept on the CPU so a cache hit never needs the text encoders
+    on the GPU. The in-memory part is bounded by ``max_bytes``; when
+    ``cache_dir`` is set, entries are also written as safetensors files and
+    reloaded from there on an in-memory miss. ``namespace`` identifies the
+    encoder weights so persisted entries are not shared across checkpoints.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        cache_dir: Optional[str] = None,
+        namespace: str = "",
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.namespace = namespace
+        self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, text: str, type_of_content: str) -> str:
+        payload = "\0".join([self.namespace, type_of_content, text])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+
+    def _load(self, key: str) -> Optional[CacheEntry]:
+        if self.cache_dir is None or not os.path.exists(self._path(key)):
+            return None
+        try:
+            tensors = load_file(self._path(key))
+            cu_seqlens = tensors.pop("cu_seqlens")
+        except Exception as e:
+            print(f"[warn] Could not read cached prompt embedding: {e}")
+            return None
+        entry = (tensors, cu_seqlens)
+        self._insert(key, entry)
+        return entry
+
+    def contains(self, text: str, type_of_content: str) -> bool:
+        # a persisted entry only counts once it has been read back, so callers
+        # that skip loading the text encoders on a hit never end up needing them
+        key = self.key(text, type_of_content)
+        return key in self.entries or self._load(key) is not None
+
+    def get(self, text: str, type_of_content: str) -> Optional[CacheEntry]:
+        key = self.key(text, type_of_content)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        else:
+            entry = self._load(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, text: str, type_of_content: str, entry: CacheEntry) -> None:
+        embeds, cu_seqlens = entry
+        entry = (
+            {name: t.detach().to("cpu") for name, t in embeds.items()},
+            cu_seqlens.detach().to("cpu"),
+        )
+        key = self.key(text, type_of_content)
+        self._insert(key, entry)
+
+        if self.cache_dir is not None:
+            try:
+                tensors = {name: t.contiguous() for name, t in entry[0].items()}
+                tensors["cu_seqlens"] = entry[1].contiguous()
+                save_file(tensors, self._path(key))
+            except Exception as e:
+                print(f"[warn] Could not persist prompt embedding: {e}")
+
+    def _insert(self, key: str, entry: CacheEntry) -> None:
+        entry_bytes = _entry_bytes(entry)
+        if entry_bytes > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self.size_bytes -= _entry_bytes(self.entries.pop(key))
+
+        while self.entries and self.size_bytes + entry_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size_bytes -= _entry_bytes(evicted)
+
+        self.entries[key] = entry
+        self.size_bytes += entry_bytes
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size_bytes = 0
+
+
+def prompt_cache_from_env(namespace: str) -> Optional[PromptEmbeddingCache]:
+    """
+    Build the cache from ``KD5_PROMPT_CACHE_MB`` (0 disables it) and
+    ``KD5_PROMPT_CACHE_DIR`` (optional on-disk persistence).
+    """
+    try:
+        max_mb = float(os.environ.get("KD5_PROMPT_CACHE_MB", "256"))
+    except ValueError:
+        max_mb = 256.0
+    if max_mb <= 0:
+        return None
+
+    cache_dir = os.environ.get("KD5_PROMPT_CACHE_DIR") or None
+    return PromptEmbeddingCache(
+        max_bytes=int(max_mb * 1024**2), cache_dir=cache_dir, namespace=namespace
+    )
+
+
+__all__ = ["PromptEmbeddingCache", "prompt_cache_from_env"]
@@ -6,16 +6,52 @@ The code has been adopted from Kandinsky-5
 """
 
 
-from typing import Union, List
+import queue
+import threading
+from contextlib import nullcontext
+from types import SimpleNamespace
+from typing import Iterable, Union, List
 
 import torch
 import torchvision
 from torchvision.transforms import ToPILImage
 
-from .generation_utils import generate_sample
+from .distributed import send_command
+from .generation_utils import decode_latents, denoise, encode_prompts, generate_sample
+from .video_writer import StreamingVideoWriter, streaming_available
 from .enhance import clear_enhance, configure_enhance
 
 
+def side_stream(device):
+    device = torch.device(device)
+    return torch.cuda.Stream(device) if device.type == "cuda" else None
+
+
+def stream_context(stream):
+    return torch.cuda.stream(stream) if stream is not None else nullcontext()
+
+
+def record_event(device):
+    # marks the work queued so far on the current stream of ``device``
+    if torch.device(device).type != "cuda":
+        return None
+    event = torch.cuda.Event()
+    event.record(torch.cuda.current_stream(device))
+    return event
+
+
+def wait_for(event, tensors, device):
+    # orders the current stream after ``event`` and keeps the allocator from
+    # reusing ``tensors``, produced on another stream, while it reads them
+    if event is None:
+        return
+    stream = torch.cuda.current_stream(device)
+    stream.wait_event(event)
+    for tensor in tensors:
+        if tensor.is_cuda:
+            tensor.record_stream(stream)
+
+
 class Kandinsky5T2VPipeline:
     def __init__(
         self,
@@ -96,7 +132,7 @@ class Kandinsky5T2VPipeline:
         )
         return output_text[0]
 
-    def __call__(
+    def prepare_job(
         self,
         text: str,
         time_length: int = 5,  # time in seconds 0 if you want generate image
@@ -113,21 +149,18 @@ class Kandinsky5T2VPipeline:
         magcache: bool = None,
         enhance_options: dict | None = None,
     ):
+        """
+        Resolves the arguments of ``__call__`` into the settings of one job.
+        """
         num_steps = self.num_steps if num_steps is None else num_steps
         guidance_weight = (
             self.guidance_weight if guidance_weight is None else guidance_weight
         )
         # SEED
+        # only rank 0 runs the pipeline, the other tensor-parallel ranks get
+        # the seed and the encoded prompts with each denoise command
         if seed is None:
-            if self.local_dit_rank == 0:
-                seed = torch.randint(2**63 - 1, (1,)).to(self.local_dit_rank)
-            else:
-                seed = torch.empty((1,), dtype=torch.int64).to(self.local_dit_rank)
-
-            if self.world_size > 1:
-                torch.distributed.broadcast(seed, 0)
-
-            seed = seed.item()
+            seed = torch.randint(2**63 - 1, (1,)).item()
 
         if self.resolution != 512:
             raise NotImplementedError("Only 512 resolution is available for now")
@@ -143,9 +176,103 @@ class Kandinsky5T2VPipeline:
         # PREPARATION
         num_frames = 1 if time_length == 0 else time_length * 24 // 4 + 1
 
-        caption = text
-        expanded_prompt = None
-        if expand_prompts:
+        # Get magcache setting from parameter, or fall back to deferred params for backward compatibility
+        if magcache is not None:
+            use_magcache = magcache
+        elif self.offload and hasattr(self, '_deferred_loading_params'):
+            use_magcache = self._deferred_loading_params.get('magcache', False)
+        else:
+            use_magcache = False
+
+        enhance_cfg = enhance_options or {}
+        enable_enhance = bool(enhance_cfg.get('enabled'))
+        raw_weight = enhance_cfg.get('weight', 3.4)
+        try:
+            enhance_weight = float(raw_weight)
+        except (TypeError, ValueError):
+            print(f"Enhance-A-Video warning: invalid weight '{raw_weight}', using 3.4.")
+            enhance_weight = 3.4
+        max_tokens_value = enhance_cfg.get('max_tokens')
+        if isinstance(max_tokens_value, str):
+            token_str = max_tokens_value.strip()
+            if token_str:
+                try:
+                    max_tokens_value = int(float(token_str))
+                except ValueError:
+                    print(f"Enhance-A-Video warning: could not parse max tokens '{max_tokens_value}', falling back to auto.")
+                    max_tokens_value = None
+            else:
+                max_tokens_value = None
+        elif isinstance(max_tokens_value, float):
+            max_tokens_value = int(max_tokens_value)
+        if isinstance(max_tokens_value, int) and max_tokens_value <= 0:
+            max_tokens_value = None
+
+        # Batched CFG needs the full DiT on one device; the tensor-parallel plan
+        # shards along the unbatched sequence dimension
+        use_batched_cfg = self.world_size == 1 and (
+            getattr(self.conf.optimizations, "use_batched_cfg", True)
+            if hasattr(self.conf, "optimizations")
+            else True
+        )
+
+        if isinstance(save_path, str):
+            save_path = [save_path]
+
+        return SimpleNamespace(
+            text=text,
+            caption=text,
+            expanded_prompt=None,
+            negative_caption=negative_caption,
+            time_length=time_length,
+            num_frames=num_frames,
+            shape=(1, num_frames, height // 8, width // 8, 16),
+            seed=seed,
+            num_steps=num_steps,
+            guidance_weight=guidance_weight,
+            scheduler_scale=scheduler_scale,
+            expand_prompts=expand_prompts,
+            save_path=save_path,
+            progress=progress,
+            magcache=use_magcache,
+            batched_cfg=use_batched_cfg,
+            enhance=dict(
+                enable=enable_enhance,
+                weight=enhance_weight,
+                num_frames=num_frames if enable_enhance else None,
+                max_tokens=max_tokens_value,
+            ),
+        )
+
+    def expand_job_prompt(self, job):
+        job.caption = self.expand_prompt(job.text)
+        job.expanded_prompt = job.caption  # Store the expanded prompt
+        print(f"\n{'='*80}")
+        print(f"Expanded prompt: {job.expanded_prompt}")
+        print(f"{'='*80}\n")
+
+    def open_stream_writer(self, job):
+        # Stream decoded frames straight into the MP4 encoder instead of
+        # materialising the whole video on the host first
+        if (
+            job.time_length > 0
+            and self.local_dit_rank == 0
+            and job.save_path is not None
+            and len(job.save_path) == 1
+            and streaming_available()
+            and (
+                getattr(self.conf.optimizations, "use_streaming_decode", True)
+                if hasattr(self.conf, "optimizations")
+                else True
+            )
+        ):
+            return StreamingVideoWriter(job.save_path[0], fps=24, options={"crf": "5"})
+        return None
+
+    def __call__(self, text: str, **kwargs):
+        job = self.prepare_job(text, **kwargs)
+
+        if job.expand_prompts:
             if self.local_dit_rank == 0:
                 if self.offload:
                     print(
@@ -154,24 +281,20 @@ class Kandinsky5T2VPipeline:
                     self.text_embedder = self.text_embedder.to(
                         self.device_map["text_embedder"]
                     )
-                caption = self.expand_prompt(caption)
-                expanded_prompt = caption  # Store the expanded prompt
-                print(f"\n{'='*80}")
-                print(f"Expanded prompt: {expanded_prompt}")
-                print(f"{'='*80}\n")
-            if self.world_size > 1:
-                caption = [caption]
-                torch.distributed.broadcast_object_list(caption, 0)
-                caption = caption[0]
-                if (
-                    expanded_prompt is None
-                ):  # Non-rank-0 processes get the expanded prompt
-                    expanded_prompt = caption
+                self.expand_job_prompt(job)
         elif self.offload:
-            print("Offload: Moving text embedder to GPU for encoding")
-            self.text_embedder = self.text_embedder.to(self.device_map["text_embedder"])
-
-        shape = (1, num_frames, height // 8, width // 8, 16)
+            type_of_content = "image" if job.num_frames == 1 else "video"
+            if all(
+                hasattr(self.text_embedder, "is_cached")
+                and self.text_embedder.is_cached([prompt], type_of_content)
+                for prompt in (job.caption, job.negative_caption)
+            ):
+                print("Offload: Prompt embeddings cached - text embedder stays on CPU")
+            else:
+                print("Offload: Moving text embedder to GPU for encoding")
+                self.text_embedder = self.text_embedder.to(
+                    self.device_map["text_embedder"]
+                )
 
         # GENERATION
         if self.dit is not None:
@@ -184,13 +307,14 @@ class Kandinsky5T2VPipeline:
         else:
             print("Starting KD5 generation - DIT will be loaded during generation")
 
+        deferred_params = getattr(self, "_deferred_loading_params", {})
         dit_is_quantized = (
             any(
                 "QuantizedTensor" in str(type(p)) or "AffineQuantized" in str(type(p))
                 for p in self.dit.parameters()
             )
             if self.dit is not None
-            else False
+            else deferred_params.get("quantize_dit", False)
         )
 
         # Text embedder is a multi-level wrapper - get all PyTorch modules
@@ -217,68 +341,46 @@ class Kandinsky5T2VPipeline:
             for p in module.parameters()
         )
 
-        # Get magcache setting from parameter, or fall back to deferred params for backward compatibility
-        if magcache is not None:
-            use_magcache = magcache
-        elif self.offload and hasattr(self, '_deferred_loading_params'):
-            use_magcache = self._deferred_loading_params.get('magcache', False)
-        else:
-            use_magcache = False
-
-        enhance_cfg = enhance_options or {}
-        enable_enhance = bool(enhance_cfg.get('enabled'))
-        raw_weight = enhance_cfg.get('weight', 3.4)
-        try:
-            enhance_weight = float(raw_weight)
-        except (TypeError, ValueError):
-            print(f"Enhance-A-Video warning: invalid weight '{raw_weight}', using 3.4.")
-            enhance_weight = 3.4
-        max_tokens_value = enhance_cfg.get('max_tokens')
-        if isinstance(max_tokens_value, str):
-            token_str = max_tokens_value.strip()
-            if token_str:
-                try:
-                    max_tokens_value = int(float(token_str))
-                except ValueError:
-                    print(f"Enhance-A-Video warning: could not parse max tokens '{max_tokens_value}', falling back to auto.")
-                    max_tokens_value = None
-            else:
-                max_tokens_value = None
-        elif isinstance(max_tokens_value, float):
-            max_tokens_value = int(max_tokens_value)
-        if isinstance(max_tokens_value, int) and max_tokens_value <= 0:
-            max_tokens_value = None
-
-        configure_enhance(
-            enable=enable_enhance,
-            weight=enhance_weight,
-            num_frames=num_frames if enable_enhance else None,
-            max_tokens=max_tokens_value,
-        )
+        stream_writer = self.open_stream_writer(job)
+        configure_enhance(**job.enhance)
 
         try:
             result = generate_sample(
-                shape,
-                caption,
+                job.shape,
+                job.caption,
                 self.dit,
                 self.vae,
                 self.conf,
                 text_embedder=self.text_embedder,
-                num_steps=num_steps,
-                guidance_weight=guidance_weight,
-                scheduler_scale=scheduler_scale,
-                negative_caption=negative_caption,
-                seed=seed,
+                num_steps=job.num_steps,
+                guidance_weight=job.guidance_weight,
+                scheduler_scale=job.scheduler_scale,
+                negative_caption=job.negative_caption,
+                seed=job.seed,
                 device=self.device_map["dit"],
                 vae_device=self.device_map["vae"],
                 text_embedder_device=self.device_map["text_embedder"],
-                progress=progress,
+                progress=job.progress,
                 offload=self.offload,
                 dit_is_quantized=dit_is_quantized,
                 text_embedder_is_quantized=text_embedder_is_quantized,
+                quantized_cache_dir=deferred_params.get("quantized_cache_dir"),
                 return_loaded_models=self.offload,
-                magcache=use_magcache,
+                magcache=job.magcache,
+                batched_cfg=job.batched_cfg,
+                stream_writer=stream_writer,
+                world_size=self.world_size,
+                offload_resident_blocks=deferred_params.get(
+                    "offload_resident_blocks", 0
+                ),
             )
+        except BaseException:
+            if stream_writer is not None:
+                try:
+                    stream_writer.close()
+                except Exception:
+                    pass  # the original error is the one worth reporting
+            raise
         finally:
             clear_enhance()
 
@@ -302,24 +404,192 @@ class Kandinsky5T2VPipeline:
 
         gc.collect()
 
+        return self.collect_results(job, images)
+
+    def pipelined(self, jobs: Iterable[dict], max_pending: int = 1):
+        """
+        Runs ``jobs`` (keyword arguments of ``__call__``) with the stages of
+        consecutive jobs overlapped: the prompts of job N+1 are expanded and
+        encoded while job N is denoised, and job N is decoded and written
+        while job N+1 is denoised. Text encoding and decoding run in their
+        own threads on side CUDA streams, at most ``max_pending`` jobs wait
+        between two stages. Denoising stays in the calling thread.
+
+        Yields ``(result, error)`` per job, in order; a failed job does not
+        stop the others. With offloading the models cannot be resident at the
+        same time, so jobs run one after another.
+        """
+        if self.offload or self.dit is None or self.vae is None:
+            for kwargs in jobs:
+                try:
+                    yield self(**kwargs), None
+                except Exception as e:
+                    yield None, e
+            return
+
+        device = self.device_map["dit"]
+        text_stream = side_stream(self.device_map["text_embedder"])
+        vae_stream = side_stream(self.device_map["vae"])
+
+        stop = threading.Event()
+        encoded = queue.Queue(maxsize=max_pending)
+        denoised = queue.Queue(maxsize=max_pending)
+        finished = queue.Queue()
+
+        def put(target, item):
+            # gives up once the consumer has gone away
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def encode_stage():
+            try:
+                for kwargs in jobs:
+                    job, error = None, None
+                    try:
+                        job = self.prepare_job(**kwargs)
+                        with stream_context(text_stream):
+                            if job.expand_prompts:
+                                self.expand_job_prompt(job)
+                            type_of_content = (
+                                "image" if job.num_frames == 1 else "video"
+                            )
+                            job.embeds = encode_prompts(
+                                self.text_embedder,
+                                job.caption,
+                                job.negative_caption,
+                                type_of_content,
+                                device,
+                            )
+                            job.ready = record_event(device)
+                    except Exception as e:
+                        error = e
+                    if not put(encoded, (job, error)):
+                        return
+            finally:
+                put(encoded, None)
+
+        def decode_stage():
+            vae_device = self.device_map["vae"]
+            try:
+                for job, error in iter(denoised.get, None):
+                    result = None
+                    if error is None:
+                        stream_writer = None
+                        try:
+                            with stream_context(vae_stream):
+                                wait_for(job.ready, [job.latents], vae_device)
+                                stream_writer = self.open_stream_writer(job)
+                                images = decode_latents(
+                                    self.vae, job.latents, 1, vae_device, stream_writer
+                                )
+                                job.latents = None
+                                result = self.collect_results(job, images)
+                        except Exception as e:
+                            if stream_writer is not None:
+                                try:
+                                    stream_writer.close()
+                                except Exception:
+                                    pass  # the original error is the one worth reporting
+                            error = e
+                    finished.put((result, error))
+            finally:
+                finished.put(None)
+
+        encoder = threading.Thread(
+            target=encode_stage, name="kd5-text-stage", daemon=True
+        )
+        decoder = threading.Thread(
+            target=decode_stage, name="kd5-vae-stage", daemon=True
+        )
+        encoder.start()
+        decoder.start()
+
+        decode_closed = False
+        try:
+            for job, error in iter(encoded.get, None):
+                if error is None:
+                    try:
+                        text_embeds, null_text_embeds, text_length, null_text_length = (
+                            job.embeds
+                        )
+                        wait_for(
+                            job.ready,
+                            [*text_embeds.values(), *null_text_embeds.values()],
+                            device,
+                        )
+                        denoise_args = dict(
+                            shape=job.shape,
+                            num_steps=job.num_steps,
+                            text_embeds=text_embeds,
+                            null_text_embeds=null_text_embeds,
+                            text_length=text_length,
+                            null_text_length=null_text_length,
+                            guidance_weight=job.guidance_weight,
+                            scheduler_scale=job.scheduler_scale,
+                            seed=job.seed,
+                            magcache=job.magcache,
+                            progress=job.progress,
+                            batched_cfg=job.batched_cfg,
+                        )
+                        job.embeds = None
+                        if self.world_size > 1:
+                            send_command("denoise", **denoise_args)
+
+                        configure_enhance(**job.enhance)
+                        try:
+                            job.latents = denoise(
+                                self.dit, self.conf, device, **denoise_args
+                            )
+                        finally:
+                            clear_enhance()
+                        job.ready = record_event(device)
+                    except Exception as e:
+                        error = e
+
+                denoised.put((job, error))
+                while not finished.empty():
+                    yield finished.get()
+
+            denoised.put(None)
+            decode_closed = True
+            yield from iter(finished.get, None)
+        finally:
+            stop.set()
+            if not decode_closed and decoder.is_alive():
+                denoised.put(None)
+            encoder.join()
+            decoder.join()
+            torch.cuda.empty_cache()
+
+    def collect_results(self, job, images):
+        text = job.text
+        expanded_prompt = job.expanded_prompt
+        expand_prompts = job.expand_prompts
+        negative_caption = job.negative_caption
+        save_path = job.save_path
+
         # RESULTS
         if self.local_dit_rank == 0:
-            if time_length == 0:
+            if job.time_length == 0:
                 return_images = []
                 for image in images.squeeze(2).cpu():
                     return_images.append(ToPILImage()(image))
                 if save_path is not None:
-                    if isinstance(save_path, str):
-                        save_path = [save_path]
                     if len(save_path) == len(return_images):
                         for path, image in zip(save_path, return_images):
                             image.save(path)
                 return return_images
             else:
                 if save_path is not None:
-                    if isinstance(save_path, str):
-                        save_path = [save_path]
-                    if len(save_path) == len(images):
+                    if images is None:
+                        # frames were already encoded by the streaming writer
+                        written_paths = save_path
+                    elif len(save_path) == len(images):
                         for path, video in zip(save_path, images):
                             torchvision.io.write_video(
                                 path,
@@ -327,39 +597,43 @@ class Kandinsky5T2VPipeline:
                                 fps=24,
                                 options={"crf": "5"},
                             )
-                            # Add metadata to the video file after saving
+                        written_paths = save_path
+                    else:
+                        written_paths = []
+                    for path in written_paths:
+                        # Add metadata to the video file after saving
+                        try:
+                            import json
+                            from mutagen.mp4 import MP4
+
+                            metadata = {
+                                "prompt": text,
+                                "expanded_prompt": (
+                                    expanded_prompt
+                                    if expand_prompts
+                                    and expanded_prompt
+                                    and expanded_prompt != text
+                                    else None
+                                ),
+                                "negative_prompt": negative_caption,
+                                "software": "Kubin v1.0.0",
+                            }
+
+                            video = MP4(path)
+                            video["\xa9cmt"] = json.dumps(metadata, indent=2)
+                            video.save()
+                        except Exception as e:
+                            print(f"⚠️  Could not save metadata to video: {e}")
+                            # Fallback: save to JSON file
                             try:
                                 import json
-                                from mutagen.mp4 import MP4
-
-                                metadata = {
-                                    "prompt": text,
-                                    "expanded_prompt": (
-                                        expanded_prompt
-                                        if expand_prompts
-                                        and expanded_prompt
-                                        and expanded_prompt != text
-                                        else None
-                                    ),
-                                    "negative_prompt": negative_caption,
-                                    "software": "Kubin v1.0.0",
-                                }
-
-                                video = MP4(path)
-                                video["\xa9cmt"] = json.dumps(metadata, indent=2)
-                                video.save()
-                            except Exception as e:
-                                print(f"⚠️  Could not save metadata to video: {e}")
-                                # Fallback: save to JSON file
-                                try:
-                                    import json
-
-                                    with open(
-                                        path.rsplit(".", 1)[0] + "_metadata.json", "w"
-                                    ) as f:
-                                        json.dump(metadata, f, indent=2)
-                                except:
-                                    pass  # Don't fail generation if metadata can't be saved
+
+                                with open(
+                                    path.rsplit(".", 1)[0] + "_metadata.json", "w"
+                                ) as f:
+                                    json.dump(metadata, f, indent=2)
+                            except:
+                                pass  # Don't fail generation if metadata can't be saved
                     # Return dict with both path and expanded prompt
                     return {
                         "path": save_path[0] if save_path else None,
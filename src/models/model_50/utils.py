@@ -11,7 +11,7 @@ import logging
 from typing import Optional, Union
 
 import torch
-from torch.distributed.device_mesh import DeviceMesh, init_device_mesh
+from torch.distributed.device_mesh import DeviceMesh
 
 from huggingface_hub import hf_hub_download, snapshot_download
 from omegaconf import OmegaConf
@@ -20,26 +20,11 @@ from omegaconf.dictconfig import DictConfig
 from safetensors.torch import load_file
 
 
-def get_T2V_pipeline(
-    device_map: Union[str, torch.device, dict],
-    resolution: int = 512,
-    cache_dir: str = "./weights/",
-    dit_path: str = None,
-    text_encoder_path: str = None,
-    text_encoder2_path: str = None,
-    vae_path: str = None,
-    conf_path: str = None,
-    conf: DictConfig = None,
-    offload: bool = False,
-    magcache: bool = False,
-    quantize_dit: bool = False,
-    quantize_text_embedder: bool = False,
+def configure_runtime(
     use_torch_compile_dit: bool = True,
     use_torch_compile_vae: bool = True,
     use_flash_attention: bool = True,
-) -> "Kandinsky5T2VPipeline":  # type: ignore
-    assert resolution in [512]
-
+):
     # Set environment variables to control torch.compile for DiT and VAE separately
     # MUST be set BEFORE importing model modules so @kd5_compile decorators see it
     if not use_torch_compile_dit:
@@ -65,40 +50,190 @@ def get_T2V_pipeline(
         logging.getLogger("torch._inductor").setLevel(logging.WARNING)
         logging.getLogger("torch.fx").setLevel(logging.WARNING)
 
-    from .models.dit import get_dit
-    from .models.text_embedders import get_text_embedder
-    from .models.vae import build_vae
-    from .models.parallelize import parallelize_dit
-    from .t2v_pipeline import Kandinsky5T2VPipeline
-    from .magcache_utils import set_magcache_params
-
     # Set environment variable to control Flash Attention usage
     if use_flash_attention:
         os.environ["KD5_USE_FLASH_ATTENTION"] = "1"
     else:
         os.environ["KD5_USE_FLASH_ATTENTION"] = "0"
 
+
+def use_fused_qkv(conf):
+    return (
+        getattr(conf.optimizations, "use_fused_qkv", True)
+        if hasattr(conf, "optimizations")
+        else True
+    )
+
+
+def load_dit(
+    conf: DictConfig,
+    device: torch.device,
+    quantize_dit: bool = False,
+    quantized_cache_dir: str = None,
+):
+    from .models.attention import bind_attention
+    from .models.dit import get_dit
+
+    # MagCache is set up for each generation by generation_utils.prepare_magcache
+    dit = get_dit(conf.model.dit_params)
+
+    # Download DIT model if it's a Hugging Face repository
+    # Check if it's a valid HF repo ID (contains "/" but doesn't look like a Windows path)
+    checkpoint_path = conf.model.checkpoint_path
+    is_windows_path = (
+        len(checkpoint_path) > 1 and checkpoint_path[1] == ":"
+    )  # Check for drive letter like "C:"
+    is_unix_path = checkpoint_path.startswith("/") or checkpoint_path.startswith("./")
+    is_hf_repo = "/" in checkpoint_path and not is_windows_path and not is_unix_path
+
+    if is_hf_repo:
+        cache_dir = os.environ.get("KD50_CACHE_DIR", "./weights/")
+        cache_dir = os.path.abspath(
+            os.path.normpath(cache_dir)
+        )  # Ensure absolute normalized path
+        print(f"Downloading DIT model to: {cache_dir}")
+
+        # Set HF_HOME to ensure consistent cache directory
+        os.environ["HF_HOME"] = cache_dir
+        os.environ["HUGGINGFACE_HUB_CACHE"] = cache_dir
+
+        model_path = snapshot_download(
+            repo_id=conf.model.checkpoint_path,
+            cache_dir=cache_dir,
+        )
+        checkpoint_path = model_path
+        print(f"Model downloaded to: {checkpoint_path}")
+    else:
+        checkpoint_path = conf.model.checkpoint_path
+        checkpoint_path = os.path.abspath(checkpoint_path)  # Ensure absolute path
+        print(f"Using local checkpoint path: {checkpoint_path}")
+
+    possible_filenames = [
+        "model.safetensors",
+        "kandinsky5lite_t2v_distilled16steps_5s.safetensors",
+        "kandinsky5lite_t2v_distilled16steps_10s.safetensors",
+        "kandinsky5lite_t2v_sft_5s.safetensors",
+        "kandinsky5lite_t2v_pretrain_5s.safetensors",
+        "kandinsky5lite_t2v_distil_5s.safetensors",
+        "kandinsky5lite_t2v_nocfg_5s.safetensors",
+        "kandinsky5lite_t2v_sft_10s.safetensors",
+        "kandinsky5lite_t2v_pretrain_10s.safetensors",
+        "kandinsky5lite_t2v_distil_10s.safetensors",
+        "kandinsky5lite_t2v_nocfg_10s.safetensors",
+    ]
+
+    full_model_path = None
+    for filename in possible_filenames:
+        test_path = os.path.join(checkpoint_path, filename)
+        if os.path.exists(test_path):
+            full_model_path = test_path
+            print(f"Found model file: {full_model_path}")
+            break
+
+        test_path_in_model = os.path.join(checkpoint_path, "model", filename)
+        if os.path.exists(test_path_in_model):
+            full_model_path = test_path_in_model
+            print(f"Found model file in model subdirectory: {full_model_path}")
+            break
+
+    if full_model_path is None:
+        try:
+            if os.path.exists(checkpoint_path):
+                files = os.listdir(checkpoint_path)
+                print(f"Files available in {checkpoint_path}: {files}")
+                model_subdir = os.path.join(checkpoint_path, "model")
+                if os.path.exists(model_subdir):
+                    model_files = os.listdir(model_subdir)
+                    print(f"Files available in {model_subdir}: {model_files}")
+        except Exception as e:
+            print(f"Could not list files: {e}")
+        raise FileNotFoundError(
+            f"No model file found in {checkpoint_path}. Tried: {possible_filenames}"
+        )
+
+    # Load weights - for CUDA, load directly to GPU to save one copy operation
+    target_device = device
+    if target_device.type == "cuda":
+        print(f"   → Loading DIT weights directly to {target_device}")
+        state_dict = load_file(full_model_path, device=str(target_device))
+        dit.load_state_dict(state_dict, assign=True)
+        # Parameters are now on GPU, but buffers are still on CPU
+        # .to() is smart - it only moves what's not already there
+        dit = dit.to(target_device)
+    else:
+        state_dict = load_file(full_model_path)
+        dit.load_state_dict(state_dict, assign=True)
+    del state_dict
+
+    if use_fused_qkv(conf):
+        from .distributed import tp_world
+
+        dit.fuse_qkv(tp_size=tp_world()[1])
+
+    if quantize_dit:
+        from .model_kd50_env import quantize_with_torch_ao
+
+        print("🔧 QUANTIZATION: Applying torchao int8 quantization to DIT model...")
+        print(f"   DIT device before quantization: {next(dit.parameters()).device}")
+
+        dit = quantize_with_torch_ao(dit, cache_dir=quantized_cache_dir)
+
+        print(f"   DIT device after quantization: {next(dit.parameters()).device}")
+        print("✅ QUANTIZATION: DIT quantization process completed")
+        print(f"   → Quantized DIT ready on: {next(dit.parameters()).device}")
+    else:
+        print("ℹ️  QUANTIZATION: DIT model will use fp16 (int8 quantization disabled)")
+        print(f"   → DIT ready on: {next(dit.parameters()).device}")
+
+    bind_attention(dit, device)
+    return dit
+
+
+def get_T2V_pipeline(
+    device_map: Union[str, torch.device, dict],
+    resolution: int = 512,
+    cache_dir: str = "./weights/",
+    dit_path: str = None,
+    text_encoder_path: str = None,
+    text_encoder2_path: str = None,
+    vae_path: str = None,
+    conf_path: str = None,
+    conf: DictConfig = None,
+    offload: bool = False,
+    magcache: bool = False,
+    quantize_dit: bool = False,
+    quantize_text_embedder: bool = False,
+    quantized_cache_dir: str = None,
+    use_torch_compile_dit: bool = True,
+    use_torch_compile_vae: bool = True,
+    use_flash_attention: bool = True,
+    offload_resident_blocks: int = 0,
+) -> "Kandinsky5T2VPipeline":  # type: ignore
+    assert resolution in [512]
+
+    configure_runtime(use_torch_compile_dit, use_torch_compile_vae, use_flash_attention)
+
+    from .models.text_embedders import get_text_embedder
+    from .models.vae import build_vae
+    from .models.parallelize import parallelize_dit
+    from .t2v_pipeline import Kandinsky5T2VPipeline
+    from .distributed import init_tp_mesh, send_command, tp_device, tp_world
+
     if not isinstance(device_map, dict):
         device_map = {"dit": device_map, "vae": device_map, "text_embedder": device_map}
 
-    try:
-        local_rank, world_size = int(os.environ["LOCAL_RANK"]), int(
-            os.environ["WORLD_SIZE"]
-        )
-    except:
-        local_rank, world_size = 0, 1
+    local_rank, world_size = tp_world()
 
     assert not (
         world_size > 1 and offload
     ), "Offloading available only with not parallel inference"
 
     if world_size > 1:
-        device_mesh = init_device_mesh(
-            "cuda", (world_size,), mesh_dim_names=("tensor_parallel",)
-        )
-        device_map["dit"] = torch.device(f"cuda:{local_rank}")
-        device_map["vae"] = torch.device(f"cuda:{local_rank}")
-        device_map["text_embedder"] = torch.device(f"cuda:{local_rank}")
+        device = tp_device(device_map["dit"], local_rank)
+        device_mesh = init_tp_mesh(device)
+        device_map["dit"] = device
+        device_map["vae"] = device
+        device_map["text_embedder"] = device
 
     os.makedirs(cache_dir, exist_ok=True)
 
@@ -176,8 +311,12 @@ def get_T2V_pipeline(
         )
 
         # Quantize both models on CPU
-        text_embedder.embedder.model = quantize_with_torch_ao(qwen_model)
-        text_embedder.clip_embedder.model = quantize_with_torch_ao(clip_model)
+        text_embedder.embedder.model = quantize_with_torch_ao(
+            qwen_model, cache_dir=quantized_cache_dir
+        )
+        text_embedder.clip_embedder.model = quantize_with_torch_ao(
+            clip_model, cache_dir=quantized_cache_dir
+        )
 
         print(
             f"   Qwen model device after quantization: {next(text_embedder.embedder.model.parameters()).device}"
@@ -223,7 +362,6 @@ def get_T2V_pipeline(
         vae = build_vae(conf.model.vae, low_vram_mode=vae_low_vram_mode)
         vae = vae.eval()
         vae = vae.to(device=device_map["vae"])
-        dit = get_dit(conf.model.dit_params)
     else:
         vae = None
         dit = None
@@ -231,156 +369,25 @@ def get_T2V_pipeline(
     # Skip magcache and DIT loading/quantization if offload is enabled
     # These will be done during generation
     if not offload:
-        if (
-            magcache
-            and hasattr(conf, "magcache")
-            and hasattr(conf.magcache, "mag_ratios")
-        ):
-            mag_ratios = conf.magcache.mag_ratios
-            num_steps = conf.model.num_steps
-            guidance_weight = conf.model.guidance_weight
-            # Detect no_cfg models: guidance_weight == 1.0
-            no_cfg = guidance_weight == 1.0
-
-            # Check if calibration mode is enabled via environment variable
-            calibrate_mode = os.environ.get("MAGCACHE_CALIBRATE", "0") == "1"
-
-            set_magcache_params(
-                dit, mag_ratios, num_steps, no_cfg, calibrate=calibrate_mode
-            )
-
-            if not calibrate_mode:
-                mag_ratio_count = (
-                    len(conf.magcache.mag_ratios)
-                    if hasattr(conf.magcache, "mag_ratios")
-                    else 0
-                )
-                print(f"✓ Magcache configuration complete")
-                print(f"   → Guidance weight: {guidance_weight}")
-                print(f"   → Mag ratios loaded: {mag_ratio_count}")
-        elif magcache:
-            print(
-                "⚠️  Magcache requested but config missing 'magcache.mag_ratios' section"
+        if world_size > 1:
+            # the other ranks build the same DiT and take their shards of it
+            # in parallelize_dit, which is a collective
+            send_command(
+                "load",
+                conf=OmegaConf.to_container(conf, resolve=True),
+                use_torch_compile_dit=use_torch_compile_dit,
+                use_torch_compile_vae=use_torch_compile_vae,
+                use_flash_attention=use_flash_attention,
             )
-            print(f"   → Config type: {type(conf)}")
-            print(f"   → Has magcache attr: {hasattr(conf, 'magcache')}")
-            if hasattr(conf, "magcache"):
-                print(f"   → Has mag_ratios: {hasattr(conf.magcache, 'mag_ratios')}")
-            print(f"   → Magcache is only available for SFT models with proper config")
-            print(
-                f"   → Try using Reset button to reload config with magcache parameters"
-            )
-        else:
-            # Ensure magcache is disabled if it was previously enabled
-            from .magcache_utils import disable_magcache
-
-            disable_magcache(dit)
-
-        # Download DIT model if it's a Hugging Face repository
-        # Check if it's a valid HF repo ID (contains "/" but doesn't look like a Windows path)
-        checkpoint_path = conf.model.checkpoint_path
-        is_windows_path = (
-            len(checkpoint_path) > 1 and checkpoint_path[1] == ":"
-        )  # Check for drive letter like "C:"
-        is_unix_path = checkpoint_path.startswith("/") or checkpoint_path.startswith(
-            "./"
+            if quantize_dit:
+                print("ℹ️  QUANTIZATION: int8 DIT is not used with tensor parallelism")
+
+        dit = load_dit(
+            conf,
+            device_map["dit"],
+            quantize_dit=quantize_dit and world_size == 1,
+            quantized_cache_dir=quantized_cache_dir,
         )
-        is_hf_repo = "/" in checkpoint_path and not is_windows_path and not is_unix_path
-
-        if is_hf_repo:
-            cache_dir = os.environ.get("KD50_CACHE_DIR", "./weights/")
-            cache_dir = os.path.abspath(
-                os.path.normpath(cache_dir)
-            )  # Ensure absolute normalized path
-            print(f"Downloading DIT model to: {cache_dir}")
-
-            # Set HF_HOME to ensure consistent cache directory
-            os.environ["HF_HOME"] = cache_dir
-            os.environ["HUGGINGFACE_HUB_CACHE"] = cache_dir
-
-            model_path = snapshot_download(
-                repo_id=conf.model.checkpoint_path,
-                cache_dir=cache_dir,
-            )
-            checkpoint_path = model_path
-            print(f"Model downloaded to: {checkpoint_path}")
-        else:
-            checkpoint_path = conf.model.checkpoint_path
-            checkpoint_path = os.path.abspath(checkpoint_path)  # Ensure absolute path
-            print(f"Using local checkpoint path: {checkpoint_path}")
-
-        possible_filenames = [
-            "model.safetensors",
-            "kandinsky5lite_t2v_distilled16steps_5s.safetensors",
-            "kandinsky5lite_t2v_distilled16steps_10s.safetensors",
-            "kandinsky5lite_t2v_sft_5s.safetensors",
-            "kandinsky5lite_t2v_pretrain_5s.safetensors",
-            "kandinsky5lite_t2v_distil_5s.safetensors",
-            "kandinsky5lite_t2v_nocfg_5s.safetensors",
-            "kandinsky5lite_t2v_sft_10s.safetensors",
-            "kandinsky5lite_t2v_pretrain_10s.safetensors",
-            "kandinsky5lite_t2v_distil_10s.safetensors",
-            "kandinsky5lite_t2v_nocfg_10s.safetensors",
-        ]
-
-        full_model_path = None
-        for filename in possible_filenames:
-            test_path = os.path.join(checkpoint_path, filename)
-            if os.path.exists(test_path):
-                full_model_path = test_path
-                print(f"Found model file: {full_model_path}")
-                break
-
-            test_path_in_model = os.path.join(checkpoint_path, "model", filename)
-            if os.path.exists(test_path_in_model):
-                full_model_path = test_path_in_model
-                print(f"Found model file in model subdirectory: {full_model_path}")
-                break
-
-        if full_model_path is None:
-            try:
-                if os.path.exists(checkpoint_path):
-                    files = os.listdir(checkpoint_path)
-                    print(f"Files available in {checkpoint_path}: {files}")
-                    model_subdir = os.path.join(checkpoint_path, "model")
-                    if os.path.exists(model_subdir):
-                        model_files = os.listdir(model_subdir)
-                        print(f"Files available in {model_subdir}: {model_files}")
-            except Exception as e:
-                print(f"Could not list files: {e}")
-            raise FileNotFoundError(
-                f"No model file found in {checkpoint_path}. Tried: {possible_filenames}"
-            )
-
-        # Load weights - for CUDA, load directly to GPU to save one copy operation
-        target_device = device_map["dit"]
-        if target_device.type == "cuda":
-            print(f"   → Loading DIT weights directly to {target_device}")
-            state_dict = load_file(full_model_path, device=str(target_device))
-            dit.load_state_dict(state_dict, assign=True)
-            # Parameters are now on GPU, but buffers are still on CPU
-            # .to() is smart - it only moves what's not already there
-            dit = dit.to(target_device)
-        else:
-            state_dict = load_file(full_model_path)
-            dit.load_state_dict(state_dict, assign=True)
-
-        if quantize_dit:
-            from .model_kd50_env import quantize_with_torch_ao
-
-            print("🔧 QUANTIZATION: Applying torchao int8 quantization to DIT model...")
-            print(f"   DIT device before quantization: {next(dit.parameters()).device}")
-
-            dit = quantize_with_torch_ao(dit)
-
-            print(f"   DIT device after quantization: {next(dit.parameters()).device}")
-            print("✅ QUANTIZATION: DIT quantization process completed")
-            print(f"   → Quantized DIT ready on: {next(dit.parameters()).device}")
-        else:
-            print(
-                "ℹ️  QUANTIZATION: DIT model will use fp16 (int8 quantization disabled)"
-            )
-            print(f"   → DIT ready on: {next(dit.parameters()).device}")
 
     if world_size > 1 and not offload:
         dit = parallelize_dit(dit, device_mesh["tensor_parallel"])
@@ -402,8 +409,10 @@ def get_T2V_pipeline(
         pipeline._deferred_loading_params = {
             "magcache": magcache,
             "quantize_dit": quantize_dit,
+            "quantized_cache_dir": quantized_cache_dir,
             "use_torch_compile_dit": use_torch_compile_dit,
             "use_torch_compile_vae": use_torch_compile_vae,
+            "offload_resident_blocks": offload_resident_blocks,
         }
 
     if not use_torch_compile_dit:
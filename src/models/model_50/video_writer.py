@@ -0,0 +1,104 @@
+"""Background MP4 writer for streaming Kandinsky-5 VAE output."""
+
+from __future__ import annotations
+
+import queue
+import threading
+from typing import Optional
+
+import numpy as np
+
+try:
+    import av
+except ImportError:
+    av = None
+
+
+def streaming_available() -> bool:
+    return av is not None
+
+
+class StreamingVideoWriter:
+    """
+    Encodes uint8 ``[frames, height, width, 3]`` chunks to an H.264 MP4 on a
+    background thread, so encoding overlaps decoding of the next VAE tile.
+    The queue is bounded, so at most ``max_pending`` chunks are held in host
+    memory at any time. Encoder settings match ``torchvision.io.write_video``.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fps: int = 24,
+        options: Optional[dict] = None,
+        max_pending: int = 2,
+    ) -> None:
+        if av is None:
+            raise ImportError("PyAV is required for streaming video output")
+
+        self.path = path
+        self.fps = fps
+        self.options = options or {}
+        self.frames_written = 0
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(
+            target=self._run, name="kd5-video-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, frames: np.ndarray) -> None:
+        self._raise_if_failed()
+        self._queue.put(frames)
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_if_failed()
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(
+                f"Video encoding failed for {self.path}: {self._error}"
+            ) from self._error
+
+    def _run(self) -> None:
+        container = None
+        stream = None
+        try:
+            while True:
+                frames = self._queue.get()
+                if frames is None:
+                    break
+
+                if container is None:
+                    container = av.open(self.path, mode="w")
+                    stream = container.add_stream("libx264", rate=self.fps)
+                    stream.width = frames.shape[2]
+                    stream.height = frames.shape[1]
+                    stream.pix_fmt = "yuv420p"
+                    stream.options = self.options
+
+                for image in frames:
+                    frame = av.VideoFrame.from_ndarray(image, format="rgb24")
+                    for packet in stream.encode(frame):
+                        container.mux(packet)
+                    self.frames_written += 1
+        except BaseException as e:
+            self._error = e
+            # keep draining so the producer never blocks on a full queue
+            while self._queue.get() is not None:
+                pass
+        finally:
+            if container is not None:
+                try:
+                    if self._error is None:
+                        for packet in stream.encode():
+                            container.mux(packet)
+                finally:
+                    container.close()
+
+
+__all__ = ["StreamingVideoWriter", "streaming_available"]
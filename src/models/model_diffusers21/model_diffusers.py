@@ -16,6 +16,7 @@ import itertools
 import os
 import secrets
 from params import KubinParams
+from progress import calibrate_preview, report_progress
 from utils.file_system import save_output
 
 
@@ -250,7 +251,18 @@ class Model_Diffusers:
                 latents=None,
                 output_type="pil",
                 return_dict=True,
+                callback=lambda s, ts, ft: report_progress(
+                    "text2img",
+                    "decoder",
+                    params["num_steps"] * params["batch_count"],
+                    s,
+                    ts,
+                    ft,
+                    latent_format="movq",
+                ),
+                callback_steps=1,
             ).images
+            calibrate_preview("movq", current_batch[0])
 
             output_dir = params.get(
                 ".output_dir",
@@ -301,7 +313,18 @@ class Model_Diffusers:
                 generator=generator,
                 output_type="pil",
                 return_dict=True,
+                callback=lambda s, ts, ft: report_progress(
+                    "img2img",
+                    "decoder",
+                    params["num_steps"] * params["batch_count"],
+                    s,
+                    ts,
+                    ft,
+                    latent_format="movq",
+                ),
+                callback_steps=1,
             ).images
+            calibrate_preview("movq", current_batch[0])
 
             output_dir = params.get(
                 ".output_dir",
@@ -363,7 +386,18 @@ class Model_Diffusers:
                 latents=None,
                 output_type="pil",
                 return_dict=True,
+                callback=lambda s, ts, ft: report_progress(
+                    "mix",
+                    "decoder",
+                    params["num_steps"] * params["batch_count"],
+                    s,
+                    ts,
+                    ft,
+                    latent_format="movq",
+                ),
+                callback_steps=1,
             ).images
+            calibrate_preview("movq", current_batch[0])
 
             output_dir = params.get(
                 ".output_dir", os.path.join(self.params("general", "output_dir"), "mix")
@@ -438,7 +472,18 @@ class Model_Diffusers:
                 latents=None,
                 output_type="pil",
                 return_dict=True,
+                callback=lambda s, ts, ft: report_progress(
+                    "inpainting",
+                    "decoder",
+                    params["num_steps"] * params["batch_count"],
+                    s,
+                    ts,
+                    ft,
+                    latent_format="movq",
+                ),
+                callback_steps=1,
             ).images
+            calibrate_preview("movq", current_batch[0])
 
             if inpaint_region == "mask":
                 current_batch_composed = []
@@ -503,7 +548,18 @@ class Model_Diffusers:
                 latents=None,
                 output_type="pil",
                 return_dict=True,
+                callback=lambda s, ts, ft: report_progress(
+                    "outpainting",
+                    "decoder",
+                    params["num_steps"] * params["batch_count"],
+                    s,
+                    ts,
+                    ft,
+                    latent_format="movq",
+                ),
+                callback_steps=1,
             ).images
+            calibrate_preview("movq", current_batch[0])
 
             output_dir = params.get(
                 ".output_dir",
@@ -20,7 +20,7 @@ from models.model_diffusers22.patched.patched_prior import (
 from models.model_diffusers22.patched.patched_prior_emb2emb import (
     KandinskyV22PriorEmb2EmbPipelinePatched,
 )
-from progress import report_progress
+from progress import calibrate_preview, report_progress
 
 from utils.image import (
     composite_images,
@@ -90,6 +90,14 @@ class Model_Diffusers22:
 
         clear_pipe_info(self)
 
+    def affinity(self, task, params):
+        # mirrors the pipeline groups released by flush_if_required
+        if task in ["inpaint", "outpaint"]:
+            return "inpainting"
+        if params.get("cnet_enable", False):
+            return "controlnet"
+        return "decoder"
+
     def prepare_model(self, task):
         k_log(f"task queued: {task}")
         assert task in [
@@ -269,9 +277,11 @@ class Model_Diffusers22:
                     s,
                     ts,
                     ft,
+                    latent_format="movq",
                 ),
                 callback_steps=1,
             ).images
+            calibrate_preview("movq", current_batch[0])
 
             hook_params["batch"] = current_batch
             execute_forced_hooks(HOOK.BEFORE_BATCH_SAVE, params, hook_params)
@@ -16,6 +16,7 @@ from models.model_diffusers30.model_30_init import (
     prepare_autopipeline_for_task,
 )
 from params import KubinParams
+from progress import calibrate_preview, report_progress
 from utils.file_system import save_output
 from utils.logging import k_log
 
@@ -95,13 +96,22 @@ class Model_Diffusers3:
                 # negative_attention_mask=None,
                 output_type="pil",
                 return_dict=True,
-                callback=None,
+                callback=lambda s, ts, ft: report_progress(
+                    "text2img",
+                    "unet",
+                    params["num_steps"] * params["batch_count"],
+                    s,
+                    ts,
+                    ft,
+                    latent_format="kandinsky3_movq",
+                ),
                 callback_steps=1,
                 # clean_caption=True,
                 # cross_attention_kwargs=None,
                 latents=None,
                 # cut_context=True,
             ).images
+            calibrate_preview("kandinsky3_movq", current_batch[0])
 
             images += self.create_batch_images(params, "text2img", current_batch)
         k_log("text2img task: done")
@@ -133,12 +143,21 @@ class Model_Diffusers3:
                 # negative_attention_mask=None,
                 output_type="pil",
                 return_dict=True,
-                callback=None,
+                callback=lambda s, ts, ft: report_progress(
+                    "img2img",
+                    "unet",
+                    params["num_steps"] * params["batch_count"],
+                    s,
+                    ts,
+                    ft,
+                    latent_format="kandinsky3_movq",
+                ),
                 callback_steps=1,
                 # callback_on_step_end=None
                 # callback_on_step_end_tensor_inputs=None
                 latents=None,
             ).images
+            calibrate_preview("kandinsky3_movq", current_batch[0])
 
             images += self.create_batch_images(params, "img2img", current_batch)
         k_log("img2img task: done")
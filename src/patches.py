@@ -9,20 +9,12 @@ def get_current_env_packages():
     return sysconfig.get_path("purelib")
 
 
-def patch():
+def patch(headless=False):
     os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
     os.environ["TRITON_CACHE_DIR"] = os.path.join(os.getcwd(), "__triton__")
-    import gradio.analytics
-
-    def custom_version_check():
-        global check_executed
-        if not check_executed:
-            check_executed = True
-            print(
-                "fyi: kubin uses an old version of Gradio (3.50.2), which is now considered deprecated for security reasons.\nhowever, the author is too stubborn to upgrade (https://github.com/seruva19/kubin/blob/main/DOCS.md#gradio-4)."
-            )
 
-    gradio.analytics.version_check = custom_version_check
+    if not headless:
+        patch_gradio()
 
     try:
         kandinsky21_file_path = os.path.join(
@@ -93,6 +85,20 @@ def patch():
         print("cannot patch transformers, some modules might be not functional")
 
 
+def patch_gradio():
+    import gradio.analytics
+
+    def custom_version_check():
+        global check_executed
+        if not check_executed:
+            check_executed = True
+            print(
+                "fyi: kubin uses an old version of Gradio (3.50.2), which is now considered deprecated for security reasons.\nhowever, the author is too stubborn to upgrade (https://github.com/seruva19/kubin/blob/main/DOCS.md#gradio-4)."
+            )
+
+    gradio.analytics.version_check = custom_version_check
+
+
 def replace_in_file(file_path, old_text, new_text):
     with open(file_path, "r") as f:
         content = f.read()
@@ -1,32 +1,226 @@
-import gradio as gr
+import asyncio
+import base64
+import contextvars
+import io
+import json
+import threading
+import time
+from contextlib import contextmanager
 
-task_progress = {"progress": {}, "poll_interval": -1, "cancel": False}
+task_progress = {
+    "push_interval": 0.25,
+    "preview_size": 0,
+    "preview_steps": 1,
+    "cancel": False,
+}
 
+_current_session = contextvars.ContextVar("kubin_progress_session", default=None)
 
-def report_progress(task, stage, total_steps, step, timestep, latents):
-    task_progress["progress"] = {
+
+class ProgressStream:
+    """
+    Latest progress event per ``.session``. Events are rate-limited on the
+    producer side and pushed to the SSE subscribers of the same session only.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = {}
+        self.last_published = {}
+        self.subscribers = {}
+
+    def should_publish(self, session, stage, step, total_steps):
+        last = self.last_published.get(session)
+        if last is None or last[1] != stage or step >= total_steps:
+            return True
+        return time.monotonic() - last[0] >= task_progress["push_interval"]
+
+    def publish(self, session, event):
+        with self.lock:
+            self.events[session] = event
+            self.last_published[session] = (time.monotonic(), event.get("stage"))
+            subscribers = list(self.subscribers.get(session, ()))
+
+        for loop, notify in subscribers:
+            loop.call_soon_threadsafe(notify.set)
+
+    def finish(self, session):
+        self.publish(session, {"finished": True})
+        with self.lock:
+            self.last_published.pop(session, None)
+
+    def subscribe(self, session):
+        notify = asyncio.Event()
+        entry = (asyncio.get_running_loop(), notify)
+        with self.lock:
+            self.subscribers.setdefault(session, set()).add(entry)
+        return entry
+
+    def unsubscribe(self, session, entry):
+        with self.lock:
+            subscribers = self.subscribers.get(session)
+            if subscribers is not None:
+                subscribers.discard(entry)
+                if not subscribers:
+                    del self.subscribers[session]
+                    self.events.pop(session, None)
+
+    def latest(self, session):
+        with self.lock:
+            return self.events.get(session)
+
+
+progress_stream = ProgressStream()
+
+
+@contextmanager
+def progress_session(session):
+    token = _current_session.set(session)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+        if session is not None:
+            progress_stream.finish(session)
+
+
+def with_progress_session(generate_fn):
+    # UI handlers run generate_fn in a worker thread so the event loop stays
+    # free to push progress; kubin.scheduler keeps generations one at a time
+    def generate(params):
+        with progress_session(params.get(".session", None)):
+            return generate_fn(params)
+
+    return generate
+
+
+def encode_preview(image):
+    if image is None:
+        return None
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=70)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def report_progress(
+    task, stage, total_steps, step, timestep, latents, latent_format=None
+):
+    session = _current_session.get()
+
+    previewer = None
+    if latent_format is not None and task_progress["preview_size"] > 0:
+        from utils.latent_preview import get_previewer
+
+        previewer = get_previewer(latent_format, task_progress["preview_size"])
+        previewer.track(latents)
+
+    last_step = step >= total_steps
+    if not progress_stream.should_publish(session, stage, step, total_steps):
+        return
+
+    preview = None
+    if previewer is not None:
+        # thumbnails are computed off the denoising stream and picked up on
+        # a later step, only the last step waits for its own
+        if not last_step:
+            preview = previewer.collect()
+        if last_step or step % task_progress["preview_steps"] == 0:
+            previewer.submit(latents)
+        if last_step:
+            preview = previewer.collect(wait=True)
+
+    event = {
         "task": task,
         "stage": stage,
         "total_steps": total_steps,
         "step": step,
-        "timestep": timestep,
-        "latents": latents,
+        "timestep": float(timestep) if timestep is not None else None,
+        "preview": encode_preview(preview),
     }
 
+    progress_stream.publish(session, event)
+
+
+def calibrate_preview(latent_format, image, latents=None):
+    if task_progress["preview_size"] <= 0:
+        return
+
+    from utils.latent_preview import get_previewer
+
+    get_previewer(latent_format, task_progress["preview_size"]).calibrate(
+        image, latents
+    )
+
+
+def register_progress_stream(app):
+    from fastapi import Request
+    from fastapi.responses import StreamingResponse
+
+    async def stream(session: str, request: Request):
+        entry = progress_stream.subscribe(session)
+        _, notify = entry
+        if progress_stream.latest(session) is not None:
+            notify.set()
+
+        async def events():
+            try:
+                while not await request.is_disconnected():
+                    try:
+                        await asyncio.wait_for(notify.wait(), timeout=15)
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+                        continue
+
+                    notify.clear()
+                    event = progress_stream.latest(session)
+                    if event is not None:
+                        yield f"data: {json.dumps(event)}\n\n"
+            finally:
+                progress_stream.unsubscribe(session, entry)
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    app.add_api_route("/kubin/progress/{session}", stream, methods=["GET"])
+
 
 def progress_api(kubin):
-    task_progress["poll_interval"] = kubin.params("ui", "progress_poll_interval")
+    import gradio as gr
+
+    task_progress["push_interval"] = float(kubin.params("ui", "progress_push_interval"))
+    task_progress["preview_size"] = int(kubin.params("ui", "progress_preview_size"))
+    task_progress["preview_steps"] = max(
+        1, int(kubin.params("ui", "progress_preview_steps"))
+    )
+
+    def output_progress(session):
+        # only the progress of the caller's own .session
+        return {"progress": progress_stream.latest(session) or {}}
 
-    def output_progress():
-        return task_progress
+    def output_queue():
+        return kubin.scheduler.status()
 
     with gr.Row(visible=False):
         dummy_progress_btn = gr.Button()
+        dummy_queue_btn = gr.Button()
         results_json = gr.JSON()
+        progress_session_id = gr.Textbox()
 
         dummy_progress_btn.click(
             output_progress,
-            inputs=None,
+            inputs=progress_session_id,
             outputs=results_json,
             api_name="progress",
         )
+
+        dummy_queue_btn.click(
+            output_queue,
+            inputs=None,
+            outputs=results_json,
+            queue=False,
+            api_name="queue",
+        )
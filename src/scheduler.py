@@ -0,0 +1,129 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.logging import k_log
+
+
+class _Job:
+    def __init__(self, seq, task, affinity):
+        self.seq = seq
+        self.task = task
+        self.affinity = affinity
+        self.submitted = time.monotonic()
+        self.skipped = 0
+
+
+class JobScheduler:
+    """
+    Runs generation jobs one at a time in front of ``kubin.model``.
+
+    Pending jobs are grouped by affinity, the pipeline a job needs loaded
+    (``model.affinity(task, params)`` when the model defines it, the task
+    otherwise). Jobs matching the currently loaded pipeline go first, so
+    concurrent users of different pipelines do not force a weight swap on
+    every request. A job that has been overtaken ``max_skips`` times or waited
+    ``max_wait`` seconds is run next regardless of affinity.
+
+    Each job runs in the thread that submitted it, so thread-bound state such
+    as the progress session is kept.
+    """
+
+    def __init__(self, kubin, max_wait=120.0, max_skips=4):
+        self.kubin = kubin
+        self.max_wait = max_wait
+        self.max_skips = max_skips
+
+        self.cond = threading.Condition()
+        self.counter = itertools.count()
+        self.pending = []
+        self.running = None
+        self.loaded_affinity = None
+
+    def affinity(self, task, params):
+        model = self.kubin.model
+        if hasattr(model, "affinity"):
+            return model.affinity(task, params)
+        return task
+
+    def select(self):
+        now = time.monotonic()
+        starving = [
+            job
+            for job in self.pending
+            if job.skipped >= self.max_skips or now - job.submitted >= self.max_wait
+        ]
+        if starving:
+            return min(starving, key=lambda job: job.seq)
+
+        affine = [job for job in self.pending if job.affinity == self.loaded_affinity]
+        if affine:
+            return min(affine, key=lambda job: job.seq)
+
+        return min(self.pending, key=lambda job: job.seq)
+
+    @contextmanager
+    def slot(self, task, params):
+        with self.cond:
+            job = _Job(next(self.counter), task, self.affinity(task, params))
+            self.pending.append(job)
+
+            while self.running is not None or self.select() is not job:
+                self.cond.wait(timeout=1.0)
+
+            self.pending.remove(job)
+            for other in self.pending:
+                if other.seq < job.seq:
+                    other.skipped += 1
+
+            if self.pending:
+                k_log(
+                    f"scheduler: running {task} ({job.affinity}), {len(self.pending)} job(s) waiting"
+                )
+            self.running = job
+
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.running = None
+                self.loaded_affinity = job.affinity
+                self.cond.notify_all()
+
+    def run(self, task, params):
+        with self.slot(task, params):
+            return getattr(self.kubin.model, task)(params)
+
+    def run_many(self, task, params_list):
+        """
+        Runs jobs of one task and affinity as a single scheduler job, through
+        ``model.<task>_many`` when the model can overlap them. Yields
+        ``(output, error)`` per job, in order.
+        """
+        with self.slot(task, params_list[0]):
+            run_many = getattr(self.kubin.model, f"{task}_many", None)
+            if run_many is not None:
+                yield from run_many(params_list)
+                return
+
+            run = getattr(self.kubin.model, task)
+            for params in params_list:
+                try:
+                    yield run(params), None
+                except Exception as e:
+                    yield None, e
+
+    def status(self):
+        with self.cond:
+            waiting = {}
+            for job in self.pending:
+                key = str(job.affinity)
+                waiting[key] = waiting.get(key, 0) + 1
+
+            return {
+                "depth": len(self.pending) + (self.running is not None),
+                "running": None if self.running is None else self.running.task,
+                "loaded": str(self.loaded_affinity),
+                "waiting": waiting,
+            }
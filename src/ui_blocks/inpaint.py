@@ -303,7 +303,7 @@ def inpaint_ui(generate_fn, shared: SharedUI, tabs, session):
                         elif params["target"] == "all but mask":
                             params["target"] = "only mask"
 
-                    yield generate_fn(params)
+                    yield await asyncio.to_thread(generate_fn, params)
 
                     if not shared.check("LOOP_INPAINT", False):
                         break
@@ -336,7 +336,7 @@ def outpaint_ui(generate_fn, shared: SharedUI, tabs, session):
                     shared.storage.save(block, saved_params)
                     params = augmentations["exec"](params, injections)
 
-                    yield generate_fn(params)
+                    yield await asyncio.to_thread(generate_fn, params)
 
                     if not shared.check("LOOP_OUTPAINT", False):
                         break
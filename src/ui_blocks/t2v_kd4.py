@@ -426,7 +426,7 @@ def t2v_kd4_ui(generate_fn, shared: SharedUI, tabs, session):
                     shared.storage.save(block, params)
 
                     params = augmentations["exec"](params, injections)
-                    yield generate_fn(params)
+                    yield await asyncio.to_thread(generate_fn, params)
 
                     if not shared.check("LOOP_T2V", False):
                         break
@@ -1177,7 +1177,7 @@ def t2v_kd5_ui(generate_fn, shared: SharedUI, tabs, session):
                     params = augmentations["exec"](params, injections)
 
                     try:
-                        yield generate_fn(params)
+                        yield await asyncio.to_thread(generate_fn, params)
                     except InterruptedError as e:
                         # Handle cancellation specifically
                         print(f"Generation cancelled: {e}")
@@ -1,3 +1,4 @@
+import asyncio
 import gradio as gr
 from ui_blocks.shared.compatibility import (
     batch_size_classes,
@@ -147,7 +148,7 @@ def v2a_ui(generate_fn, shared: SharedUI, tabs, session):
                     shared.storage.save(block, params)
 
                     params = augmentations["exec"](params, injections)
-                    yield generate_fn(params)
+                    yield await asyncio.to_thread(generate_fn, params)
 
                     if not shared.check("LOOP_V2A", False):
                         break
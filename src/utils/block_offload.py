@@ -0,0 +1,191 @@
+"""
+Block-level offloading of transformer weights with prefetch on a copy stream.
+"""
+
+from functools import partial
+from itertools import chain
+from typing import List, Optional, Sequence, Union
+
+import torch
+import torch.nn as nn
+
+from utils.logging import k_log
+
+
+class _Block:
+    def __init__(self, module: nn.Module, pin: bool):
+        self.module = module
+        self.tensors: List[torch.Tensor] = list(
+            chain(module.parameters(), module.buffers())
+        )
+        self.host = [_host_copy(t.data, pin) for t in self.tensors]
+        self.ready: Optional[torch.cuda.Event] = None
+        self.on_device = False
+
+        for tensor, host in zip(self.tensors, self.host):
+            tensor.data = host
+
+    @property
+    def nbytes(self) -> int:
+        return sum(t.numel() * t.element_size() for t in self.host)
+
+
+def _host_copy(tensor: torch.Tensor, pin: bool) -> torch.Tensor:
+    if tensor.device.type == "cpu" and (tensor.is_pinned() or not pin):
+        return tensor
+    try:
+        host = torch.empty_like(tensor, device="cpu", pin_memory=pin)
+    except RuntimeError:
+        host = torch.empty_like(tensor, device="cpu")
+    host.copy_(tensor)
+    return host
+
+
+class BlockOffloader:
+    """
+    Runs a model whose transformer blocks live in pinned host memory.
+
+    ``load`` moves everything except ``blocks`` to ``device``. The blocks are
+    copied to the GPU on a side stream shortly before they run: entering
+    block ``i`` queues the copies of the next ``resident_blocks - 1`` blocks,
+    so they overlap the compute of the current one, and leaving block ``i``
+    drops its device copy. At most ``resident_blocks`` blocks are on the
+    device at any time. Blocks are expected to run in the order given, the
+    order wraps around for the next forward pass.
+
+    The pinned copies are made once and kept, so ``release`` (back to the
+    host) is free and every later ``load`` only moves the small non-block
+    weights.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        blocks: Sequence[nn.Module],
+        device: Union[str, torch.device],
+        resident_blocks: int = 4,
+    ):
+        self.model = model
+        self.device = torch.device(device)
+        self.resident_blocks = max(1, min(resident_blocks, len(blocks)))
+        self.copy_stream = torch.cuda.Stream(self.device)
+
+        self.blocks = [_Block(block, pin=True) for block in blocks]
+        block_tensors = {id(t) for block in self.blocks for t in block.tensors}
+        self.rest = [
+            t
+            for t in chain(model.parameters(), model.buffers())
+            if id(t) not in block_tensors
+        ]
+        self.rest_host = [_host_copy(t.data, pin=False) for t in self.rest]
+
+        self.hooks = []
+        for index, block in enumerate(self.blocks):
+            self.hooks.append(
+                block.module.register_forward_pre_hook(partial(self._enter, index))
+            )
+            self.hooks.append(
+                block.module.register_forward_hook(partial(self._leave, index))
+            )
+
+        k_log(
+            f"block offload: {len(self.blocks)} blocks ({round(sum(b.nbytes for b in self.blocks) / 1024**2)} MB) in pinned memory, {self.resident_blocks} resident on {self.device}"
+        )
+
+    def load(self):
+        for tensor, host in zip(self.rest, self.rest_host):
+            tensor.data = host.to(self.device)
+        for index in range(self.resident_blocks):
+            self._fetch(index)
+
+    def release(self):
+        for index in range(len(self.blocks)):
+            self._evict(index)
+        for tensor, host in zip(self.rest, self.rest_host):
+            tensor.data = host
+
+    def remove(self):
+        self.release()
+        for hook in self.hooks:
+            hook.remove()
+        self.hooks = []
+
+    def _fetch(self, index: int):
+        block = self.blocks[index]
+        if block.on_device:
+            return
+
+        with torch.cuda.stream(self.copy_stream):
+            for tensor, host in zip(block.tensors, block.host):
+                device_tensor = torch.empty_like(host, device=self.device)
+                device_tensor.copy_(host, non_blocking=True)
+                tensor.data = device_tensor
+            block.ready = torch.cuda.Event()
+            block.ready.record(self.copy_stream)
+        block.on_device = True
+
+    def _evict(self, index: int):
+        block = self.blocks[index]
+        if not block.on_device:
+            return
+
+        # the caching allocator holds the memory back until the compute
+        # stream is done with it (record_stream in _enter)
+        for tensor, host in zip(block.tensors, block.host):
+            tensor.data = host
+        block.ready = None
+        block.on_device = False
+
+    def _enter(self, index, module, args):
+        count = len(self.blocks)
+        window = {(index + offset) % count for offset in range(self.resident_blocks)}
+
+        # blocks skipped since they were prefetched (e.g. cached steps) would
+        # otherwise stay on the device past the budget
+        for other in range(count):
+            if other not in window:
+                self._evict(other)
+
+        self._fetch(index)
+        block = self.blocks[index]
+        stream = torch.cuda.current_stream(self.device)
+        if block.ready is not None:
+            stream.wait_event(block.ready)
+            for tensor in block.tensors:
+                tensor.data.record_stream(stream)
+            block.ready = None
+
+        for offset in range(1, self.resident_blocks):
+            self._fetch((index + offset) % count)
+
+    def _leave(self, index, module, args, output):
+        if self.resident_blocks < len(self.blocks):
+            self._evict(index)
+
+
+def block_offloader(
+    model: nn.Module,
+    blocks: Sequence[nn.Module],
+    device: Union[str, torch.device],
+    resident_blocks: int,
+) -> Optional[BlockOffloader]:
+    """
+    The ``BlockOffloader`` of ``model``, created on first use and kept on the
+    model afterwards; ``None`` when block offloading does not apply.
+    """
+    device = torch.device(device)
+    if resident_blocks <= 0 or device.type != "cuda" or len(blocks) == 0:
+        return None
+
+    offloader = getattr(model, "_block_offloader", None)
+    if offloader is not None and (
+        offloader.device != device
+        or offloader.resident_blocks != max(1, min(resident_blocks, len(blocks)))
+    ):
+        offloader.remove()
+        offloader = None
+
+    if offloader is None:
+        offloader = BlockOffloader(model, blocks, device, resident_blocks)
+        model._block_offloader = offloader
+    return offloader
@@ -0,0 +1,194 @@
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from utils.logging import k_log
+
+# HunyuanVideo VAE (Kandinsky 5), applied to scaled latents, output in [-1, 1]
+HUNYUAN_VIDEO_RGB_FACTORS = (
+    [
+        [-0.0395, -0.0331, 0.0445],
+        [0.0696, 0.0795, 0.0518],
+        [0.0135, -0.0945, -0.0282],
+        [0.0108, -0.0250, -0.0765],
+        [-0.0209, 0.0032, 0.0224],
+        [-0.0804, -0.0254, -0.0639],
+        [-0.0991, 0.0271, -0.0669],
+        [-0.0646, -0.0422, -0.0400],
+        [-0.0696, -0.0595, -0.0894],
+        [-0.0799, -0.0208, -0.0375],
+        [0.1166, 0.1627, 0.0962],
+        [0.1165, 0.0432, 0.0407],
+        [-0.2315, -0.1920, -0.1355],
+        [-0.0270, 0.0401, -0.0821],
+        [-0.0616, -0.0997, -0.0727],
+        [0.0249, -0.0469, -0.1703],
+    ],
+    [0.0259, -0.0192, -0.0761],
+)
+
+# channels_last: latents come as [frames, height, width, channels]
+# (Kandinsky 4/5 DiT), otherwise as [batch, channels, height, width] (MoVQ).
+# Kandinsky 2.1 and 2.2 share one MoVQ, Kandinsky 3.0 and 3.1 another. The
+# native 2.0/2.1 pipelines sample inside the kandinsky2 package, which has no
+# step callback, so they report no progress and have no format here
+LATENT_FORMATS = {
+    "movq": {"channels_last": False, "factors": None},
+    "kandinsky3_movq": {"channels_last": False, "factors": None},
+    "cogvideox": {"channels_last": True, "factors": None},
+    "hunyuan_video": {"channels_last": True, "factors": HUNYUAN_VIDEO_RGB_FACTORS},
+}
+
+
+class LatentPreviewer:
+    """
+    Projects in-flight latents of one format to a small RGB thumbnail.
+
+    Formats with known factors use them right away. Every format is
+    (re)fitted once per process by least squares against the first decoded
+    result, so formats without factors get a proper projection after the first
+    generation and fall back to min-max scaled channels until then.
+
+    On CUDA, pooling runs on a side stream and lands in pinned memory; the
+    thumbnail is collected on a later call once it is ready, so the denoising
+    stream never waits for it.
+    """
+
+    def __init__(self, latent_format: str, size: int = 64):
+        spec = LATENT_FORMATS[latent_format]
+        self.latent_format = latent_format
+        self.channels_last = spec["channels_last"]
+        self.size = size
+        self.weight: Optional[torch.Tensor] = None
+        self.bias: Optional[torch.Tensor] = None
+        self.fitted = False
+
+        if spec["factors"] is not None:
+            weight, bias = spec["factors"]
+            self.weight = torch.tensor(weight) * 0.5
+            self.bias = torch.tensor(bias) * 0.5 + 0.5
+
+        self.last_latents: Optional[torch.Tensor] = None
+        self.streams: Dict[torch.device, torch.cuda.Stream] = {}
+        self.pending = None
+
+    def first_frame(self, latents: torch.Tensor) -> Optional[torch.Tensor]:
+        if latents.dim() != 4:
+            return None
+        frame = latents[0]
+        return frame.permute(2, 0, 1) if self.channels_last else frame
+
+    def pool(self, frame: torch.Tensor, size: int) -> torch.Tensor:
+        frame = frame.detach().float()
+        scale = size / max(frame.shape[-2:])
+        if scale < 1:
+            frame = F.interpolate(frame[None], scale_factor=scale, mode="area")[0]
+        return frame
+
+    def track(self, latents: torch.Tensor):
+        self.last_latents = latents
+
+    def submit(self, latents: torch.Tensor):
+        frame = self.first_frame(latents)
+        if frame is None:
+            return
+
+        if not frame.is_cuda:
+            self.pending = (None, self.pool(frame, self.size))
+            return
+
+        device = frame.device
+        stream = self.streams.get(device)
+        if stream is None:
+            stream = self.streams[device] = torch.cuda.Stream(device)
+
+        stream.wait_stream(torch.cuda.current_stream(device))
+        with torch.cuda.stream(stream):
+            frame.record_stream(stream)
+            pooled = self.pool(frame, self.size)
+            host = torch.empty(pooled.shape, dtype=pooled.dtype, pin_memory=True)
+            host.copy_(pooled, non_blocking=True)
+            ready = torch.cuda.Event()
+            ready.record(stream)
+        self.pending = (ready, host)
+
+    def collect(self, wait: bool = False) -> Optional[Image.Image]:
+        if self.pending is None:
+            return None
+
+        ready, pooled = self.pending
+        if ready is not None:
+            if wait:
+                ready.synchronize()
+            elif not ready.query():
+                return None
+
+        self.pending = None
+        return self.to_image(pooled)
+
+    def to_image(self, pooled: torch.Tensor) -> Optional[Image.Image]:
+        channels = pooled.shape[0]
+        if self.weight is not None and self.weight.shape[0] == channels:
+            rgb = torch.einsum("chw,cr->rhw", pooled, self.weight)
+            rgb = rgb + self.bias[:, None, None]
+        elif channels >= 3:
+            rgb = pooled[:3]
+            low = rgb.amin(dim=(1, 2), keepdim=True)
+            high = rgb.amax(dim=(1, 2), keepdim=True)
+            rgb = (rgb - low) / (high - low + 1e-6)
+        else:
+            return None
+
+        rgb = (rgb.clamp(0, 1) * 255).to(torch.uint8)
+        return Image.fromarray(rgb.permute(1, 2, 0).numpy())
+
+    def calibrate(self, image, latents: Optional[torch.Tensor] = None):
+        """
+        Fits the projection on final ``latents`` (or the last tracked ones) and
+        the matching decoded ``image`` (PIL, or a [3, H, W] tensor in [0, 1]).
+        """
+        latents = latents if latents is not None else self.last_latents
+        self.last_latents = None
+        if self.fitted or latents is None:
+            return
+
+        frame = self.first_frame(latents)
+        if frame is None:
+            return
+
+        if isinstance(image, Image.Image):
+            image = torch.from_numpy(np.asarray(image.convert("RGB")).copy())
+            image = image.permute(2, 0, 1).float() / 255
+
+        frame = self.pool(frame, 128).cpu()
+        target = F.interpolate(
+            image.detach().float().cpu()[None], size=frame.shape[-2:], mode="area"
+        )[0]
+
+        x = frame.flatten(1).T
+        x = torch.cat([x, torch.ones_like(x[:, :1])], dim=1)
+        y = target.flatten(1).T
+
+        try:
+            solution = torch.linalg.lstsq(x, y).solution
+        except RuntimeError as e:
+            k_log(f"cannot fit latent preview for {self.latent_format}: {e}")
+            return
+
+        self.weight, self.bias = solution[:-1], solution[-1]
+        self.fitted = True
+        k_log(f"latent preview projection fitted for {self.latent_format}")
+
+
+previewers: Dict[str, LatentPreviewer] = {}
+
+
+def get_previewer(latent_format: str, size: int) -> LatentPreviewer:
+    previewer = previewers.get(latent_format)
+    if previewer is None:
+        previewer = previewers[latent_format] = LatentPreviewer(latent_format, size)
+    previewer.size = size
+    return previewer
@@ -5,6 +5,8 @@ import torch
 from collections import defaultdict
 from safetensors.torch import _find_shared_tensors, _is_complete, load_file, save_file
 
+from utils.logging import k_log
+
 
 def shared_pointers(tensors):
     ptrs = defaultdict(list)
@@ -138,6 +140,79 @@ def read_safetensors_metadata(path):
         return metadata
 
 
+def _checkpoint_stamp(pt_filename: str) -> str:
+    stat = os.stat(os.path.realpath(pt_filename))
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def load_checkpoint_entries(
+    pt_filename: str, keys: List[str], sidecar_tag: str = "entries"
+) -> Dict[str, object]:
+    """
+    Reads only ``keys`` (tensors or nested state dicts) from a pickled
+    checkpoint. The first call extracts them into a small
+    ``<checkpoint>.<sidecar_tag>.safetensors`` file next to the checkpoint,
+    later calls read that file instead. The checkpoint itself is opened with
+    ``mmap=True`` so only the requested tensors are paged in.
+    """
+    sidecar = f"{pt_filename}.{sidecar_tag}.safetensors"
+    stamp = _checkpoint_stamp(pt_filename)
+
+    if os.path.exists(sidecar):
+        try:
+            if read_safetensors_metadata(sidecar).get("source") == stamp:
+                flat = load_file(sidecar)
+                entries = {}
+                for key in keys:
+                    if key in flat:
+                        entries[key] = flat[key]
+                    else:
+                        prefix = f"{key}."
+                        entries[key] = {
+                            name[len(prefix) :]: value
+                            for name, value in flat.items()
+                            if name.startswith(prefix)
+                        }
+                if all(
+                    isinstance(value, torch.Tensor) or value
+                    for value in entries.values()
+                ):
+                    return entries
+        except Exception as e:
+            k_log(f"cannot read checkpoint sidecar {sidecar}: {e}")
+
+    try:
+        state_dict = torch.load(pt_filename, map_location="cpu", mmap=True)
+    except RuntimeError:
+        # legacy (non-zip) checkpoints cannot be memory-mapped
+        state_dict = torch.load(pt_filename, map_location="cpu")
+
+    entries = {}
+    flat = {}
+    for key in keys:
+        value = state_dict[key]
+        if isinstance(value, torch.Tensor):
+            value = value.clone()
+            flat[key] = value
+        else:
+            value = {name: tensor.clone() for name, tensor in value.items()}
+            flat.update({f"{key}.{name}": tensor for name, tensor in value.items()})
+        entries[key] = value
+    del state_dict
+
+    try:
+        save_file(
+            {k: v.contiguous() for k, v in flat.items()},
+            sidecar,
+            metadata={"format": "pt", "source": stamp},
+        )
+        k_log(f"extracted {', '.join(keys)} from {pt_filename} to {sidecar}")
+    except Exception as e:
+        k_log(f"cannot write checkpoint sidecar {sidecar}: {e}")
+
+    return entries
+
+
 # https://huggingface.co/Kijai/flux-fp8/discussions/7#66ae0455a20def3de3c6d476
 def convert_torch_dtype(
     src_path: str, target_path: str, target_dtype_format: torch.dtype
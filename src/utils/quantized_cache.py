@@ -0,0 +1,134 @@
+"""
+On-disk cache of quantized state dicts (torchao and optimum-quanto).
+"""
+
+import hashlib
+import os
+from importlib.metadata import PackageNotFoundError, version
+from typing import Callable, Optional
+
+import torch
+import torch.nn as nn
+
+from utils.logging import k_log
+
+SCHEME_LIBRARIES = {"torchao": "torchao", "quanto": "optimum-quanto"}
+FINGERPRINT_SAMPLES = 64
+
+
+def library_version(package: str) -> str:
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return "none"
+
+
+def state_fingerprint(model: nn.Module) -> str:
+    # names, shapes and dtypes of every tensor plus the first and last few
+    # values of each, gathered in one device-to-host copy; telling apart two
+    # checkpoints of the same architecture does not need every weight
+    digest = hashlib.sha256()
+    samples = []
+    for name, tensor in model.state_dict().items():
+        digest.update(f"{name}:{tuple(tensor.shape)}:{tensor.dtype};".encode())
+        if tensor.numel() > 0 and tensor.is_floating_point():
+            flat = tensor.detach().reshape(-1)
+            samples.append(flat[:FINGERPRINT_SAMPLES].float())
+            samples.append(flat[-FINGERPRINT_SAMPLES:].float())
+
+    if len(samples) > 0:
+        devices = {sample.device for sample in samples}
+        if len(devices) > 1:
+            samples = [sample.cpu() for sample in samples]
+        digest.update(torch.cat(samples).cpu().numpy().tobytes())
+
+    return digest.hexdigest()
+
+
+def cache_path(model: nn.Module, scheme: str, cache_dir: str) -> str:
+    library = scheme.split("_")[0]
+    key = hashlib.sha256(
+        ";".join(
+            [
+                state_fingerprint(model),
+                scheme,
+                f"torch={torch.__version__}",
+                f"{library}={library_version(SCHEME_LIBRARIES[library])}",
+            ]
+        ).encode()
+    ).hexdigest()
+
+    return os.path.join(cache_dir, f"{scheme}-{key[:32]}.pt")
+
+
+def model_device(model: nn.Module) -> torch.device:
+    param = next(model.parameters(), None)
+    return param.device if param is not None else torch.device("cpu")
+
+
+def save_quantized(model: nn.Module, scheme: str, path: str):
+    if scheme.startswith("quanto"):
+        from optimum.quanto import quantization_map
+
+        payload = {
+            "state_dict": model.state_dict(),
+            "quantization_map": quantization_map(model),
+        }
+    else:
+        payload = model.state_dict()
+
+    # written under a temporary name so concurrent loaders never see a
+    # partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(payload, temp_path)
+    os.replace(temp_path, path)
+
+
+def load_quantized(model: nn.Module, scheme: str, path: str) -> nn.Module:
+    device = model_device(model)
+    payload = torch.load(path, map_location=device, mmap=True, weights_only=False)
+
+    if scheme.startswith("quanto"):
+        from optimum.quanto import requantize
+
+        requantize(model, payload["state_dict"], payload["quantization_map"], device)
+    else:
+        # assign keeps the quantized tensor subclasses instead of copying
+        # their values into the full precision parameters
+        model.load_state_dict(payload, assign=True)
+
+    return model
+
+
+def quantize_cached(
+    model: nn.Module,
+    scheme: str,
+    quantize: Callable[[nn.Module], nn.Module],
+    cache_dir: Optional[str] = None,
+) -> nn.Module:
+    """
+    Quantizes ``model`` with ``quantize``, or, when ``cache_dir`` is set,
+    loads the result of an earlier run over the same weights with the same
+    ``scheme`` ("torchao_*" or "quanto_*") and library versions.
+    """
+    if cache_dir is None:
+        return quantize(model)
+
+    path = cache_path(model, scheme, cache_dir)
+    if os.path.exists(path):
+        k_log(f"loading quantized weights from {path}")
+        try:
+            return load_quantized(model, scheme, path)
+        except Exception as e:
+            k_log(f"cannot load quantized weights from {path}, requantizing: {e}")
+
+    model = quantize(model)
+
+    k_log(f"saving quantized weights to {path}")
+    try:
+        save_quantized(model, scheme, path)
+    except Exception as e:
+        k_log(f"cannot save quantized weights to {path}: {e}")
+
+    return model
@@ -0,0 +1,108 @@
+"""
+Level-gated tracing for diagnostics on hot paths (per step, per block).
+
+Every subsystem has a ``Tracer`` with a level: 0 silent, 1 info, 2 debug.
+Call sites test the precomputed ``info`` / ``debug`` flags before building a
+message, so a disabled trace costs one attribute lookup:
+
+    trace = tracer("nabla", default_level=0)
+    ...
+    if trace.debug:
+        trace.log(f"query {tuple(query.shape)}", DEBUG)
+
+``KUBIN_TRACE`` sets the levels, e.g. ``nabla=2,magcache=0`` (``*`` applies
+to every subsystem without an entry of its own). With ``KUBIN_TRACE_BUFFER=N``
+messages are kept in a ring buffer of the last N records instead of being
+written to stdout; ``dump_trace`` prints the buffer, and does so at exit.
+"""
+
+import atexit
+import os
+import sys
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+SILENT = 0
+INFO = 1
+DEBUG = 2
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        try:
+            levels[name.strip()] = int(level)
+        except ValueError:
+            print(f"⚠️  Ignoring trace level {item!r} in KUBIN_TRACE")
+    return levels
+
+
+class Tracer:
+    def __init__(self, name: str, level: int):
+        self.name = name
+        self.set_level(level)
+
+    def set_level(self, level: int):
+        self.level = level
+        self.info = level >= INFO
+        self.debug = level >= DEBUG
+
+    def log(self, message: str, level: int = INFO):
+        if self.level >= level:
+            emit(self.name, level, message)
+
+
+_levels = parse_levels(os.environ.get("KUBIN_TRACE", ""))
+_buffer_size = int(os.environ.get("KUBIN_TRACE_BUFFER", "0"))
+_buffer: Optional[deque] = deque(maxlen=_buffer_size) if _buffer_size > 0 else None
+_tracers: Dict[str, Tracer] = {}
+
+
+def tracer(name: str, default_level: int = INFO) -> Tracer:
+    """
+    The tracer of subsystem ``name``, at its ``KUBIN_TRACE`` level or else
+    ``default_level``.
+    """
+    trace = _tracers.get(name)
+    if trace is None:
+        level = _levels.get(name, _levels.get("*", default_level))
+        trace = _tracers[name] = Tracer(name, level)
+    return trace
+
+
+def set_trace_level(name: str, level: int):
+    _levels[name] = level
+    if name in _tracers:
+        _tracers[name].set_level(level)
+
+
+def emit(name: str, level: int, message: str):
+    if _buffer is not None:
+        _buffer.append((time.time(), name, level, message))
+    else:
+        print(message)
+
+
+def trace_records() -> List[Tuple[float, str, int, str]]:
+    return list(_buffer) if _buffer is not None else []
+
+
+def dump_trace(file=None):
+    # one write for the whole buffer
+    records = trace_records()
+    if len(records) == 0:
+        return
+    (file or sys.stdout).write(
+        "".join(
+            f"[{time.strftime('%H:%M:%S', time.localtime(created))}] {name}: {message}\n"
+            for created, name, _, message in records
+        )
+    )
+    _buffer.clear()
+
+
+atexit.register(dump_trace)
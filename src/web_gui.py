@@ -1,6 +1,6 @@
 import gradio as gr
 from env import Kubin
-from progress import progress_api
+from progress import progress_api, with_progress_session
 from ui_blocks.i2i import i2i_ui
 from ui_blocks.i2v import i2v_ui
 from ui_blocks.inpaint import inpaint_ui
@@ -48,7 +48,9 @@ def gradio_ui(kubin: Kubin, start_fn):
         ) as ui_tabs:
             with gr.TabItem("Text To Image", id=0) as t2i_tabitem:
                 t2i_ui(
-                    generate_fn=lambda params: kubin.model.t2i(params),
+                    generate_fn=with_progress_session(
+                        lambda params: kubin.scheduler.run("t2i", params)
+                    ),
                     shared=ui_shared,
                     tabs=ui_tabs,
                     session=session,
@@ -56,7 +58,9 @@ def gradio_ui(kubin: Kubin, start_fn):
 
             with gr.TabItem("Image To Image", id=1) as i2i_tabitem:
                 i2i_ui(
-                    generate_fn=lambda params: kubin.model.i2i(params),
+                    generate_fn=with_progress_session(
+                        lambda params: kubin.scheduler.run("i2i", params)
+                    ),
                     shared=ui_shared,
                     tabs=ui_tabs,
                     session=session,
@@ -64,7 +68,9 @@ def gradio_ui(kubin: Kubin, start_fn):
 
             with gr.TabItem("Mix Images", id=2) as mix_tabitem:
                 mix_ui(
-                    generate_fn=lambda params: kubin.model.mix(params),
+                    generate_fn=with_progress_session(
+                        lambda params: kubin.scheduler.run("mix", params)
+                    ),
                     shared=ui_shared,
                     tabs=ui_tabs,
                     session=session,
@@ -72,7 +78,9 @@ def gradio_ui(kubin: Kubin, start_fn):
 
             with gr.TabItem("Inpainting", id=3) as inpaint_tabitem:
                 inpaint_ui(
-                    generate_fn=lambda params: kubin.model.inpaint(params),
+                    generate_fn=with_progress_session(
+                        lambda params: kubin.scheduler.run("inpaint", params)
+                    ),
                     shared=ui_shared,
                     tabs=ui_tabs,
                     session=session,
@@ -80,7 +88,9 @@ def gradio_ui(kubin: Kubin, start_fn):
 
             with gr.TabItem("Outpainting", id=4) as outpaint_tabitem:
                 outpaint_ui(
-                    generate_fn=lambda params: kubin.model.outpaint(params),
+                    generate_fn=with_progress_session(
+                        lambda params: kubin.scheduler.run("outpaint", params)
+                    ),
                     shared=ui_shared,
                     tabs=ui_tabs,
                     session=session,
@@ -89,7 +99,9 @@ def gradio_ui(kubin: Kubin, start_fn):
             with gr.TabItem("Text To Video", id=5) as t2v_tabitem:
                 with gr.Column(elem_classes=["t2v-kd4-container", "unsupported_50"]) as t2v_kd4_block:
                     t2v_kd4_ui(
-                        generate_fn=lambda params: kubin.model.t2v(params),
+                        generate_fn=with_progress_session(
+                            lambda params: kubin.scheduler.run("t2v", params)
+                        ),
                         shared=ui_shared,
                         tabs=ui_tabs,
                         session=session,
@@ -97,7 +109,9 @@ def gradio_ui(kubin: Kubin, start_fn):
 
                 with gr.Column(elem_classes=["t2v-kd5-container", "unsupported_20", "unsupported_21", "unsupported_d21", "unsupported_22", "unsupported_d22", "unsupported_30", "unsupported_d30", "unsupported_31", "unsupported_40"]) as t2v_kd5_block:
                     t2v_kd5_ui(
-                        generate_fn=lambda params: kubin.model.t2v(params),
+                        generate_fn=with_progress_session(
+                            lambda params: kubin.scheduler.run("t2v", params)
+                        ),
                         shared=ui_shared,
                         tabs=ui_tabs,
                         session=session,
@@ -105,7 +119,9 @@ def gradio_ui(kubin: Kubin, start_fn):
 
             with gr.TabItem("Image To Video", id=6) as i2v_tabitem:
                 i2v_ui(
-                    generate_fn=lambda params: kubin.model.i2v(params),
+                    generate_fn=with_progress_session(
+                        lambda params: kubin.scheduler.run("i2v", params)
+                    ),
                     shared=ui_shared,
                     tabs=ui_tabs,
                     session=session,
@@ -113,7 +129,9 @@ def gradio_ui(kubin: Kubin, start_fn):
 
             with gr.TabItem("Video To Audio", id=7) as v2a_tabitem:
                 v2a_ui(
-                    generate_fn=lambda params: kubin.model.v2a(params),
+                    generate_fn=with_progress_session(
+                        lambda params: kubin.scheduler.run("v2a", params)
+                    ),
                     shared=ui_shared,
                     tabs=ui_tabs,
                     session=session,
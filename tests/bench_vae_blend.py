@@ -0,0 +1,60 @@
+"""
+Times the VAE tile seam blending against the per-slice loops it replaced.
+
+    python tests/bench_vae_blend.py --device cuda --dtype bfloat16
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+from models.model_50.models.vae import blend_tiles
+from test_vae_blend import LOOPS
+
+# decoded tiles of a 768x512 generation: 256 pixel tiles blended over 64
+# pixels, 16 frame temporal tiles over 4
+CASES = [
+    ("v", -2, (1, 3, 33, 320, 320), 64),
+    ("h", -1, (1, 3, 33, 320, 320), 64),
+    ("t", -3, (1, 3, 17, 512, 768), 4),
+]
+
+
+def timed(fn, device, runs):
+    synchronize = torch.cuda.synchronize if device.type == "cuda" else (lambda: None)
+    fn()
+    synchronize()
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    synchronize()
+    return (time.perf_counter() - start) / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VAE tile blending")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--dtype", type=str, default="float32")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+    for name, dim, shape, blend_extent in CASES:
+        a = torch.randn(shape, device=device).to(dtype)
+        b = torch.randn(shape, device=device).to(dtype)
+        loop = timed(lambda: LOOPS[dim](a, b, blend_extent), device, args.runs)
+        ramp = timed(lambda: blend_tiles(a, b, blend_extent, dim), device, args.runs)
+        print(
+            f"blend_{name} {tuple(shape)}, extent {blend_extent}: loop {loop * 1000:.2f} ms, ramp {ramp * 1000:.2f} ms ({loop / ramp:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import math
+
+import pytest
+import torch
+
+from models.model_40.kandinsky_4.attention import (
+    standard_flash_attn_varlen_qkvpacked_func_replacement as varlen_attention,
+)
+
+HEADS = 4
+HEAD_DIM = 16
+
+
+def packed_qkv(seqlens, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    qkv = torch.randn(sum(seqlens), 3, HEADS, HEAD_DIM, generator=generator)
+    cu_seqlens = torch.tensor([0] + seqlens).cumsum(0).to(torch.int32)
+    return qkv, cu_seqlens
+
+
+def reference(qkv, cu_seqlens, causal):
+    # every sequence on its own, in float64
+    out, lse = [], []
+    for start, end in zip(cu_seqlens[:-1].tolist(), cu_seqlens[1:].tolist()):
+        if end == start:
+            continue
+        q, k, v = qkv[start:end].double().unbind(1)
+        scores = torch.einsum("qhd,khd->hqk", q, k) / math.sqrt(HEAD_DIM)
+        if causal:
+            length = end - start
+            mask = torch.ones(length, length, dtype=torch.bool).tril()
+            scores = scores.masked_fill(~mask, float("-inf"))
+        out.append(torch.einsum("hqk,khd->qhd", scores.softmax(-1), v))
+        lse.append(scores.logsumexp(-1).transpose(0, 1))
+    return torch.cat(out), torch.cat(lse)
+
+
+@pytest.mark.parametrize(
+    "seqlens",
+    [[16, 16, 16], [5, 17, 9, 1], [7, 0, 12], [4, 9, 0]],
+    ids=["equal", "unequal", "empty-inner", "empty-trailing"],
+)
+@pytest.mark.parametrize("causal", [False, True], ids=["full", "causal"])
+def test_matches_per_sequence_reference(seqlens, causal):
+    qkv, cu_seqlens = packed_qkv(seqlens)
+    out, lse, _ = varlen_attention(qkv, cu_seqlens, max(seqlens), causal=causal)
+    expected_out, expected_lse = reference(qkv, cu_seqlens, causal)
+
+    assert out.shape == (sum(seqlens), HEADS, HEAD_DIM)
+    assert lse.shape == (sum(seqlens), HEADS)
+    torch.testing.assert_close(out.double(), expected_out, rtol=1e-5, atol=1e-5)
+    torch.testing.assert_close(lse.double(), expected_lse, rtol=1e-5, atol=1e-5)
+
+
+def test_heads_first_packing_without_lse():
+    qkv, cu_seqlens = packed_qkv([6, 10])
+    out, lse, _ = varlen_attention(
+        qkv.transpose(1, 2),  # (total, heads, 3, dim)
+        cu_seqlens,
+        10,
+        return_softmax_lse=False,
+    )
+    expected_out, _ = reference(qkv, cu_seqlens, causal=False)
+
+    assert lse is None
+    torch.testing.assert_close(out.double(), expected_out, rtol=1e-5, atol=1e-5)
@@ -0,0 +1,32 @@
+import pytest
+import torch
+
+pytest.importorskip("safetensors")
+
+from models.model_50.prompt_cache import PromptEmbeddingCache
+
+
+def entry():
+    embeds = {"text_embeds": torch.randn(5, 8), "pooled_embed": torch.randn(1, 4)}
+    return embeds, torch.tensor([0, 5], dtype=torch.int32)
+
+
+def test_persisted_entry_is_reloaded(tmp_path):
+    PromptEmbeddingCache(2**20, str(tmp_path)).put("a cat", "video", entry())
+
+    cache = PromptEmbeddingCache(2**20, str(tmp_path))
+    assert cache.contains("a cat", "video")
+    embeds, cu_seqlens = cache.get("a cat", "video")
+    assert embeds["text_embeds"].shape == (5, 8)
+    assert cu_seqlens.tolist() == [0, 5]
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_unreadable_entry_is_not_reported_as_cached(tmp_path):
+    cache = PromptEmbeddingCache(2**20, str(tmp_path))
+    with open(cache._path(cache.key("a cat", "video")), "wb") as file:
+        file.write(b"not a safetensors file")
+
+    assert not cache.contains("a cat", "video")
+    assert cache.get("a cat", "video") is None
+    assert (cache.hits, cache.misses) == (0, 1)
@@ -0,0 +1,166 @@
+import os
+import socket
+
+import pytest
+import torch
+import torch.multiprocessing as mp
+
+pytest.importorskip("omegaconf")
+pytest.importorskip("safetensors")
+pytest.importorskip("huggingface_hub")
+pytest.importorskip("requests")
+
+from omegaconf import OmegaConf
+from safetensors.torch import save_file
+
+os.environ["KD5_DISABLE_COMPILE"] = "1"
+os.environ["KD5_ATTENTION_MODE"] = "sdpa"
+
+from models.model_50.generation_utils import denoise
+from models.model_50.models.dit import get_dit
+from models.model_50.utils import load_dit
+
+WORLD_SIZE = 2
+TEXT_DIM = 24
+POOLED_DIM = 16
+
+
+class FakeKubin:
+    def __init__(self, cache_dir):
+        self.general = {"device": "cpu", "cache_dir": cache_dir}
+
+    def params(self, section, key):
+        assert section == "general"
+        return self.general[key]
+
+
+def tiny_conf(checkpoint_path):
+    return OmegaConf.create(
+        {
+            "model": {
+                "checkpoint_path": checkpoint_path,
+                "dit_params": {
+                    "in_visual_dim": 4,
+                    "out_visual_dim": 4,
+                    "time_dim": 32,
+                    "patch_size": [1, 2, 2],
+                    "model_dim": 64,
+                    "ff_dim": 128,
+                    "num_text_blocks": 1,
+                    "num_visual_blocks": 2,
+                    "axes_dims": [4, 6, 6],
+                    "visual_cond": False,
+                    "in_text_dim": TEXT_DIM,
+                    "in_text_dim2": POOLED_DIM,
+                },
+                "attention": {"type": "flash"},
+            },
+            "metrics": {"scale_factor": [1.0, 1.0, 1.0]},
+            "optimizations": {"use_fused_qkv": True},
+        }
+    )
+
+
+def denoise_args():
+    generator = torch.Generator().manual_seed(0)
+
+    def embeds(length):
+        return {
+            "text_embeds": torch.randn(
+                length, TEXT_DIM, generator=generator
+            ).bfloat16(),
+            "pooled_embed": torch.randn(1, POOLED_DIM, generator=generator).bfloat16(),
+        }
+
+    return dict(
+        shape=(1, 3, 8, 8, 4),
+        num_steps=3,
+        text_embeds=embeds(6),
+        null_text_embeds=embeds(4),
+        text_length=6,
+        null_text_length=4,
+        guidance_weight=5.0,
+        scheduler_scale=5.0,
+        seed=7,
+    )
+
+
+def bf16_autocast():
+    # denoise only autocasts on CUDA, the DiT blocks expect bf16 activations
+    return torch.autocast(device_type="cpu", dtype=torch.bfloat16)
+
+
+def run_rank(rank, conf, port, output_path):
+    os.environ.update(
+        LOCAL_RANK=str(rank),
+        RANK=str(rank),
+        WORLD_SIZE=str(WORLD_SIZE),
+        MASTER_ADDR="127.0.0.1",
+        MASTER_PORT=str(port),
+    )
+    torch.set_grad_enabled(False)
+
+    from models.model_50 import distributed
+    from models.model_50.models.parallelize import parallelize_dit
+
+    if rank > 0:
+        with bf16_autocast():
+            distributed.serve(FakeKubin(conf.model.checkpoint_path))
+        return
+
+    device = torch.device("cpu")
+    mesh = distributed.init_tp_mesh(device)
+    distributed.send_command(
+        "load",
+        conf=OmegaConf.to_container(conf, resolve=True),
+        use_torch_compile_dit=False,
+        use_torch_compile_vae=False,
+        use_flash_attention=False,
+    )
+    dit = load_dit(conf, device)
+    dit = parallelize_dit(dit, mesh["tensor_parallel"])
+    assert dit.visual_transformer_blocks[0].self_attention.num_heads == 2
+
+    args = denoise_args()
+    distributed.send_command("denoise", **args)
+    with bf16_autocast():
+        latents = denoise(dit, conf, device, **args)
+    distributed.stop_workers()
+    torch.save(latents, output_path)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_tensor_parallel_denoise_matches_single_process(tmp_path):
+    conf = tiny_conf(str(tmp_path))
+    torch.manual_seed(0)
+    dit = get_dit(conf.model.dit_params)
+    save_file(
+        {
+            name: value.to(torch.bfloat16).contiguous()
+            for name, value in dit.state_dict().items()
+        },
+        str(tmp_path / "model.safetensors"),
+    )
+
+    with torch.no_grad(), bf16_autocast():
+        expected = denoise(
+            load_dit(conf, torch.device("cpu")),
+            conf,
+            torch.device("cpu"),
+            **denoise_args()
+        )
+
+    output_path = str(tmp_path / "rank0.pt")
+    mp.spawn(
+        run_rank, args=(conf, free_port(), output_path), nprocs=WORLD_SIZE, join=True
+    )
+    latents = torch.load(output_path)
+
+    assert latents.shape == expected.shape
+    # the shards sum their partial products in another order, in bf16
+    torch.testing.assert_close(latents, expected, rtol=2e-2, atol=2e-2)
@@ -0,0 +1,84 @@
+import pytest
+import torch
+
+pytest.importorskip("diffusers")
+
+from models.model_50.models.vae import blend_tiles
+
+
+# the per-slice loops blend_tiles replaced
+def loop_blend_v(a, b, blend_extent):
+    blend_extent = min(a.shape[-2], b.shape[-2], blend_extent)
+    for y in range(blend_extent):
+        b[:, :, :, y, :] = a[:, :, :, -blend_extent + y, :] * (
+            1 - y / blend_extent
+        ) + b[:, :, :, y, :] * (y / blend_extent)
+    return b
+
+
+def loop_blend_h(a, b, blend_extent):
+    blend_extent = min(a.shape[-1], b.shape[-1], blend_extent)
+    for x in range(blend_extent):
+        b[:, :, :, :, x] = a[:, :, :, :, -blend_extent + x] * (
+            1 - x / blend_extent
+        ) + b[:, :, :, :, x] * (x / blend_extent)
+    return b
+
+
+def loop_blend_t(a, b, blend_extent):
+    blend_extent = min(a.shape[-3], b.shape[-3], blend_extent)
+    for x in range(blend_extent):
+        b[:, :, x, :, :] = a[:, :, -blend_extent + x, :, :] * (
+            1 - x / blend_extent
+        ) + b[:, :, x, :, :] * (x / blend_extent)
+    return b
+
+
+LOOPS = {-2: loop_blend_v, -1: loop_blend_h, -3: loop_blend_t}
+
+
+def ulp_distance(x, y):
+    # distance in representable values, via the ordered integer encoding
+    int_dtype = {torch.float32: torch.int32, torch.bfloat16: torch.int16}[x.dtype]
+    x, y = x.view(int_dtype).long(), y.view(int_dtype).long()
+    sign_bit = 1 << (8 * x.element_size() - 1)
+    x = torch.where(x < 0, -sign_bit - x, x)
+    y = torch.where(y < 0, -sign_bit - y, y)
+    return (x - y).abs()
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16])
+@pytest.mark.parametrize("dim", [-1, -2, -3], ids=["h", "v", "t"])
+@pytest.mark.parametrize("blend_extent", [1, 4, 7, 64])
+def test_matches_loop(dtype, dim, blend_extent):
+    generator = torch.Generator().manual_seed(blend_extent)
+    a = torch.randn(1, 3, 9, 12, 16, generator=generator).to(dtype)
+    b = torch.randn(1, 3, 9, 12, 16, generator=generator).to(dtype)
+
+    expected = LOOPS[dim](a, b.clone(), blend_extent)
+    result = blend_tiles(a, b.clone(), blend_extent, dim=dim)
+
+    assert result.dtype == dtype
+    assert ulp_distance(result, expected).max().item() <= 1
+
+
+def test_blends_in_place_and_keeps_the_rest():
+    a = torch.randn(1, 3, 4, 8, 8)
+    b = torch.randn(1, 3, 4, 8, 8)
+    original = b.clone()
+
+    result = blend_tiles(a, b, 3, dim=-1)
+
+    assert result is b
+    torch.testing.assert_close(b[..., 3:], original[..., 3:], rtol=0, atol=0)
+    torch.testing.assert_close(b[..., 0], a[..., -3], rtol=0, atol=0)
+
+
+def test_zero_extent_is_a_no_op():
+    a = torch.randn(1, 3, 4, 8, 8)
+    b = torch.randn(1, 3, 4, 8, 8)
+    original = b.clone()
+
+    blend_tiles(a, b, 0, dim=-2)
+
+    torch.testing.assert_close(b, original, rtol=0, atol=0)